@@ -0,0 +1,108 @@
+"""
+Inference backends of the website classifier, chosen with CLASSIFIER_BACKEND:
+- fp32: the BertForSequenceClassification model as trained
+- int8: the same model with its Linear layers dynamically quantized to int8 (torch.ao.quantization)
+- onnx: the model exported to ONNX and run by onnxruntime on the CPU
+- onnx-int8: the ONNX graph with its weights quantized to int8 by onnxruntime
+The ONNX graphs are exported next to the model (model.onnx, model-int8.onnx) the first time they're used, then
+reused: delete them when the model is retrained. onnxruntime and onnx are only needed for the onnx backends
+(pip install onnxruntime onnx).
+Each backend takes the padded features of a batch and returns its logits as a numpy array.
+"""
+import os
+import warnings
+
+import numpy as np
+import torch
+
+BACKENDS = ('fp32', 'int8', 'onnx', 'onnx-int8')
+INPUT_NAMES = ['input_ids', 'attention_mask', 'token_type_ids']
+
+
+class TorchBackend:
+    """
+    A PyTorch classifier (fp32, or dynamically quantized to int8).
+    """
+    tensors = 'pt' # What tokenizer.pad() returns for this backend
+
+    def __init__(self, model, name: str = 'fp32'):
+        self.model = model.eval()
+        self.name = name
+
+    def __call__(self, features) -> np.ndarray:
+        with torch.inference_mode():
+            return self.model(**features).logits.float().numpy()
+
+
+class OnnxBackend:
+    """
+    An exported ONNX graph run by onnxruntime.
+    """
+    tensors = 'np'
+
+    def __init__(self, path: str, threads: int = 0, name: str = 'onnx'):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads # 0: onnxruntime's default, one per core
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.inputs = [node.name for node in self.session.get_inputs()]
+        self.name = name
+
+    def __call__(self, features) -> np.ndarray:
+        return self.session.run(None, {name: np.asarray(features[name], dtype=np.int64) for name in self.inputs})[0]
+
+
+def export_onnx(model, path: str):
+    """
+    Export a BertForSequenceClassification to ONNX, with a dynamic batch size and sequence length.
+    Args:
+        model: The model
+        path: The .onnx file
+    """
+    example = torch.ones((2, 16), dtype=torch.long)
+    axes = {name: {0: 'batch', 1: 'sequence'} for name in INPUT_NAMES}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # The tracer warns about every Python condition of the model
+        torch.onnx.export(model.eval(), (example, example, torch.zeros_like(example)), path, input_names=INPUT_NAMES,
+                          output_names=['logits'], dynamic_axes={**axes, 'logits': {0: 'batch'}}, opset_version=17,
+                          dynamo=False)
+
+
+def load_backend(name: str, model_dir: str, threads: int = 0, local_files_only: bool = False):
+    """
+    Load the classifier with a backend.
+    Args:
+        name: One of BACKENDS
+        model_dir: The directory of the trained model (website_classifier_model)
+        threads: The number of CPU threads of the inference, 0 to keep the runtime's default
+        local_files_only: Don't look anything up online (offline mode)
+
+    Returns: TorchBackend or OnnxBackend: The backend
+
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {', '.join(BACKENDS)}")
+    onnx_path = os.path.join(model_dir, 'model.onnx')
+    quantized_path = os.path.join(model_dir, 'model-int8.onnx')
+    if name == 'onnx' and os.path.exists(onnx_path) or name == 'onnx-int8' and os.path.exists(quantized_path):
+        return OnnxBackend(onnx_path if name == 'onnx' else quantized_path, threads, name)
+
+    from transformers import BertForSequenceClassification
+    if threads:
+        torch.set_num_threads(threads)
+    model = BertForSequenceClassification.from_pretrained(model_dir, local_files_only=local_files_only).eval()
+    if name == 'fp32':
+        return TorchBackend(model)
+    if name == 'int8':
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore') # torch.ao.quantization is deprecated in favour of torchao
+            return TorchBackend(torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8),
+                                'int8')
+    if not os.path.exists(onnx_path):
+        export_onnx(model, onnx_path)
+    if name == 'onnx-int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+        return OnnxBackend(quantized_path, threads, name)
+    return OnnxBackend(onnx_path, threads, name)
@@ -0,0 +1,134 @@
+"""
+Dynamic micro-batching for the website classifier.
+Concurrent requests are queued and grouped into batches (up to max_batch_size texts, or whatever arrived within
+max_wait_ms of the first one). A batch is tokenized in one call, sorted by length and split into buckets of
+similar lengths so short pages aren't padded to the length of the longest one. Each bucket runs in one forward
+pass of the inference backend (backends.py), and its results are handed out as soon as the pass is done.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from backends import TorchBackend
+
+
+class MicroBatcher:
+    """
+    Runs the model on batches of queued texts in a background thread.
+    """
+    def __init__(self, model, tokenizer, max_batch_size: int = 32, max_wait_ms: float = 10, max_length: int = 512,
+                 padding_slack: float = 1.2):
+        """
+        Args:
+            model: The inference backend (backends.py), or a BertForSequenceClassification model to run in fp32
+            tokenizer: The tokenizer of the model
+            max_batch_size: The maximum number of texts per batch
+            max_wait_ms: How long the first text of a batch waits for others, in milliseconds
+            max_length: The number of tokens kept per text (the rest is truncated)
+            padding_slack: The maximum ratio of padded to real tokens in a bucket
+        """
+        self.model = model if hasattr(model, 'tensors') else TorchBackend(model)
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_length = max_length
+        self.padding_slack = padding_slack
+        self.batches = 0
+        self.items = 0
+        self.forward_passes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='classifier-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        Queue a text.
+        Returns: Future: Resolves to the logits of the text (np.ndarray)
+
+        """
+        future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def predict(self, texts: list) -> np.ndarray:
+        """
+        Queue texts and wait for their logits.
+        Args:
+            texts: The texts
+
+        Returns: np.ndarray: The logits, one row per text
+
+        """
+        futures = [self.submit(text) for text in texts]
+        return np.stack([future.result() for future in futures])
+
+    def stats(self) -> dict:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'forward_passes': self.forward_passes,
+            'mean_batch_size': round(self.items / self.batches, 2) if self.batches else None,
+        }
+
+    def _next_batch(self) -> list:
+        # Block for the first text, then take what arrives until the batch is full or the wait is over
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self._forward(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+    def buckets(self, lengths: np.ndarray) -> list:
+        """
+        Split texts into buckets of similar lengths: sorted by length, a bucket is closed when padding the next text
+        would make it more than padding_slack times its real tokens.
+        Args:
+            lengths: The number of tokens of each text
+
+        Returns: list: The rows of each bucket
+
+        """
+        buckets, bucket, tokens = [], [], 0
+        for row in np.argsort(lengths, kind='stable').tolist():
+            if bucket and (len(bucket) + 1) * lengths[row] > self.padding_slack * (tokens + lengths[row]):
+                buckets.append(bucket)
+                bucket, tokens = [], 0
+            bucket.append(row)
+            tokens += lengths[row]
+        return buckets + [bucket]
+
+    def _forward(self, batch: list):
+        """
+        Tokenize the texts of a batch together and run them through the model, one forward pass per bucket.
+        """
+        encoded = self.tokenizer([text for text, _ in batch], truncation=True, max_length=self.max_length)
+        lengths = np.array([len(ids) for ids in encoded['input_ids']])
+        for rows in self.buckets(lengths):
+            features = self.tokenizer.pad(
+                [{key: values[row] for key, values in encoded.items()} for row in rows], return_tensors=self.model.tensors)
+            logits = self.model(features)
+            self.forward_passes += 1
+            for row, row_logits in zip(rows, logits):
+                batch[row][1].set_result(row_logits)
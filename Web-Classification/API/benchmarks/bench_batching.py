@@ -0,0 +1,130 @@
+"""
+Throughput and latency of the classifier with one forward pass per request (the previous predict()) and with
+the micro-batcher (batcher.py), at 1, 8 and 32 concurrent clients. The clients call the inference directly,
+without the page fetch and the HTTP layer, on synthetic preprocessed texts of mixed lengths.
+The two modes must predict the same labels.
+
+--random-model runs a randomly initialized bert-base classifier with a synthetic vocabulary, when the
+trained website_classifier_model isn't available: the speed is the same, the labels are meaningless.
+
+Usage: python benchmarks/bench_batching.py [--requests 64] [--clients 1 8 32] [--random-model]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import torch
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from batcher import MicroBatcher
+
+WORDS = ['ordin', 'portabl', 'clavi', 'souri', 'écran', 'livr', 'roman', 'auteur', 'chien', 'chat', 'croquet',
+         'voyag', 'hôtel', 'vol', 'séjour', 'crème', 'visag', 'pharmac', 'vitamin', 'promo', 'livraison', 'gratuit',
+         'prix', 'stock', 'marqu', 'catalogu', 'contact', 'compt', 'panier', 'command']
+
+
+def random_model(directory: str, num_labels: int = 6):
+    """
+    A bert-base classifier with random weights and a tokenizer over a synthetic vocabulary.
+    """
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + WORDS + [f'##{i}' for i in range(100)]
+    vocab_file = os.path.join(directory, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(vocab))
+    torch.manual_seed(0)
+    model = BertForSequenceClassification(BertConfig(vocab_size=len(vocab), num_labels=num_labels))
+    return model, BertTokenizerFast(vocab_file=vocab_file, model_max_length=512)
+
+
+def synthetic_texts(count: int, seed: int = 0) -> list:
+    # Preprocessed pages: bags of stemmed words, from a few words to more than the 512 tokens kept
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.choice([20, 60, 150, 300, 700]))) for _ in range(count)]
+
+
+def previous_predict(model, tokenizer, content: str) -> np.ndarray:
+    # predict() before the batcher: one padded sequence per request, eval() on every call
+    tokenized_content = tokenizer(content, padding=True, truncation=True, return_tensors='pt')
+    model.eval()
+    with torch.no_grad():
+        return model(**tokenized_content).logits.numpy()[0]
+
+
+def run_clients(predict, texts: list, clients: int) -> tuple:
+    """
+    Send the texts from concurrent clients, each one waiting for its answer before sending the next text.
+    Returns: tuple: The logits of each text, the latencies and the wall time
+
+    """
+    logits, latencies = [None] * len(texts), []
+    lock = threading.Lock()
+
+    def client(indexes):
+        for index in indexes:
+            start = time.perf_counter()
+            logits[index] = predict(texts[index])
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client, args=(range(offset, len(texts), clients),)) for offset in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.stack(logits), latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--model', default='website_classifier_model')
+    parser.add_argument('--tokenizer', default='website_classifier_tokenizer')
+    parser.add_argument('--random-model', action='store_true')
+    parser.add_argument('--max-batch', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    if args.random_model:
+        model, tokenizer = random_model(directory)
+    else:
+        model = BertForSequenceClassification.from_pretrained(args.model)
+        tokenizer = BertTokenizerFast.from_pretrained(args.tokenizer)
+    model.eval()
+    batcher = MicroBatcher(model, tokenizer, max_batch_size=args.max_batch, max_wait_ms=args.max_wait_ms)
+    texts = synthetic_texts(args.requests)
+    previous_predict(model, tokenizer, texts[0]) # Warm up
+
+    print(f"{args.requests} requests, {torch.get_num_threads()} torch threads")
+    print(f"{'clients':>7}  {'mode':<9} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8}  forward passes")
+    failures = 0
+    for clients in args.clients:
+        results = {}
+        for mode, predict in (('previous', lambda text: previous_predict(model, tokenizer, text)),
+                              ('batched', lambda text: batcher.submit(text).result())):
+            passes = batcher.forward_passes
+            logits, latencies, wall = run_clients(predict, texts, clients)
+            results[mode] = logits
+            latencies.sort()
+            print(f"{clients:>7}  {mode:<9} {len(texts) / wall:7.2f} {statistics.median(latencies) * 1000:8.0f} "
+                  f"{latencies[int(0.95 * (len(latencies) - 1))] * 1000:8.0f}  "
+                  f"{len(texts) if mode == 'previous' else batcher.forward_passes - passes}")
+        if not np.array_equal(results['previous'].argmax(axis=1), results['batched'].argmax(axis=1)):
+            failures += 1
+            print(f"FAILED: the batched predictions differ at {clients} clients "
+                  f"(max logit difference {np.abs(results['previous'] - results['batched']).max():.2e})")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Re-run a list of websites through POST /classify/batch with the result cache (result_cache.py), the way lists like
+cleaned_results.csv are re-run:
+- cold: empty cache, every page fetched and classified
+- within TTL: answered from the cache, nothing fetched
+- TTL expired: every page fetched and preprocessed again, the model runs only for the pages whose text changed
+  (a quarter of them here)
+- restart: a new process with the SQLite tier (CLASSIFIER_CACHE_DB), the memory tier empty.
+The sample pages (benchmarks/sample_pages.py) are served by replacing fetch_page with a lookup, each taking
+--fetch-ms like a real fetch. --random-model runs a randomly initialized bert-base when website_classifier_model
+isn't available.
+
+Usage: python benchmarks/bench_cache.py [--spacy-model fr_core_news_lg] [--random-model] [--fetch-ms 200]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_startup import API, fill_stopwords, save_random_model
+from sample_pages import VOCABULARY, sample_page, sample_pages
+
+
+def run(client, main, urls: list, batch_size: int = 16) -> dict:
+    # One pass over the list: the seconds, the cache outcome of each URL and the texts run through the model
+    items = main.resource('batcher').items
+    outcomes = {}
+    start = time.perf_counter()
+    for batch in range(0, len(urls), batch_size):
+        response = client.post('/classify/batch', json={'urls': urls[batch:batch + batch_size]})
+        for result in response.json['results']:
+            outcomes[result.get('cache', 'error')] = outcomes.get(result.get('cache', 'error'), 0) + 1
+    return {'seconds': time.perf_counter() - start, 'outcomes': outcomes,
+            'inferred': main.resource('batcher').items - items}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spacy-model', default='fr_core_news_lg')
+    parser.add_argument('--random-model', action='store_true')
+    parser.add_argument('--fetch-ms', type=float, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    if args.random_model:
+        model_dir, tokenizer_dir = save_random_model(directory)
+    else:
+        model_dir, tokenizer_dir = (os.path.join(API, 'website_classifier_model'),
+                                    os.path.join(API, 'website_classifier_tokenizer'))
+    fill_stopwords(os.path.join(directory, 'resources', 'nltk_data'))
+    cache_db = os.path.join(directory, 'cache.sqlite')
+    os.environ.update(CLASSIFIER_RESOURCE_DIR=os.path.join(directory, 'resources'),
+                      CLASSIFIER_SPACY_MODEL=args.spacy_model, CLASSIFIER_MODEL_DIR=model_dir,
+                      CLASSIFIER_TOKENIZER_DIR=tokenizer_dir,
+                      CLASSIFIER_LABEL_ENCODER=os.path.join(os.path.dirname(API), 'label_encoder.pkl'),
+                      CLASSIFIER_OFFLINE='1', HF_HUB_OFFLINE='1', CLASSIFIER_CACHE_DB=cache_db)
+    import main
+    from result_cache import ResultCache
+
+    pages = {f'{name.lower()}.example': html for name, html in sample_pages()}
+    urls = [f'https://www.{domain}/' for domain in pages]
+
+    def fetch_page(url):
+        time.sleep(args.fetch_ms / 1000)
+        return pages.get(main.normalize_domain(url))
+
+    main.fetch_page = fetch_page
+    client = main.app.test_client()
+    main.resources.get('warmup')
+    print(f"{len(urls)} websites, fetch {args.fetch_ms:.0f} ms, {args.spacy_model}")
+
+    passes = [('cold', run(client, main, urls)), ('within TTL', run(client, main, urls))]
+    main.result_cache.ttl_s = 0
+    for position, domain in enumerate(pages):
+        if position % 4 == 0: # The site changed
+            name, size, seed = domain.split('.')[0].split('-')
+            category = next(category for category in VOCABULARY if category.lower() == name)
+            pages[domain] = sample_page(category, int(size), int(seed) + 100)
+    passes.append(('TTL expired', run(client, main, urls)))
+    stats = client.get('/cache/stats').json
+    main.result_cache = ResultCache(ttl_s=7 * 86400, sqlite_path=cache_db)
+    passes.append(('restart', run(client, main, urls)))
+
+    print(f"{'pass':<14}{'seconds':>9}{'ms/site':>9}{'inferred':>10}  cache")
+    for name, result in passes:
+        outcomes = ', '.join(f'{outcome} {count}' for outcome, count in sorted(result['outcomes'].items()))
+        print(f"{name:<14}{result['seconds']:9.2f}{result['seconds'] * 1000 / len(urls):9.1f}"
+              f"{result['inferred']:10d}  {outcomes}")
+    print(f"\nGET /cache/stats before the restart: {stats}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+pipeline.py against the Flask predict() endpoint called one URL at a time, offline: the sample pages are served by
+the local stand-in (benchmarks/page_server.py) with --delay-ms per page, one loopback host per page.
+- one at a time: GET /?url= for the first --baseline URLs, extrapolated to the list
+- pipeline: the whole list, with the per-stage report of the CLI
+- resume: the pipeline killed halfway through, then run again with --resume; every URL must be in the output
+  once, with the label of the uninterrupted run.
+--random-model runs a randomly initialized bert-base when website_classifier_model isn't available.
+
+Usage: python benchmarks/bench_pipeline.py [--spacy-model fr_core_news_lg] [--random-model] [--seeds 4] [--delay-ms 1000]
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_startup import API, fill_stopwords, save_random_model
+from page_server import load_pages, serve, write_csv
+
+ONE_AT_A_TIME = r"""
+import csv, sys, time
+import main
+urls = [row['URL'] for row in csv.DictReader(open(sys.argv[1]))][:int(sys.argv[2])]
+client = main.app.test_client()
+main.resources.get('warmup')
+start = time.perf_counter()
+for url in urls:
+    client.get('/', query_string={'url': url})
+print((time.perf_counter() - start) / len(urls))
+"""
+
+
+def pipeline(args: list, env: dict) -> subprocess.Popen:
+    # In its own process group, to kill it with its preprocessing workers
+    return subprocess.Popen([sys.executable, 'pipeline.py'] + args, cwd=API, env=env, stderr=subprocess.PIPE, text=True,
+                            start_new_session=True)
+
+
+def read_results(path: str) -> dict:
+    with open(path) as f:
+        rows = [json.loads(line) for line in f]
+    labels = {row['url']: row.get('predicted_label', row.get('error')) for row in rows}
+    if len(labels) != len(rows):
+        raise AssertionError(f"{len(rows) - len(labels)} URLs written twice in {path}")
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spacy-model', default='fr_core_news_lg')
+    parser.add_argument('--random-model', action='store_true')
+    parser.add_argument('--seeds', type=int, default=4, help='Sample pages of each category and size')
+    parser.add_argument('--delay-ms', type=float, default=1000)
+    parser.add_argument('--baseline', type=int, default=12, help='URLs classified one at a time')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    if args.random_model:
+        model_dir, tokenizer_dir = save_random_model(directory)
+    else:
+        model_dir, tokenizer_dir = (os.path.join(API, 'website_classifier_model'),
+                                    os.path.join(API, 'website_classifier_tokenizer'))
+    fill_stopwords(os.path.join(directory, 'resources', 'nltk_data'))
+    env = dict(os.environ, CLASSIFIER_RESOURCE_DIR=os.path.join(directory, 'resources'),
+               CLASSIFIER_SPACY_MODEL=args.spacy_model, CLASSIFIER_MODEL_DIR=model_dir,
+               CLASSIFIER_TOKENIZER_DIR=tokenizer_dir,
+               CLASSIFIER_LABEL_ENCODER=os.path.join(os.path.dirname(API), 'label_encoder.pkl'),
+               CLASSIFIER_OFFLINE='1', HF_HUB_OFFLINE='1', CLASSIFIER_CACHE='0', NO_PROXY='*')
+    pages = load_pages(seeds=args.seeds)
+    server = serve(pages, delay_ms=args.delay_ms)
+    urls_csv = os.path.join(directory, 'urls.csv')
+    write_csv(urls_csv, pages, server.server_address[1])
+    print(f"{len(pages)} websites served with {args.delay_ms:.0f} ms per page, {args.spacy_model}")
+
+    child = subprocess.run([sys.executable, '-c', ONE_AT_A_TIME, urls_csv, str(args.baseline)], cwd=API, env=env,
+                           capture_output=True, text=True)
+    if child.returncode:
+        raise RuntimeError(child.stderr[-3000:])
+    per_url = float(child.stdout.strip().splitlines()[-1])
+    print(f"one at a time: {per_url * 1000:.0f} ms/URL, {per_url * len(pages):.1f}s for the list (extrapolated)")
+
+    common = ['--workers', str(args.workers), '--report-every', '5']
+    full = os.path.join(directory, 'full.jsonl')
+    run = pipeline([urls_csv, full] + common, env)
+    report = run.communicate()[1]
+    print("pipeline:\n" + '\n'.join(line for line in report.splitlines() if 'busy' in line or 'URLs in' in line))
+
+    resumed = os.path.join(directory, 'resumed.jsonl')
+    run = pipeline([urls_csv, resumed] + common, env)
+    while not os.path.exists(resumed) or sum(1 for _ in open(resumed)) < len(pages) // 2:
+        time.sleep(0.2)
+    os.killpg(run.pid, signal.SIGKILL)
+    run.wait()
+    written = sum(1 for _ in open(resumed))
+    run = pipeline([urls_csv, resumed, '--resume'] + common, env)
+    report = run.communicate()[1]
+    expected, labels = read_results(full), read_results(resumed)
+    print(f"resume: killed after {written} URLs, "
+          + next(line for line in report.splitlines() if 'URLs in' in line))
+    if labels != expected:
+        print(f"FAILED: {len(set(expected) ^ set(labels))} URLs missing or extra, "
+              f"{sum(labels.get(url) != label for url, label in expected.items())} different")
+        sys.exit(1)
+    print("Every URL written once, with the labels of the uninterrupted run")
+
+
+if __name__ == '__main__':
+    main()
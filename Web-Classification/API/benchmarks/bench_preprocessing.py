@@ -0,0 +1,127 @@
+"""
+Time each stage of the classifier preprocessing, the previous fetch_content (full spaCy pipeline, one page
+at a time, the whole page lemmatized) against the lean Preprocessor (preprocessing.py), on the sample pages
+(benchmarks/sample_pages.py), and check that both give BERT the same words.
+
+Usage: python benchmarks/bench_preprocessing.py [--model fr_core_news_lg] [--rounds 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+from nltk.stem import SnowballStemmer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from preprocessing import Preprocessor, load_pipeline
+from sample_pages import sample_pages
+
+BERT_WORDS = 510 # BERT keeps 512 tokens with [CLS] and [SEP], and every word is at least one token
+FRENCH_EXTRA = ["ajout", "pani", "tous", "recherche", "achet", "tnd","wishlist", "span","euro"]
+ENGLISH_EXTRA = ["add", "pani", "all", "search", "buy", "tnd","wishlist"]
+
+
+def load_stopwords() -> tuple:
+    """
+    The stopwords of main.py; spaCy's lists when the NLTK corpus isn't downloaded (the timings don't change).
+    """
+    try:
+        from nltk.corpus import stopwords
+        french, english = set(stopwords.words('french')), set(stopwords.words('english'))
+    except LookupError:
+        from spacy.lang.en.stop_words import STOP_WORDS as english
+        from spacy.lang.fr.stop_words import STOP_WORDS as french
+        print("NLTK stopwords not downloaded, using spaCy's stopword lists")
+        french, english = set(french), set(english)
+    return french | set(FRENCH_EXTRA), english | set(ENGLISH_EXTRA)
+
+
+def previous_preprocess(html, nlp, stemmer, french_stopwords, english_stopwords, timings) -> str:
+    """
+    fetch_content before the lean mode, split in timed stages.
+    """
+    from bs4 import BeautifulSoup
+    start = time.perf_counter()
+    soup = BeautifulSoup(html, 'lxml')
+    metas = soup.find_all("meta")
+    description = (" ".join([meta["content"] if "description" in str(meta) else "" for meta in metas])).strip()
+    for tag in soup(['script', 'style', 'noscript', 'iframe', 'link', 'comment', 'footer', 'header','meta','span']):
+        tag.decompose()
+    combined_text = soup.get_text(separator=' ', strip=True)
+    timings['clean'] += time.perf_counter() - start
+    start = time.perf_counter()
+    filtered_words = [word for word in combined_text.split() if word.lower() not in french_stopwords and word.lower() not in english_stopwords]
+    stemmed_words = {stemmer.stem(word) for word in filtered_words}  # Use a set to remove duplicates
+    timings['stopwords + stem'] += time.perf_counter() - start
+    start = time.perf_counter()
+    doc = nlp(" ".join(stemmed_words).strip()+" "+description)
+    timings['spaCy'] += time.perf_counter() - start
+    start = time.perf_counter()
+    text = (" ".join([token.lemma_ for token in doc if not token.is_stop])).strip()
+    timings['lemmas'] += time.perf_counter() - start
+    return text
+
+
+def lean_preprocess(pages: list, preprocessor: Preprocessor, timings) -> list:
+    """
+    Preprocessor.process_many, split in timed stages.
+    """
+    start = time.perf_counter()
+    cleaned = [preprocessor.clean(html) for html in pages]
+    timings['clean'] += time.perf_counter() - start
+    start = time.perf_counter()
+    stems = [preprocessor.stem(text) for text, _ in cleaned]
+    timings['stopwords + stem'] += time.perf_counter() - start
+    start = time.perf_counter()
+    texts = [preprocessor.spacy_input(page_stems, description) for page_stems, (_, description) in zip(stems, cleaned)]
+    docs = list(preprocessor.nlp.pipe(texts, batch_size=preprocessor.batch_size))
+    timings['spaCy'] += time.perf_counter() - start
+    start = time.perf_counter()
+    results = [preprocessor.lemmas(doc) for doc in docs]
+    timings['lemmas'] += time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model', default='fr_core_news_lg')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    french, english = load_stopwords()
+    stemmer = SnowballStemmer(language='french')
+    start = time.perf_counter()
+    full = load_pipeline(args.model, lean=False)
+    full_load = time.perf_counter() - start
+    start = time.perf_counter()
+    lean = load_pipeline(args.model, lean=True)
+    lean_load = time.perf_counter() - start
+    preprocessor = Preprocessor(lean, stemmer, french | english)
+    pages = [html for _, html in sample_pages()]
+    names = [name for name, _ in sample_pages()]
+    print(f"{len(pages)} pages, {args.model}: full pipeline {full.pipe_names} loaded in {full_load:.2f}s, "
+          f"lean {lean.pipe_names} in {lean_load:.2f}s")
+
+    stages = ('clean', 'stopwords + stem', 'spaCy', 'lemmas')
+    previous_timings, lean_timings = dict.fromkeys(stages, 0.0), dict.fromkeys(stages, 0.0)
+    for _ in range(args.rounds):
+        previous = [previous_preprocess(html, full, stemmer, french, english, previous_timings) for html in pages]
+        current = lean_preprocess(pages, preprocessor, lean_timings)
+
+    print(f"{'stage':<18}{'previous ms/page':>18}{'lean ms/page':>14}")
+    for stage in stages + ('total',):
+        before = sum(previous_timings.values()) if stage == 'total' else previous_timings[stage]
+        after = sum(lean_timings.values()) if stage == 'total' else lean_timings[stage]
+        scale = 1000 / (args.rounds * len(pages))
+        print(f"{stage:<18}{before * scale:18.2f}{after * scale:14.2f}")
+
+    different = [name for name, before, after in zip(names, previous, current)
+                 if before.split()[:BERT_WORDS] != after.split()[:BERT_WORDS]]
+    if different:
+        print(f"FAILED: BERT gets different words on {len(different)} pages: {', '.join(different)}")
+        sys.exit(1)
+    print(f"Same first {BERT_WORDS} words on every page")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Cold start of the classification API: the previous main.py, which loaded every resource one after the other at
+import, against the background loading of resources.py. Each start runs in a fresh process and reports
+- import: the time until main.py is imported
+- health: the time until GET /health answers (the worker can take traffic and pass liveness checks)
+- ready: the time until GET /ready answers 200 (every resource loaded, warmup done)
+- the cold-start trace: when each resource started and finished loading.
+The new API starts with CLASSIFIER_OFFLINE=1 and HF_HUB_OFFLINE=1, from the resource cache of a temporary directory.
+
+--random-model saves a randomly initialized bert-base (same size as the trained one) when
+website_classifier_model isn't available. The NLTK stopwords come from nltk_data, or from spaCy's lists when the
+corpus was never downloaded (the load time is the same).
+
+Usage: python benchmarks/bench_startup.py [--spacy-model fr_core_news_lg] [--random-model] [--rounds 3]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# The previous main.py up to app.run(), timed per resource (without nltk.download, which needs the network)
+PREVIOUS = r"""
+import json, os, time
+start = time.perf_counter()
+trace = {}
+last = [start]
+def timed(name, load):
+    # A resource's load starts where the previous one ended, so its imports count
+    resource = load()
+    end = time.perf_counter()
+    trace[name] = {'state': 'ready', 'start_s': round(last[0] - start, 3), 'end_s': round(end - start, 3),
+                   'seconds': round(end - last[0], 3), 'waited_s': 0.0}
+    last[0] = end
+    return resource
+import nltk, pickle
+from nltk.stem import SnowballStemmer
+from nltk.corpus import stopwords
+nltk.data.path.insert(0, os.environ['CLASSIFIER_RESOURCE_DIR'] + '/nltk_data')
+french = timed('stopwords', lambda: set(stopwords.words('french')) | set(stopwords.words('english')))
+from preprocessing import Preprocessor, load_pipeline
+nlp = timed('nlp', lambda: load_pipeline(os.environ['CLASSIFIER_SPACY_MODEL'], lean=True))
+preprocessor = timed('preprocessor', lambda: Preprocessor(nlp, SnowballStemmer(language='french'), french))
+label_encoder = timed('label_encoder', lambda: pickle.load(open(os.environ['CLASSIFIER_LABEL_ENCODER'], 'rb')))
+from flask import Flask, jsonify
+app = Flask(__name__)
+from transformers import BertForSequenceClassification, BertTokenizerFast
+model = timed('model', lambda: BertForSequenceClassification.from_pretrained(os.environ['CLASSIFIER_MODEL_DIR']))
+tokenizer = timed('tokenizer', lambda: BertTokenizerFast.from_pretrained(os.environ['CLASSIFIER_TOKENIZER_DIR']))
+from batcher import MicroBatcher
+batcher = timed('batcher', lambda: MicroBatcher(model, tokenizer))
+@app.route('/health')
+def health():
+    return jsonify({'status': 'ok'})
+imported = time.perf_counter() - start
+client = app.test_client()
+client.get('/health')
+health = time.perf_counter() - start
+# No readiness check nor warmup: the first request pays the lazy initializations
+batcher.predict([preprocessor.process('<html><body><p>Ordinateur portable</p></body></html>')])
+print(json.dumps({'import': imported, 'health': health, 'ready': time.perf_counter() - start, 'trace': trace}))
+"""
+
+CURRENT = r"""
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+client = main.app.test_client()
+assert client.get('/health').status_code == 200
+health = time.perf_counter() - start
+while True:
+    response = client.get('/ready')
+    if response.status_code == 200:
+        break
+    if any(resource['state'] == 'failed' for resource in response.json['resources'].values()):
+        raise SystemExit(json.dumps(response.json['resources']))
+    time.sleep(0.01)
+print(json.dumps({'import': imported, 'health': health, 'ready': time.perf_counter() - start,
+                  'trace': response.json['resources']}))
+"""
+
+
+def save_random_model(directory: str):
+    # A bert-base classifier with random weights, saved like website_classifier_model and its tokenizer
+    from bench_batching import random_model
+    model, tokenizer = random_model(directory)
+    model.save_pretrained(os.path.join(directory, 'model'))
+    tokenizer.save_pretrained(os.path.join(directory, 'tokenizer'))
+    return os.path.join(directory, 'model'), os.path.join(directory, 'tokenizer')
+
+
+def fill_stopwords(nltk_dir: str):
+    # The resource cache of `python resources.py`; spaCy's lists in NLTK's format when the corpus isn't downloaded
+    import nltk
+    try:
+        source = nltk.data.find('corpora/stopwords')
+        shutil.copytree(str(source), os.path.join(nltk_dir, 'corpora', 'stopwords'))
+        return
+    except LookupError:
+        from spacy.lang.en.stop_words import STOP_WORDS as english
+        from spacy.lang.fr.stop_words import STOP_WORDS as french
+        print("NLTK stopwords not downloaded, using spaCy's stopword lists")
+    os.makedirs(os.path.join(nltk_dir, 'corpora', 'stopwords'))
+    for language, words in (('french', french), ('english', english)):
+        with open(os.path.join(nltk_dir, 'corpora', 'stopwords', language), 'w') as f:
+            f.write('\n'.join(sorted(words)))
+
+
+def start(code: str, env: dict) -> dict:
+    # One cold start in a fresh process
+    result = subprocess.run([sys.executable, '-c', code], cwd=API, env=env, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr[-3000:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spacy-model', default='fr_core_news_lg')
+    parser.add_argument('--random-model', action='store_true')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.random_model:
+            model_dir, tokenizer_dir = save_random_model(directory)
+        else:
+            model_dir, tokenizer_dir = (os.path.join(API, 'website_classifier_model'),
+                                        os.path.join(API, 'website_classifier_tokenizer'))
+        fill_stopwords(os.path.join(directory, 'resources', 'nltk_data'))
+        env = dict(os.environ, CLASSIFIER_RESOURCE_DIR=os.path.join(directory, 'resources'),
+                   CLASSIFIER_SPACY_MODEL=args.spacy_model, CLASSIFIER_MODEL_DIR=model_dir,
+                   CLASSIFIER_TOKENIZER_DIR=tokenizer_dir,
+                   CLASSIFIER_LABEL_ENCODER=os.path.join(os.path.dirname(API), 'label_encoder.pkl'),
+                   CLASSIFIER_OFFLINE='1', HF_HUB_OFFLINE='1', PYTHONPATH=API)
+
+        runs = {'previous': [], 'background': []}
+        for _ in range(args.rounds):
+            runs['previous'].append(start(PREVIOUS, env))
+            runs['background'].append(start(CURRENT, env))
+
+    print(f"{args.rounds} cold starts each, median seconds")
+    print(f"{'startup':<12}{'import':>10}{'health':>10}{'ready':>10}")
+    for name, results in runs.items():
+        print(f"{name:<12}" + ''.join(f"{statistics.median(run[key] for run in results):10.2f}"
+                                      for key in ('import', 'health', 'ready')))
+    for name, results in runs.items():
+        print(f"\nCold-start trace, {name} (last start, seconds since import)")
+        print(f"{'resource':<16}{'start':>8}{'end':>8}{'load':>8}{'waited':>8}")
+        for resource, timing in sorted(results[-1]['trace'].items(), key=lambda item: item[1]['end_s']):
+            print(f"{resource:<16}{timing['start_s']:8.2f}{timing['end_s']:8.2f}{timing['seconds']:8.2f}"
+                  f"{timing['waited_s']:8.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Compare the inference backends (backends.py) on the websites of cleaned_results.csv: the accuracy against their
+labels, the drift from fp32 (labels that change, largest logit difference), the latency of one text, the throughput
+of batches and the memory of the process.
+Each backend runs in its own process, so its RSS isn't mixed with the others'. The ONNX graphs are exported
+beforehand, the load time and RSS are those of a worker starting with them.
+
+The pages are fetched and preprocessed once, like main.py does, and kept in --texts (JSON lines) for the next runs.
+--sample-pages uses the sample pages (benchmarks/sample_pages.py) and their categories instead, when the websites
+can't be fetched. --random-model runs a randomly initialized bert-base when website_classifier_model isn't
+available: the drift, speed and memory are meaningful, the accuracy isn't.
+
+Usage: python benchmarks/eval_backends.py [--backends fp32 int8 onnx onnx-int8] [--threads 0] [--texts texts.jsonl]
+                                          [--sample-pages] [--random-model] [--spacy-model fr_core_news_lg]
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_startup import API, save_random_model
+
+
+def prepare_texts(args) -> list:
+    """
+    The preprocessed text and the expected label of each website.
+    Returns: list: dicts with url, label and text
+
+    """
+    if args.texts and os.path.exists(args.texts):
+        with open(args.texts) as f:
+            return [json.loads(line) for line in f]
+    os.environ['CLASSIFIER_PRELOAD'] = '0' # Only the preprocessing resources are loaded, on first use
+    os.environ['CLASSIFIER_SPACY_MODEL'] = args.spacy_model
+    import main
+    preprocessor = main.resources.get('preprocessor')
+    if args.sample_pages:
+        from sample_pages import sample_pages
+        pages = [(name, name.split('-')[0], html) for name, html in sample_pages()]
+    else:
+        import pandas as pd
+        from concurrent.futures import ThreadPoolExecutor
+        websites = pd.read_csv(args.csv)
+        with ThreadPoolExecutor(8) as executor:
+            htmls = list(executor.map(main.fetch_page, websites['URL']))
+        pages = [(url, label, html) for url, label, html in zip(websites['URL'], websites['Classification'], htmls)
+                 if html is not None]
+        print(f"{len(pages)} of {len(websites)} websites fetched")
+    texts = [{'url': url, 'label': label, 'text': text}
+             for (url, label, _), text in zip(pages, preprocessor.process_many([html for _, _, html in pages]))]
+    if args.texts:
+        with open(args.texts, 'w') as f:
+            f.writelines(json.dumps(text) + '\n' for text in texts)
+    return texts
+
+
+def run_backend(name: str, texts_path: str, model_dir: str, tokenizer_dir: str, threads: int, batch_size: int):
+    # In the child process: load the backend, time it, print the logits and measures as JSON
+    start = time.perf_counter()
+    from transformers import BertTokenizerFast
+    from backends import load_backend
+    from batcher import MicroBatcher
+    backend = load_backend(name, model_dir, threads)
+    tokenizer = BertTokenizerFast.from_pretrained(tokenizer_dir)
+    load_s = time.perf_counter() - start
+    with open(texts_path) as f:
+        texts = [json.loads(line)['text'] for line in f]
+    batcher = MicroBatcher(backend, tokenizer, max_batch_size=batch_size, max_wait_ms=0)
+    batcher.predict(texts[:2]) # Warm up
+    latencies = []
+    for text in texts:
+        began = time.perf_counter()
+        batcher.predict([text])
+        latencies.append(time.perf_counter() - began)
+    batcher = MicroBatcher(backend, tokenizer, max_batch_size=batch_size, max_wait_ms=50)
+    began = time.perf_counter()
+    logits = batcher.predict(texts)
+    throughput = len(texts) / (time.perf_counter() - began)
+    print(json.dumps({'load_s': load_s, 'p50_ms': statistics.median(latencies) * 1000,
+                      'throughput': throughput, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                      'logits': logits.tolist()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--backends', nargs='+', default=['fp32', 'int8', 'onnx', 'onnx-int8'])
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--csv', default=os.path.join(os.path.dirname(API), 'cleaned_results.csv'))
+    parser.add_argument('--label-encoder', default=os.path.join(os.path.dirname(API), 'label_encoder.pkl'))
+    parser.add_argument('--texts', help='JSON lines file keeping the preprocessed texts between runs')
+    parser.add_argument('--sample-pages', action='store_true')
+    parser.add_argument('--spacy-model', default='fr_core_news_lg')
+    parser.add_argument('--model', default=os.path.join(API, 'website_classifier_model'))
+    parser.add_argument('--tokenizer', default=os.path.join(API, 'website_classifier_tokenizer'))
+    parser.add_argument('--random-model', action='store_true')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--child-texts', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child and not args.child_texts:
+        from backends import load_backend
+        return load_backend(args.child, args.model) # Export the ONNX graph, apart from the measured process
+    if args.child:
+        return run_backend(args.child, args.child_texts, args.model, args.tokenizer, args.threads, args.batch_size)
+
+    import pickle
+    import numpy as np
+    directory = tempfile.mkdtemp()
+    if args.random_model:
+        args.model, args.tokenizer = save_random_model(directory)
+    os.environ['CLASSIFIER_LABEL_ENCODER'] = args.label_encoder
+    texts = prepare_texts(args)
+    texts_path = os.path.join(directory, 'texts.jsonl')
+    with open(texts_path, 'w') as f:
+        f.writelines(json.dumps(text) + '\n' for text in texts)
+    with open(args.label_encoder, 'rb') as f:
+        label_encoder = pickle.load(f)
+    expected = label_encoder.transform([text['label'] for text in texts])
+
+    results = {}
+    for name in ['fp32'] + [name for name in args.backends if name != 'fp32']: # fp32 is the reference of the drift
+        if name.startswith('onnx'):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--model', args.model],
+                           capture_output=True, cwd=API)
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--child-texts', texts_path,
+                                '--model', args.model, '--tokenizer', args.tokenizer, '--threads', str(args.threads),
+                                '--batch-size', str(args.batch_size)], capture_output=True, text=True, cwd=API)
+        if child.returncode:
+            print(f"{name}: failed\n{child.stderr[-2000:]}")
+            continue
+        results[name] = json.loads(child.stdout.strip().splitlines()[-1])
+        results[name]['logits'] = np.array(results[name]['logits'])
+
+    reference = results['fp32']['logits']
+    print(f"{len(texts)} texts, {args.threads or 'default'} threads, batches of {args.batch_size}")
+    print(f"{'backend':<11}{'accuracy':>9}{'same as fp32':>14}{'max logit diff':>16}{'p50 ms':>8}{'texts/s':>9}"
+          f"{'load s':>8}{'peak RSS MB':>13}")
+    for name, result in results.items():
+        predicted = result['logits'].argmax(axis=1)
+        print(f"{name:<11}{np.mean(predicted == expected):9.3f}{np.mean(predicted == reference.argmax(axis=1)):14.3f}"
+              f"{np.abs(result['logits'] - reference).max():16.4f}{result['p50_ms']:8.1f}{result['throughput']:9.2f}"
+              f"{result['load_s']:8.2f}{result['peak_rss_mb']:13.0f}")
+
+
+if __name__ == '__main__':
+    main()
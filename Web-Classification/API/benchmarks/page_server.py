@@ -0,0 +1,105 @@
+"""
+A local HTTP stand-in for the websites, to run the classifier and pipeline.py offline.
+It serves saved pages (the .html files of --pages) or the sample pages (benchmarks/sample_pages.py) at /<name>, after
+--delay-ms like a remote site. It listens on every loopback address, and --write-csv lists the pages as
+http://127.0.X.Y:<port>/<name>, one host per page, with their category in the columns of cleaned_results.csv.
+
+Usage: python benchmarks/page_server.py [--pages saved_pages/] [--port 8765] [--delay-ms 200] [--write-csv urls.csv]
+"""
+import argparse
+import csv
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from sample_pages import sample_pages
+
+
+def load_pages(directory: str = None, seeds: int = 2) -> dict:
+    """
+    The pages to serve.
+    Args:
+        directory: A directory of saved .html pages, None for the sample pages
+        seeds: The number of sample pages of each category and size
+
+    Returns: dict: The HTML of each name
+
+    """
+    if directory is None:
+        return {name: html.encode('utf-8') for name, html in sample_pages(seeds=seeds)}
+    pages = {}
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('.html'):
+            with open(os.path.join(directory, file), 'rb') as f:
+                pages[file[:-len('.html')]] = f.read()
+    return pages
+
+
+def serve(pages: dict, port: int = 0, delay_ms: float = 0) -> ThreadingHTTPServer:
+    """
+    Serve pages in a background thread.
+    Args:
+        pages: The HTML of each name, served at /<name>
+        port: The port, 0 for any free one
+        delay_ms: The time taken by each response, in milliseconds
+
+    Returns: ThreadingHTTPServer: The server (server.server_address[1] is its port)
+
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay_ms / 1000)
+            page = pages.get(self.path.strip('/'))
+            self.send_response(200 if page is not None else 404)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+            self.wfile.write(page if page is not None else b'Not found')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='page-server', daemon=True).start()
+    return server
+
+
+def page_urls(pages: dict, port: int) -> list:
+    # One loopback host per page, so the per-host limits apply as with real websites
+    return [f'http://127.0.{index // 250}.{index % 250 + 1}:{port}/{name}' for index, name in enumerate(pages)]
+
+
+def write_csv(path: str, pages: dict, port: int):
+    # The URLs in the columns of cleaned_results.csv; the category of a sample page starts its name
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['URL', 'Classification'])
+        for url, name in zip(page_urls(pages, port), pages):
+            writer.writerow([url, name.split('-')[0]])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', help='Directory of saved .html pages (default: the sample pages)')
+    parser.add_argument('--seeds', type=int, default=2, help='Sample pages of each category and size')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--delay-ms', type=float, default=200)
+    parser.add_argument('--write-csv', help='Write the URLs of the pages to this CSV')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages, args.seeds)
+    server = serve(pages, args.port, args.delay_ms)
+    if args.write_csv:
+        write_csv(args.write_csv, pages, args.port)
+    print(f"Serving {len(pages)} pages on port {args.port}, {args.delay_ms:.0f} ms each")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Synthetic shop pages for the classifier benchmarks, one kind per category of label_encoder.pkl, from a few
+hundred words to several thousand (well past the 512 tokens BERT keeps). Generated from a seed, so every run
+uses the same pages.
+"""
+import random
+
+VOCABULARY = {
+    'Animal': "croquettes pour chien chat litière aquarium poisson rongeur cage laisse collier friandises "
+              "vétérinaire antiparasitaire jouet griffoir niche panier gamelle oiseau graines alimentation",
+    'Informatique': "ordinateur portable processeur carte graphique mémoire vive disque SSD écran clavier souris "
+                    "imprimante routeur wifi logiciel câble USB serveur composants boîtier alimentation gamer",
+    'Livre': "roman auteur éditeur poche littérature jeunesse bande dessinée manga polar essai biographie "
+             "librairie lecture collection parution histoire poésie dictionnaire scolaire nouveautés",
+    'Others': "service contact entreprise accueil actualités mentions légales partenaires événement équipe "
+              "projet solution conseil formation devis agence réalisations",
+    'Parapharmacie': "crème visage solaire hydratant shampoing complément alimentaire vitamines dermatologique "
+                     "peau sensible sérum anti-âge hygiène bébé minceur soin cheveux pharmacien",
+    'voyage': "séjour hôtel vol billet réservation circuit croisière plage destination vacances location "
+              "voiture club tout compris randonnée excursion désert île promotion départ",
+}
+COMMON = ("ajouter au panier livraison gratuite prix promo nouveau stock disponible tous nos produits "
+          "recherche compte connexion wishlist comparer quantité TND DT en stock catégorie marque "
+          "le la les de des du un une et en pour avec sur par au aux the and of to for with")
+
+
+def sample_page(category: str, words: int, seed: int = 0) -> str:
+    """
+    A shop page of a category.
+    Args:
+        category: The category (a key of VOCABULARY)
+        words: The approximate number of words of the body
+        seed: The seed of the page
+
+    Returns: str: The HTML
+
+    """
+    rng = random.Random(f'{category}-{words}-{seed}')
+    vocabulary, common = VOCABULARY[category].split(), COMMON.split()
+
+    def word() -> str:
+        draw = rng.random()
+        if draw < 0.15: # Product references: the large pages have thousands of distinct words
+            return f"{rng.choice(vocabulary)}{rng.randint(10, 99999)}"
+        return rng.choice(vocabulary if draw < 0.6 else common)
+
+    def sentence(length: int) -> str:
+        return ' '.join(word() for _ in range(length))
+
+    paragraphs = []
+    written = 0
+    while written < words:
+        length = rng.randint(8, 40)
+        paragraphs.append(f'<p>{sentence(length).capitalize()}.</p>')
+        if rng.random() < 0.3:
+            paragraphs.append(f'<div class="price"><span>{rng.randint(5, 2000)},{rng.randint(0, 999):03d} DT</span></div>')
+        written += length
+    return f"""<!DOCTYPE html>
+<html lang="fr"><head>
+<meta charset="utf-8"><title>{sentence(5)}</title>
+<meta name="description" content="{sentence(25)}">
+<meta property="og:description" content="{sentence(15)}">
+<link rel="stylesheet" href="/style.css"><style>body {{ font-family: sans-serif; }}</style>
+<script>window.dataLayer = window.dataLayer || []; function gtag() {{ dataLayer.push(arguments); }}</script>
+</head><body>
+<header><nav>{sentence(12)}</nav></header>
+<main><h1>{sentence(6)}</h1>
+{''.join(paragraphs)}
+</main>
+<footer>{sentence(20)}</footer>
+<noscript>Activez JavaScript</noscript>
+</body></html>"""
+
+
+def sample_pages(sizes=(150, 600, 4000), seeds: int = 2) -> list:
+    """
+    Pages of every category and size.
+    Returns: list: (name, html) pairs
+
+    """
+    return [(f'{category}-{size}-{seed}', sample_page(category, size, seed))
+            for category in VOCABULARY for size in sizes for seed in range(seeds)]
@@ -1,60 +1,240 @@
 import cloudscraper
-from bs4 import BeautifulSoup
-import torch
-from transformers import BertForSequenceClassification, BertTokenizerFast
+import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from flask import Flask, request, jsonify
-import nltk
-from nltk.stem import SnowballStemmer
-import spacy
-from nltk.corpus import stopwords
-nltk.download('stopwords')
-french_stopwords = set(stopwords.words('french'))
-english_stopwords = set(stopwords.words('english'))
-stemmer = SnowballStemmer(language='french')
-french_stopwords.update(["ajout", "pani", "tous", "recherche", "achet", "tnd","wishlist", "span","euro"])
-english_stopwords.update(["add", "pani", "all", "search", "buy", "tnd","wishlist"])
-nlp = spacy.load("fr_core_news_lg")
-# Function to fetch and clean the content of a website
-with open('label_encoder.pkl', 'rb') as f:
-    label_encoder = pickle.load(f)
+from resources import ResourceLoader, load_stopwords, offline
+from result_cache import ResultCache, normalize_domain, text_hash
+
+# The models load in the background (resources.py): the app answers /health at once and /ready once they are
+# loaded and warmed up. CLASSIFIER_PRELOAD=0 loads each one on its first use instead.
+READY_TIMEOUT = float(os.environ.get('CLASSIFIER_READY_TIMEOUT', 120)) # How long a request waits for a resource
+# CLASSIFIER_PREPROCESSING=full runs the whole spaCy pipeline on the whole page, as before the lean mode
+lean_preprocessing = os.environ.get('CLASSIFIER_PREPROCESSING', 'lean') == 'lean'
+resources = ResourceLoader()
+
+
+def load_all_stopwords():
+    french_stopwords, english_stopwords = load_stopwords()
+    french_stopwords.update(["ajout", "pani", "tous", "recherche", "achet", "tnd","wishlist", "span","euro"])
+    english_stopwords.update(["add", "pani", "all", "search", "buy", "tnd","wishlist"])
+    return french_stopwords | english_stopwords
+
+
+def load_nlp():
+    with resources.importing():
+        import spacy.lang.fr # noqa: F401 (imported under IMPORT_LOCK, spacy.load would import it lazily)
+        from preprocessing import load_pipeline
+    return load_pipeline(os.environ.get('CLASSIFIER_SPACY_MODEL', 'fr_core_news_lg'), lean=lean_preprocessing)
+
+
+def load_preprocessor():
+    with resources.importing():
+        from nltk.stem import SnowballStemmer
+        from preprocessing import Preprocessor
+    return Preprocessor(resources.get('nlp'), SnowballStemmer(language='french'), resources.get('stopwords'),
+                        max_tokens=512 if lean_preprocessing else None)
+
+
+def load_label_encoder():
+    with resources.importing():
+        import sklearn.preprocessing # noqa: F401 (imported under IMPORT_LOCK, the unpickling would import it)
+    with open(os.environ.get('CLASSIFIER_LABEL_ENCODER', 'label_encoder.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+def load_model():
+    # The inference backend (backends.py) of CLASSIFIER_BACKEND, on CLASSIFIER_THREADS threads
+    backend = os.environ.get('CLASSIFIER_BACKEND', 'fp32')
+    with resources.importing():
+        from backends import load_backend
+        from transformers import BertForSequenceClassification # noqa: F401 (imported under IMPORT_LOCK for backends)
+        if backend.startswith('onnx'):
+            import onnxruntime.quantization # noqa: F401 (imported under IMPORT_LOCK, backends.py imports it lazily)
+    return load_backend(backend, os.environ.get('CLASSIFIER_MODEL_DIR', 'website_classifier_model'),
+                        threads=int(os.environ.get('CLASSIFIER_THREADS', 0)), local_files_only=offline())
 
-app = Flask(__name__)
 
-model = BertForSequenceClassification.from_pretrained('website_classifier_model')
-tokenizer = BertTokenizerFast.from_pretrained('website_classifier_tokenizer')
+def load_tokenizer():
+    with resources.importing():
+        from transformers import BertTokenizerFast
+    return BertTokenizerFast.from_pretrained(
+        os.environ.get('CLASSIFIER_TOKENIZER_DIR', 'website_classifier_tokenizer'), local_files_only=offline())
+
+
+def load_batcher():
+    # Concurrent requests share batched forward passes
+    with resources.importing():
+        from batcher import MicroBatcher
+    return MicroBatcher(resources.get('model'), resources.get('tokenizer'),
+                        max_batch_size=int(os.environ.get('CLASSIFIER_MAX_BATCH', 32)),
+                        max_wait_ms=float(os.environ.get('CLASSIFIER_MAX_WAIT_MS', 10)))
+
+
+def warmup():
+    # One page through the whole pipeline, so the first request doesn't pay the lazy initializations
+    html = "<html><head><meta name='description' content='boutique en ligne'></head><body><p>Ordinateur portable et livres</p></body></html>"
+    labels_of(resources.get('batcher').predict(resources.get('preprocessor').process_many([html])))
+    return True
+
+
+app = Flask(__name__)
 scraper = cloudscraper.create_scraper()
+# Results by domain: within the TTL a domain isn't fetched again, past it the page is, but the model only runs
+# again if its preprocessed text changed. CLASSIFIER_CACHE=0 turns the cache off.
+result_cache = ResultCache(max_entries=int(os.environ.get('CLASSIFIER_CACHE_SIZE', 10000)),
+                           ttl_s=float(os.environ.get('CLASSIFIER_CACHE_TTL_S', 7 * 86400)),
+                           sqlite_path=os.environ.get('CLASSIFIER_CACHE_DB')) \
+    if os.environ.get('CLASSIFIER_CACHE', '1') == '1' else None
+
+
+class NotReady(Exception):
+    pass
+
+
+def resource(name):
+    # A loaded resource; NotReady (503) if it doesn't load in time or failed to load
+    try:
+        return resources.get(name, READY_TIMEOUT)
+    except Exception as e:
+        raise NotReady(f'{name} is not available: {e!r}')
+
+
+@app.errorhandler(NotReady)
+def not_ready(e):
+    return jsonify({'error': str(e), 'resources': resources.trace()}), 503
+
+
+def fetch_page(url):
+    # The HTML of a website, None if it can't be fetched
+    try:
+        return scraper.get(url, timeout=10).content
+    except Exception:
+        return
+
+
 def fetch_content(url):
+    html = fetch_page(url)
+    preprocessor = resource('preprocessor')
     try:
-        r = scraper.get(url, timeout=10)
-        soup = BeautifulSoup(r.content, 'lxml')
-        metas = soup.find_all("meta")
-        description = (" ".join([meta["content"] if "description" in str(meta) else "" for meta in metas])).strip()
-        for tag in soup(['script', 'style', 'noscript', 'iframe', 'link', 'comment', 'footer', 'header','meta','span']):
-            tag.decompose()
-        combined_text = soup.get_text(separator=' ', strip=True)
-        filtered_words = [word for word in combined_text.split() if word.lower() not in french_stopwords and word.lower() not in english_stopwords]
-        stemmed_words = {stemmer.stem(word) for word in filtered_words}  # Use a set to remove duplicates
-        doc = nlp(" ".join(stemmed_words).strip()+" "+description)
-        return (" ".join([token.lemma_ for token in doc if not token.is_stop])).strip()
+        return None if html is None else preprocessor.process(html)
     except Exception as e:
         return
 
 
 
+def labels_of(logits):
+    # The predicted label of each row of logits
+    return resource('label_encoder').inverse_transform(np.argmax(logits, axis=-1))
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    # Liveness: answers as soon as the process is up, even while the models load
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness: 200 once every resource is loaded and the warmup is done, 503 before (or if a load failed).
+    Returns: JSON with the cold-start trace, the state and load time of each resource
+    """
+    is_ready = resources.ready()
+    return jsonify({'ready': is_ready, 'resources': resources.trace()}), 200 if is_ready else 503
+
+
 @app.route('/', methods=['GET'])
 def predict():
     test_url = request.args.get('url')
+    domain = normalize_domain(test_url) if result_cache else None
+    entry, fresh = result_cache.lookup(domain) if domain else (None, False)
+    if fresh:
+        return jsonify({'predicted_label': entry['label'], 'cache': 'hit'})
     content = fetch_content(test_url)
+    if content is None:
+        return jsonify({'error': f'Could not fetch {test_url}'}), 502
+
+    digest = text_hash(content)
+    if domain and result_cache.revalidate(domain, entry, digest):
+        return jsonify({'predicted_label': entry['label'], 'cache': 'same_content'})
+    logits = resource('batcher').submit(content).result()
+    predicted_label = labels_of(logits[np.newaxis])[0]
+    if domain:
+        result_cache.store(domain, predicted_label, logits, digest)
+    return jsonify({'predicted_label': predicted_label, 'cache': 'miss'})
+
+
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """
+    Classify many websites: the body is a JSON object with a 'urls' list. The cached domains are answered from the
+    cache, the other pages are fetched concurrently (CLASSIFIER_FETCH_WORKERS) and classified in batched forward
+    passes.
+    Returns: JSON list with the predicted label (or the error) of each URL, in the order of the urls
+    """
+    urls = (request.get_json(silent=True) or {}).get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+        return jsonify({'error': 'urls must be a non-empty list of URLs'}), 400
+
+    domains = [normalize_domain(url) if result_cache else None for url in urls]
+    results = [None] * len(urls)
+    entries = {}
+    for index, domain in enumerate(domains):
+        if domain:
+            entry, fresh = result_cache.lookup(domain)
+            if fresh:
+                results[index] = {'url': urls[index], 'predicted_label': entry['label'], 'cache': 'hit'}
+            else:
+                entries[index] = entry
+    fetched = [index for index, result in enumerate(results) if result is None]
+    with ThreadPoolExecutor(int(os.environ.get('CLASSIFIER_FETCH_WORKERS', 8))) as executor:
+        pages = list(executor.map(fetch_page, [urls[index] for index in fetched]))
+    preprocessor, batcher = resource('preprocessor'), resource('batcher')
+    texts, errors = {}, {} # The per-URL errors, by index
+    for index, page in zip(fetched, pages):
+        try:
+            if page is not None:
+                texts[index] = preprocessor.prepare(page)
+        except Exception as e:
+            errors[index] = f'Could not preprocess {urls[index]}: {e}'
+    inferred = {}
+    if texts:
+        contents = preprocessor.lemmatize_many(list(texts.values())) # The pages are lemmatized together with nlp.pipe
+        for index, content in zip(texts, contents):
+            digest = text_hash(content)
+            if domains[index] and result_cache.revalidate(domains[index], entries.get(index), digest):
+                results[index] = {'url': urls[index], 'predicted_label': entries[index]['label'], 'cache': 'same_content'}
+            else:
+                inferred[index] = (content, digest)
+    if inferred:
+        logits = batcher.predict([content for content, _ in inferred.values()])
+        for (index, (_, digest)), label, row_logits in zip(inferred.items(), labels_of(logits), logits):
+            results[index] = {'url': urls[index], 'predicted_label': label, 'cache': 'miss'}
+            if domains[index]:
+                result_cache.store(domains[index], label, row_logits, digest)
+    results = [result or {'url': url, 'error': errors.get(index, f'Could not fetch {url}')}
+               for index, (url, result) in enumerate(zip(urls, results))]
+    return jsonify({'results': results, 'batching': batcher.stats()})
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    # Hits and misses of the result cache
+    return jsonify(result_cache.stats() if result_cache else {'enabled': False})
 
-    tokenized_content = tokenizer(content, padding=True, truncation=True, return_tensors='pt')
-    model.eval()
-    with torch.no_grad():
-        outputs = model(**tokenized_content)
-        predictions = torch.argmax(outputs.logits, dim=-1)
 
-    predicted_label = label_encoder.inverse_transform(predictions.numpy())[0]
-    return jsonify({'predicted_label': predicted_label})
+resources.register('stopwords', load_all_stopwords)
+resources.register('nlp', load_nlp)
+resources.register('preprocessor', load_preprocessor)
+resources.register('label_encoder', load_label_encoder)
+resources.register('model', load_model)
+resources.register('tokenizer', load_tokenizer)
+resources.register('batcher', load_batcher)
+resources.register('warmup', warmup)
+if os.environ.get('CLASSIFIER_PRELOAD', '1') == '1':
+    resources.start()
 
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -0,0 +1,355 @@
+"""
+Classify a CSV of websites in bulk, without going through the Flask API one URL at a time.
+The list streams through stages that overlap, connected by bounded queues (--queue-size), so a slow stage holds
+back the ones before it instead of buffering the whole list:
+- fetch: scheduled by asyncio, at most --concurrency pages at once and --per-host per host, with main.fetch_page
+- preprocess: the cleanup, stemming and lemmatization of fetch_content (main's Preprocessor), in --workers processes
+- infer: batches of --batch-size texts through main's micro-batcher and inference backend (CLASSIFIER_BACKEND)
+- write: each result appended to the output (.jsonl or .csv) as soon as it's known
+The output is the checkpoint: --resume skips the URLs it already holds. The throughput of each stage is printed
+every --report-every seconds and at the end; the busiest stage is the bottleneck.
+A stage always sends DONE on, even when it fails, and a failed batch becomes error rows, so a failure can't leave
+the other stages waiting; the CLI exits with an error if a stage failed.
+
+Usage: python pipeline.py ../cleaned_results.csv results.jsonl [--url-column URL] [--resume]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+os.environ.setdefault('CLASSIFIER_PRELOAD', '0') # Only the resources the pipeline uses are loaded
+import main
+
+DONE = None # Sent down a queue after its last item
+_preprocessor = None # The Preprocessor of a worker process
+
+
+class Stage:
+    """
+    The counts and timings of a stage.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_s = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def working(self, items: int = 1):
+        # Time a piece of work of the stage, and count its items
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.busy_s += time.perf_counter() - start
+                self.items += items
+
+    def report(self, threads: int = 1) -> str:
+        elapsed = time.perf_counter() - self.started
+        busy = self.busy_s / threads / elapsed if elapsed else 0
+        return f"{self.name} {self.items} ({self.items / elapsed:.1f}/s, {busy:.0%} busy)"
+
+
+def read_urls(path: str, column: str, done: set):
+    # The URLs of the CSV that aren't in the output yet, in order
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            url = (row.get(column) or '').strip()
+            if url and url not in done:
+                done.add(url) # The duplicates of the list are classified once
+                yield url
+
+
+def read_done(path: str) -> set:
+    """
+    The URLs already in an output file, to resume from it.
+    Returns: set: The URLs
+
+    """
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            return {row['url'] for row in csv.DictReader(f) if row.get('url')}
+        done = set()
+        for line in f:
+            try:
+                done.add(json.loads(line)['url'])
+            except (ValueError, KeyError):
+                pass # The last line of an interrupted run
+        return done
+
+
+def init_worker():
+    global _preprocessor
+    _preprocessor = main.resources.get('preprocessor')
+
+
+def worker_pid(_) -> int:
+    return os.getpid()
+
+
+def preprocess_pages(pages: list) -> tuple:
+    """
+    Preprocess pages like fetch_content, lemmatized together with nlp.pipe.
+    Args:
+        pages: The HTML of the pages
+
+    Returns: tuple: The text to classify of each page (None for those that failed) and the error of each page
+    (None for those that didn't)
+
+    """
+    preprocessor = _preprocessor or main.resources.get('preprocessor')
+    texts, errors = {}, [None] * len(pages)
+    for index, html in enumerate(pages):
+        try:
+            texts[index] = preprocessor.prepare(html)
+        except Exception as e:
+            errors[index] = repr(e)
+    results = [None] * len(pages)
+    for index, text in zip(texts, preprocessor.lemmatize_many(list(texts.values()))):
+        results[index] = text
+    return results, errors
+
+
+def take(source: queue.Queue, size: int, wait: float = 0.05) -> tuple:
+    """
+    Up to size items of a queue: blocks for the first one, then takes what arrives within wait seconds.
+    Returns: tuple: The items and whether DONE was reached
+
+    """
+    items = [source.get()]
+    deadline = time.perf_counter() + wait
+    while items[-1] is not DONE and len(items) < size:
+        try:
+            items.append(source.get(timeout=max(deadline - time.perf_counter(), 0)))
+        except queue.Empty:
+            break
+    if items[-1] is DONE:
+        return items[:-1], True
+    return items, False
+
+
+class Pipeline:
+    """
+    The stages of a run and the queues between them.
+    """
+    def __init__(self, concurrency: int = 32, per_host: int = 2, workers: int = 1, batch_size: int = 32,
+                 queue_size: int = 256):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.workers = workers
+        self.batch_size = batch_size
+        self.pages = queue.Queue(queue_size) # (url, html) fetched
+        self.texts = queue.Queue(queue_size) # (url, text) preprocessed
+        self.results = queue.Queue(queue_size) # Rows to write
+        self.stages = {name: Stage(name) for name in ('fetch', 'preprocess', 'infer', 'write')}
+        self.failed = 0
+        self.errors = [] # The failures that stopped a stage
+
+    def fetch(self, urls):
+        try:
+            asyncio.run(self._fetch_all(urls))
+        except Exception as e:
+            self.errors.append(f"fetch: {e!r}") # Reading the list failed, the URLs fetched so far go on
+        finally:
+            for _ in range(max(self.workers, 1)):
+                self.pages.put(DONE)
+
+    async def _fetch_all(self, urls):
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='fetch')
+        slots = asyncio.Semaphore(self.concurrency)
+        hosts = defaultdict(lambda: asyncio.Semaphore(self.per_host))
+        tasks = set()
+
+        async def fetch_one(url):
+            try:
+                async with hosts[urlsplit(url).hostname]:
+                    # The page goes into the bounded queue from the fetch thread: a full queue holds the fetches
+                    await loop.run_in_executor(executor, self._fetch_page, url)
+            finally:
+                slots.release()
+
+        for url in urls:
+            await slots.acquire()
+            task = asyncio.create_task(fetch_one(url))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        executor.shutdown()
+
+    def _fetch_page(self, url):
+        with self.stages['fetch'].working():
+            try:
+                html = main.fetch_page(url)
+            except Exception:
+                html = None
+        if html is None:
+            self.results.put({'url': url, 'error': f'Could not fetch {url}'})
+        else:
+            self.pages.put((url, html))
+
+    def preprocess(self, pool):
+        # One of the preprocessing threads, each feeding a worker process (or preprocessing itself without a pool)
+        try:
+            done = False
+            while not done:
+                batch, done = take(self.pages, self.batch_size)
+                if not batch:
+                    continue
+                with self.stages['preprocess'].working(len(batch)):
+                    pages = [html for _, html in batch]
+                    try:
+                        texts, errors = pool.submit(preprocess_pages, pages).result() if pool else preprocess_pages(pages)
+                    except Exception as e: # BrokenProcessPool, a preprocessor that failed to load...
+                        texts, errors = [None] * len(batch), [repr(e)] * len(batch)
+                for (url, _), text, error in zip(batch, texts, errors):
+                    if text is None:
+                        self.results.put({'url': url, 'error': f'Could not preprocess {url}: {error}'})
+                    else:
+                        self.texts.put((url, text))
+        finally:
+            self.texts.put(DONE)
+
+    def infer(self):
+        remaining = max(self.workers, 1) # The preprocessing threads still running
+        try:
+            while remaining:
+                batch, done = take(self.texts, self.batch_size)
+                remaining -= done
+                if not batch:
+                    continue
+                with self.stages['infer'].working(len(batch)):
+                    try:
+                        labels = main.labels_of(main.resources.get('batcher').predict([text for _, text in batch]))
+                        rows = [{'url': url, 'predicted_label': str(label)} for (url, _), label in zip(batch, labels)]
+                    except Exception as e:
+                        rows = [{'url': url, 'error': f'Could not classify {url}: {e!r}'} for url, _ in batch]
+                for row in rows:
+                    self.results.put(row)
+        finally:
+            self.results.put(DONE)
+
+    def write(self, path: str, append: bool):
+        self._written_all = False # Set once DONE is read
+        try:
+            self._write(path, append)
+        except Exception as e:
+            self.errors.append(f"write: {e!r}")
+        finally:
+            while not self._written_all: # The rows are drained so the other stages can finish
+                self._written_all = self.results.get() is DONE
+
+    def _write(self, path: str, append: bool):
+        if append and os.path.exists(path) and os.path.getsize(path):
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                newline = f.read() != b'\n' # An interrupted run may have left half a line
+        else:
+            append, newline = False, False
+        with open(path, 'a' if append else 'w', newline='', encoding='utf-8') as f:
+            if newline:
+                f.write('\n')
+            writer = csv.DictWriter(f, ['url', 'predicted_label', 'error']) if path.endswith('.csv') else None
+            if writer and not append:
+                writer.writeheader()
+            while True:
+                row = self.results.get()
+                if row is DONE:
+                    self._written_all = True
+                    break
+                with self.stages['write'].working():
+                    if writer:
+                        writer.writerow(row)
+                    else:
+                        f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                    if self.results.empty():
+                        f.flush() # Written rows are the checkpoint
+                self.failed += 'error' in row
+
+    def report(self) -> str:
+        threads = {'fetch': self.concurrency, 'preprocess': max(self.workers, 1)}
+        stages = ', '.join(stage.report(threads.get(name, 1)) for name, stage in self.stages.items())
+        return f"{stages} | queued: pages {self.pages.qsize()}, texts {self.texts.qsize()}, results {self.results.qsize()}"
+
+    def run(self, urls, output: str, append: bool = False, report_every: float = 10):
+        """
+        Classify URLs into an output file.
+        Args:
+            urls: The URLs (an iterable, read as the fetches go)
+            output: The .jsonl or .csv file
+            append: Append to the output instead of replacing it
+            report_every: Print the stage throughputs every this many seconds
+        """
+        # Loaded before the stages start, so the load time isn't counted as stage time
+        main.resources.get('batcher')
+        if not self.workers:
+            main.resources.get('preprocessor')
+        pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context('spawn'),
+                                   initializer=init_worker) if self.workers else None
+        if pool:
+            list(pool.map(worker_pid, range(self.workers))) # Start the workers before the clock
+        for stage in self.stages.values():
+            stage.started = time.perf_counter()
+        threads = [threading.Thread(target=self.fetch, args=(urls,), name='fetch'),
+                   *[threading.Thread(target=self.preprocess, args=(pool,), name='preprocess')
+                     for _ in range(max(self.workers, 1))],
+                   threading.Thread(target=self.infer, name='infer')]
+        writer = threading.Thread(target=self.write, args=(output, append), name='write')
+        for thread in threads + [writer]:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(report_every)
+                if thread.is_alive():
+                    print(self.report(), file=sys.stderr, flush=True)
+        writer.join()
+        if pool:
+            pool.shutdown()
+        if self.errors:
+            raise RuntimeError(f"The pipeline failed: {'; '.join(self.errors)}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Classify a CSV of websites")
+    parser.add_argument('input', help='CSV with a column of URLs')
+    parser.add_argument('output', help='.jsonl or .csv results, written as they come')
+    parser.add_argument('--url-column', default='URL')
+    parser.add_argument('--resume', action='store_true', help='Skip the URLs already in the output')
+    parser.add_argument('--concurrency', type=int, default=32, help='Pages fetched at once')
+    parser.add_argument('--per-host', type=int, default=2, help='Pages fetched at once from one host')
+    parser.add_argument('--workers', type=int, default=1, help='Preprocessing processes, 0 to preprocess in-process')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--queue-size', type=int, default=256)
+    parser.add_argument('--report-every', type=float, default=10)
+    args = parser.parse_args()
+
+    done = read_done(args.output) if args.resume else set()
+    if done:
+        print(f"Resuming: {len(done)} URLs already in {args.output}", file=sys.stderr)
+    pipeline = Pipeline(args.concurrency, args.per_host, args.workers, args.batch_size, args.queue_size)
+    start = time.perf_counter()
+    try:
+        pipeline.run(read_urls(args.input, args.url_column, set(done)), args.output, append=args.resume,
+                     report_every=args.report_every)
+    finally:
+        written, started = pipeline.stages['write'].items, pipeline.stages['write'].started
+        print(f"{written} URLs in {time.perf_counter() - started:.1f}s after {started - start:.1f}s of loading "
+              f"({pipeline.failed} failed)\n{pipeline.report()}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main_cli()
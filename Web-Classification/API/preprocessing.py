@@ -0,0 +1,138 @@
+"""
+Text preprocessing of the classifier: clean the HTML of a page, drop the stopwords, stem the words, then
+lemmatize them with spaCy.
+The lean mode only loads the spaCy components the lemmatizer needs (no parser, no NER), lemmatizes many pages
+at once with nlp.pipe, and stops feeding spaCy once it has the words BERT will keep (max_tokens). Each distinct
+word is stemmed once.
+"""
+import functools
+
+import spacy
+from bs4 import BeautifulSoup
+
+# Components the rule-based French lemmatizer doesn't use
+LEAN_EXCLUDE = ['parser', 'ner', 'senter']
+CONTEXT_WORDS = 16 # Words kept after the cap, so the tagging of the last kept words doesn't change
+
+
+def load_pipeline(name: str, lean: bool = True):
+    """
+    Load a spaCy pipeline.
+    Args:
+        name: The pipeline (fr_core_news_lg)
+        lean: Only load the components the lemmatizer needs
+
+    Returns: spacy.Language: The pipeline
+
+    """
+    return spacy.load(name, exclude=LEAN_EXCLUDE) if lean else spacy.load(name)
+
+
+class Preprocessor:
+    """
+    Turns pages into the text the classifier is run on.
+    """
+    def __init__(self, nlp, stemmer, stopwords: set, max_tokens: int = 512, batch_size: int = 32):
+        """
+        Args:
+            nlp: The spaCy pipeline
+            stemmer: The stemmer
+            stopwords: The French and English stopwords
+            max_tokens: The number of tokens the classifier keeps (its tokenizer truncates the rest), None to
+                lemmatize the whole page
+            batch_size: The number of pages per nlp.pipe batch
+        """
+        self.nlp = nlp
+        self.stemmer = stemmer
+        self._stem = functools.lru_cache(maxsize=200000)(stemmer.stem) # Pages repeat the same words
+        self.stopwords = {word.lower() for word in stopwords} # One lowercase set, one lookup per word
+        self.spacy_stopwords = nlp.Defaults.stop_words
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+
+    def clean(self, html) -> tuple:
+        """
+        Extract the visible text and the meta descriptions of a page.
+        Args:
+            html: The page (str or bytes)
+
+        Returns: tuple: The text and the description
+
+        """
+        soup = BeautifulSoup(html, 'lxml')
+        metas = soup.find_all("meta")
+        description = (" ".join([meta["content"] if "description" in str(meta) else "" for meta in metas])).strip()
+        for tag in soup(['script', 'style', 'noscript', 'iframe', 'link', 'comment', 'footer', 'header','meta','span']):
+            tag.decompose()
+        return soup.get_text(separator=' ', strip=True), description
+
+    def stem(self, text: str) -> set:
+        """
+        Drop the stopwords and stem the words of a text.
+        Returns: set: The distinct stems
+
+        """
+        stopwords, stem = self.stopwords, self._stem
+        return {stem(word) for word in text.split() if word.lower() not in stopwords}
+
+    def spacy_input(self, stems: set, description: str) -> str:
+        """
+        The text given to spaCy: the stems then the description, cut once it holds max_tokens words that aren't
+        spaCy stopwords (plus a few words of context).
+        """
+        text = " ".join(stems).strip() + " " + description
+        if self.max_tokens is None:
+            return text
+        words = text.split()
+        kept = 0
+        for position, word in enumerate(words):
+            if word.lower() not in self.spacy_stopwords:
+                kept += 1
+                if kept == self.max_tokens:
+                    return " ".join(words[:position + 1 + CONTEXT_WORDS])
+        return text
+
+    def prepare(self, html) -> str:
+        """
+        Everything before spaCy: the text of a page to lemmatize.
+        Args:
+            html: The page (str or bytes)
+
+        Returns: str: The spaCy input
+
+        """
+        text, description = self.clean(html)
+        return self.spacy_input(self.stem(text), description)
+
+    def lemmas(self, doc) -> str:
+        return (" ".join([token.lemma_ for token in doc if not token.is_stop])).strip()
+
+    def lemmatize_many(self, texts: list) -> list:
+        """
+        Lemmatize prepared texts in nlp.pipe batches, without the stopwords.
+        Returns: list: The text to classify of each input
+
+        """
+        return [self.lemmas(doc) for doc in self.nlp.pipe(texts, batch_size=self.batch_size)]
+
+    def process(self, html) -> str:
+        """
+        Preprocess one page.
+        Args:
+            html: The page (str or bytes)
+
+        Returns: str: The text to classify
+
+        """
+        return self.process_many([html])[0]
+
+    def process_many(self, pages: list) -> list:
+        """
+        Preprocess pages, lemmatized in nlp.pipe batches.
+        Args:
+            pages: The pages (str or bytes)
+
+        Returns: list: The text to classify of each page
+
+        """
+        return self.lemmatize_many([self.prepare(html) for html in pages])
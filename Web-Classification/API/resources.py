@@ -0,0 +1,155 @@
+"""
+Background loading of the classifier resources (stopwords, spaCy pipeline, BERT model, tokenizer, label
+encoder).
+The resources load in parallel threads while the API already answers health checks. A request waits only
+for the resources it uses. Each load is timed, and the timings make the cold-start trace.
+In offline mode (CLASSIFIER_OFFLINE=1) nothing is downloaded: the NLTK data comes from the local resource cache
+(CLASSIFIER_RESOURCE_DIR), filled beforehand with `python resources.py`.
+"""
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+RESOURCE_DIR = os.environ.get('CLASSIFIER_RESOURCE_DIR', 'resources')
+NLTK_DIR = os.path.join(RESOURCE_DIR, 'nltk_data')
+# Held while a load imports a library: imports from several threads at once break the lazy modules of
+# transformers and nltk. Only the imports are serialized, the loads still run in parallel.
+IMPORT_LOCK = threading.RLock()
+
+
+def offline() -> bool:
+    return os.environ.get('CLASSIFIER_OFFLINE', '0') == '1'
+
+
+class ResourceLoader:
+    """
+    Named resources, each loaded once by its own function in a background thread.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._futures = {}
+        self._trace = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._current = threading.local() # The resource loaded by the current thread
+        self.created = time.perf_counter()
+
+    def register(self, name: str, load: Callable):
+        """
+        Register a resource. The load function may get() the resources it depends on.
+        Args:
+            name: The name of the resource
+            load: Returns the resource
+        """
+        self._loaders[name] = load
+
+    def start(self, names: Optional[list] = None):
+        """
+        Start loading resources in the background, all of them by default.
+        """
+        for name in names or list(self._loaders):
+            self._future(name)
+
+    def _future(self, name: str) -> Future:
+        with self._lock:
+            if name not in self._futures:
+                if self._executor is None:
+                    # One thread per resource: a load waiting for a dependency doesn't hold back the others
+                    self._executor = ThreadPoolExecutor(len(self._loaders), thread_name_prefix='resource')
+                self._futures[name] = self._executor.submit(self._load, name)
+            return self._futures[name]
+
+    def _load(self, name: str):
+        start = time.perf_counter()
+        self._trace[name] = {'state': 'loading', 'start_s': round(start - self.created, 3), 'waited_s': 0.0}
+        self._current.name = name
+        try:
+            resource = self._loaders[name]()
+        except Exception as e:
+            traceback.print_exc()
+            self._trace[name].update(state='failed', error=str(e), seconds=round(time.perf_counter() - start, 3))
+            raise
+        end = time.perf_counter()
+        self._trace[name].update(state='ready', end_s=round(end - self.created, 3), seconds=round(end - start, 3))
+        return resource
+
+    def get(self, name: str, timeout: Optional[float] = None):
+        """
+        Get a resource, loading it now if its load hasn't started.
+        Args:
+            name: The name of the resource
+            timeout: The maximum time to wait, in seconds
+
+        Returns: The resource (raises the error of its load, or TimeoutError)
+
+        """
+        with self._waiting():
+            return self._future(name).result(timeout)
+
+    @contextmanager
+    def importing(self):
+        """
+        Hold IMPORT_LOCK, for the imports of a load.
+        """
+        with self._waiting():
+            IMPORT_LOCK.acquire()
+        try:
+            yield
+        finally:
+            IMPORT_LOCK.release()
+
+    @contextmanager
+    def _waiting(self):
+        # Count the time a load waits for another resource or for IMPORT_LOCK, apart from its own work
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            name = getattr(self._current, 'name', None)
+            if name is not None:
+                self._trace[name]['waited_s'] = round(self._trace[name]['waited_s'] + time.perf_counter() - start, 3)
+
+    def ready(self) -> bool:
+        return all(name in self._futures and self._futures[name].done() and not self._futures[name].exception()
+                   for name in self._loaders)
+
+    def trace(self) -> dict:
+        """
+        The state and timings of each resource, in seconds since the loader was created. seconds is the whole load,
+        waited_s the part spent waiting for other resources and imports.
+        Returns: dict: The cold-start trace
+
+        """
+        return {name: dict(self._trace.get(name, {'state': 'pending'})) for name in self._loaders}
+
+
+def load_stopwords() -> tuple:
+    """
+    Load the French and English NLTK stopwords from the local resource cache, downloading them there first
+    unless offline.
+    Returns: tuple: The French and the English stopwords
+
+    """
+    with IMPORT_LOCK:
+        import nltk
+        from nltk.corpus import stopwords
+    if NLTK_DIR not in nltk.data.path:
+        nltk.data.path.insert(0, NLTK_DIR)
+    try:
+        nltk.data.find('corpora/stopwords')
+    except LookupError:
+        if offline():
+            raise LookupError(f"NLTK stopwords missing from {NLTK_DIR} (run `python resources.py` online first)")
+        nltk.download('stopwords', download_dir=NLTK_DIR, quiet=True)
+    return set(stopwords.words('french')), set(stopwords.words('english'))
+
+
+if __name__ == '__main__':
+    # Fill the local resource cache, so the API can start offline
+    os.environ['CLASSIFIER_OFFLINE'] = '0'
+    french, english = load_stopwords()
+    print(f"NLTK stopwords in {NLTK_DIR}: {len(french)} French, {len(english)} English")
@@ -0,0 +1,160 @@
+"""
+Per-domain cache of the classifier results.
+An entry holds the predicted label, the logits and a hash of the preprocessed text of the domain's page. Within
+its TTL an entry answers without fetching the page. Past it, the page is fetched and preprocessed again, and if its
+text hashes the same, the cached prediction is reused without running the model.
+Entries live in memory (LRU, CLASSIFIER_CACHE_SIZE of them) and, with CLASSIFIER_CACHE_DB, in a SQLite database
+that outlives the process and keeps the entries evicted from memory.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit
+
+
+def normalize_domain(url: str) -> Optional[str]:
+    """
+    The domain a URL is cached under: lowercase, without the scheme, port, path and leading "www.".
+    Args:
+        url: The URL, with or without its scheme
+
+    Returns: str: The domain, None if the URL has none
+
+    """
+    if not url:
+        return None
+    host = urlsplit(url if '://' in url else '//' + url).hostname
+    if not host:
+        return None
+    host = host.rstrip('.')
+    return host[4:] if host.startswith('www.') else host
+
+
+def text_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """
+    Memory LRU of the results by domain, in front of an optional SQLite tier.
+    """
+    def __init__(self, max_entries: int = 10000, ttl_s: float = 7 * 86400, sqlite_path: Optional[str] = None):
+        """
+        Args:
+            max_entries: The number of entries kept in memory
+            ttl_s: How long an entry answers without fetching the page, in seconds
+            sqlite_path: The SQLite database of the persistent tier, None to keep the entries in memory only
+        """
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(('lookups', 'fresh_hits', 'sqlite_hits', 'content_hits', 'misses', 'stores',
+                                     'evictions'), 0)
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS results (domain TEXT PRIMARY KEY, label TEXT, logits TEXT, "
+                             "text_hash TEXT, stored REAL)")
+            self._db.commit()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def lookup(self, domain: str) -> tuple:
+        """
+        The cached entry of a domain.
+        Args:
+            domain: The normalized domain
+
+        Returns: tuple: The entry (dict with label, logits, text_hash and stored, or None) and whether it's still
+        within its TTL
+
+        """
+        self._count('lookups')
+        with self._lock:
+            entry = self._entries.get(domain)
+            if entry is not None:
+                self._entries.move_to_end(domain)
+        if entry is None and self._db is not None:
+            with self._lock:
+                row = self._db.execute("SELECT label, logits, text_hash, stored FROM results WHERE domain = ?",
+                                       (domain,)).fetchone()
+            if row is not None:
+                entry = {'label': row[0], 'logits': json.loads(row[1]), 'text_hash': row[2], 'stored': row[3]}
+                self._remember(domain, entry)
+                self._count('sqlite_hits')
+        fresh = entry is not None and time.time() - entry['stored'] < self.ttl_s
+        if fresh:
+            self._count('fresh_hits')
+        return entry, fresh
+
+    def revalidate(self, domain: str, entry: Optional[dict], digest: str) -> bool:
+        """
+        Reuse an expired entry if the page still has the same preprocessed text, for another TTL.
+        Args:
+            domain: The normalized domain
+            entry: The entry of lookup()
+            digest: The text_hash() of the page's preprocessed text
+
+        Returns: bool: Whether the entry can be reused (else the page is a miss)
+
+        """
+        if entry is None or entry['text_hash'] != digest:
+            self._count('misses')
+            return False
+        self._count('content_hits')
+        self.store(domain, entry['label'], entry['logits'], digest, count=False)
+        return True
+
+    def store(self, domain: str, label: str, logits, digest: str, count: bool = True):
+        """
+        Cache the result of a domain.
+        Args:
+            domain: The normalized domain
+            label: The predicted label
+            logits: The logits of the prediction
+            digest: The text_hash() of the preprocessed text
+            count: Count it in the stores
+        """
+        entry = {'label': str(label), 'logits': [float(value) for value in logits], 'text_hash': digest,
+                 'stored': time.time()}
+        self._remember(domain, entry)
+        if count:
+            self._count('stores')
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                 (domain, entry['label'], json.dumps(entry['logits']), digest, entry['stored']))
+                self._db.commit()
+
+    def _remember(self, domain: str, entry: dict):
+        # Into the memory LRU, evicting the least recently used entries past max_entries
+        with self._lock:
+            self._entries[domain] = entry
+            self._entries.move_to_end(domain)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def stats(self) -> dict:
+        """
+        Returns: dict: The counts, the hit ratio and the size of each tier
+
+        """
+        with self._lock:
+            stats = dict(self.counts)
+            stats['memory_entries'] = len(self._entries)
+            if self._db is not None:
+                stats['sqlite_entries'] = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        hits = stats['fresh_hits'] + stats['content_hits']
+        stats['hit_ratio'] = round(hits / stats['lookups'], 4) if stats['lookups'] else None
+        stats['ttl_s'] = self.ttl_s
+        stats['max_entries'] = self.max_entries
+        return stats
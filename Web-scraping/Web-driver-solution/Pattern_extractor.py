@@ -1,7 +1,12 @@
-from playwright.sync_api import sync_playwright
+from typing import Optional
+
 from bs4 import BeautifulSoup
-from bs4 import Tag
-import re
+
+from browser_pool import get_pool
+from metrics import span
+from render_cache import get_render_cache
+from render_profile import get_profile
+from dom_scan import compile_price_patterns, scan_page
 
 PRICE_PATTERNS = [
     # Matches: 1234.56 DT, 1,234.56 TND, 1 234.56 D.T
@@ -13,6 +18,10 @@ PRICE_PATTERNS = [
     # Matches: 1234.56$, 1,234.56€, 1 234.56£
     r'^(?:\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2})?)\s*[$€£]$'
 ]
+PRICE_REGEX = compile_price_patterns(PRICE_PATTERNS) # All the patterns in one compiled pattern
+# Tags ignored by the price detection
+PRUNED_TAGS = frozenset(['script', 'style', 'noscript', 'iframe',
+                         'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li'])
 
 
 def _extract_content_attributes(element) -> str:
@@ -59,99 +68,86 @@ def clean_stock_attrs(attrs):
     return {k: v for k, v in attrs.items() if k not in exclude_attrs}
 
 
-def extract_pattern(url: str):
+def extract_pattern(url: str, max_age: Optional[float] = None):
     """
-    Extract price patterns from the given URL using Playwright and BeautifulSoup.
+    Extract price patterns from the given URL using the browser pool and BeautifulSoup.
     Args:
         url: The URL to extract data from
+        max_age: The maximum age (in seconds) of a cached rendering of the page, 0 to render it again
+
+    Returns: list: A list of dictionaries containing product information
+
+    """
+    try:
+        # Render the page with a pooled browser, unless it was rendered recently
+        html_content = get_render_cache().fetch(
+            url, lambda: get_pool().fetch_html(url, timeout=30000, profile=get_profile(url)), max_age)
+    except Exception as e:
+        print(f"Error loading page: {e}")
+        return []
+
+    return extract_pattern_from_html(html_content)
+
+
+def extract_pattern_from_html(html_content: str):
+    """
+    Extract price patterns from an already rendered page using BeautifulSoup.
+    Args:
+        html_content: The HTML content of the page
 
     Returns: list: A list of dictionaries containing product information
 
     """
-    with sync_playwright() as playwright:
-        browser = playwright.chromium.launch(
-            proxy={
-                "server": "socks5://127.0.0.1:8899"
-            },
-            headless=False
-        )# Set headless to True for faster execution, but it's easily blocked by some sites
-        page = browser.new_page() # Open a new browser page
-        try:
-            page.goto(url, timeout=30000) # Navigate to the URL with a timeout of 30 seconds (adjust as needed)
-            page.wait_for_timeout(2000) # Wait for 2 seconds to allow the page to load
-            html_content = page.content() # Get the HTML content of the page
-        except Exception as e:
-            print(f"Error loading page: {e}")
-            return []
-        finally:
-            browser.close() # Close the browser after extraction
-
-    soup = BeautifulSoup(html_content, 'lxml') # Parse the HTML content for prices extraction with BeautifulSoup
-    soup1 = BeautifulSoup(html_content, 'lxml') # Parse the HTML content for description and stock extraction with BeautifulSoup
-    for tag in soup(['script', 'style', 'noscript', 'iframe',
-                      'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
-        tag.decompose() # Remove unnecessary tags from the soup
-    for tag in soup1(['script', 'style', 'noscript', 'iframe']):
-        tag.decompose() # Remove unnecessary tags from the soup1
-    # List to store all found prices
-    prices_list = []
-
-    # Get all elements
-    all_elements = soup.find_all(True, recursive=True)
-
-    for element in all_elements:
-        if isinstance(element, Tag):
-            # Get text and clean it from extra spaces
-            text = element.get_text().strip()
-
-            # Check if the text is exactly a price format
-            is_price = False
-            for pattern in PRICE_PATTERNS:
-                if re.match(pattern, text):
-                    is_price = True
-
-            if is_price and element.attrs:
-                # Add price element to list without checking for duplicates
-                prices_list.append(element)
-
-    # Extract description information
-    description = []
-    # Get all elements with 'description' in their attributes
-    for element in soup1.find_all(lambda tag: any('description' in str(value).lower()
-                                                 for value in tag.attrs.values())):
-        content = ' '.join(element.get_text().split()).strip()
-        attr_content = _extract_content_attributes(element)
-        # Check if the content or attribute content is not empty
-        if content or attr_content:
-            description.append({
-                'tag_name': element.name,
-                'attributes': clean_attrs(element.attrs),
-                'text_content': content or attr_content,
-
-            })
-
-    # Extract stock information
-    stock = []
-    # Get all elements with 'stock' in their attributes, excluding 'main' as a tag and 'stockage' as a keyword
-    for element in soup1.find_all(lambda tag: tag.name != 'main' and any('stock' in str(value).lower()
-                                                  and 'stockage' not in str(value).lower()
-                                                 for value in tag.attrs.values())):
-        content = ' '.join(element.get_text().split()).strip()
-        attr_content = _extract_content_attributes(element)
-        # Check if the content or attribute content is not empty
-        if content or attr_content:
-            stock.append({
-                'tag_name': element.name,
-                'attributes': clean_stock_attrs(element.attrs),
-                'text_content': content or attr_content,
-
-            })
+    with span('pattern.parse'):
+        soup1 = BeautifulSoup(html_content, 'lxml') # Parse the HTML content for prices, description and stock extraction with BeautifulSoup
+        for tag in soup1(['script', 'style', 'noscript', 'iframe']):
+            tag.decompose() # Remove unnecessary tags from the soup1
+    with span('pattern.scan'):
+        # Find all the elements whose text is exactly a price format, the pruned tags being skipped
+        scan = scan_page(soup1, PRUNED_TAGS, price_regex=PRICE_REGEX, price_tags=None)
+    # List to store all found prices (elements with attributes), without checking for duplicates
+    prices_list = [(element, text) for _, element, text in scan.prices if element.attrs]
+
+    with span('pattern.heuristics'): # The description and stock candidates
+        # Extract description information
+        description = []
+        # Get all elements with 'description' in their attributes
+        for element in soup1.find_all(lambda tag: any('description' in str(value).lower()
+                                                     for value in tag.attrs.values())):
+            content = ' '.join(element.get_text().split()).strip()
+            attr_content = _extract_content_attributes(element)
+            # Check if the content or attribute content is not empty
+            if content or attr_content:
+                description.append({
+                    'tag_name': element.name,
+                    'attributes': clean_attrs(element.attrs),
+                    'text_content': content or attr_content,
+
+                })
+
+        # Extract stock information
+        stock = []
+        # Get all elements with 'stock' in their attributes, excluding 'main' as a tag and 'stockage' as a keyword
+        for element in soup1.find_all(lambda tag: tag.name != 'main' and any('stock' in str(value).lower()
+                                                      and 'stockage' not in str(value).lower()
+                                                     for value in tag.attrs.values())):
+            content = ' '.join(element.get_text().split()).strip()
+            attr_content = _extract_content_attributes(element)
+            # Check if the content or attribute content is not empty
+            if content or attr_content:
+                stock.append({
+                    'tag_name': element.name,
+                    'attributes': clean_stock_attrs(element.attrs),
+                    'text_content': content or attr_content,
+
+                })
 
     results = []
     # Extract price information from meta tags for more accurate results
-    price_metas_str = list(map(lambda x: str(x), soup1.find_all('meta')))
-    price_metas_str = list(filter(lambda x: 'price' in x.lower(), price_metas_str))
-    price_metas = [BeautifulSoup(tag, 'lxml').meta for tag in price_metas_str]
+    with span('pattern.meta_parse'): # The price meta tags are parsed again on their own
+        price_metas_str = list(map(lambda x: str(x), soup1.find_all('meta')))
+        price_metas_str = list(filter(lambda x: 'price' in x.lower(), price_metas_str))
+        price_metas = [BeautifulSoup(tag, 'lxml').meta for tag in price_metas_str]
     # Extract price information from the soup1 and merge it with the prices_list
     for meta in price_metas:
         if meta.has_attr('content') :
@@ -163,9 +159,9 @@ def extract_pattern(url: str):
                 })
             except:
                 pass
-    for element in prices_list:
+    for element, text in prices_list:
         results.append({
-            'price': element.get_text().strip(),
+            'price': text,
             'tag_name': element.name,
             'attributes': clean_attrs(element.attrs)
         })
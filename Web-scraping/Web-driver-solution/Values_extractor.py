@@ -1,9 +1,22 @@
 import json
+import os
 from typing import Any, Optional
 
-from playwright.sync_api import sync_playwright
-from bs4 import BeautifulSoup, Comment ,Tag
-import re
+from bs4 import BeautifulSoup
+
+from browser_pool import get_pool
+from fetch_strategy import BLOCKED_STATUSES, HTTP_OK, NEEDS_BROWSER, get_strategies, http_fetch, is_challenge
+from metrics import span
+from render_cache import HTTP, get_render_cache
+from render_profile import get_profile, param_selector
+from recipe_registry import Recipe, get_recipes
+from dom_scan import PRICE_TAGS, PageScan, best_container, compile_price_patterns, scan_page, visible_text
+
+
+class MissingElementsError(Exception):
+    """
+    Raised when a page doesn't contain the elements described by the params.
+    """
 
 
 class DOMExtractor:
@@ -25,60 +38,79 @@ class DOMExtractor:
             # Matches: 1234.56$, 1,234.56€, 1 234.56£
             r'^(?:\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2})?)\s*[$€£]$'
         ]
-
-    def _get_node_weight(self, element) -> float:
+        self.http_first = os.environ.get('FETCH_HTTP_FIRST', '1') == '1' # Try a plain HTTP fetch before the browser
+        self.price_regex = compile_price_patterns(self.PRICE_PATTERNS) # All the patterns in one compiled pattern
+        # Tags ignored by the heuristics, their subtrees are skipped instead of being removed from the tree
+        self.pruned_tags = frozenset(['script', 'style', 'noscript', 'iframe',
+                                      'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li'])
+        # Meta tags looked up on every page
+        self.meta_queries = {
+            'og:title': ('meta', {'property': 'og:title'}),
+            'twitter:title': ('meta', {'property': 'twitter:title'}),
+            'title': ('meta', {'name': 'title'}),
+            'currency': ('meta', {'property': 'product:price:currency'}),
+        }
+
+    def _find_product_container(self, scan: PageScan):
         """
-        Calculate importance weight of a DOM node.
-        This function assigns a weight to a DOM node based on its attributes, content size, and depth in the DOM tree.
-        The weight is used to identify the most relevant elements for price extraction.
-        The higher the weight, the more important the element is considered to be.
-
+        Find the main product container using weighted scoring (see dom_scan.container_weight).
+        The text length and depth of the candidates were computed during the traversal of the page.
         Args:
-            element: The HTML element to analyze.
+            scan: The candidates collected from the page
 
-        Returns: float: The importance weight of the element.
+        Returns: tuple: The container candidate (element, depth, start, end, text length) or None for the whole page
 
         """
+        return best_container(scan.containers, self.product_indicators)
+
+    def _scan(self, soup, queries: dict = None, bare: frozenset = frozenset()) -> PageScan:
+        """
+        Collect the candidates of the page in a single traversal, the pruned tags being skipped.
+        Args:
+            soup: The BeautifulSoup object representing the parsed HTML content.
+            queries: Query key -> (tag name, attributes) for the param-driven lookups
+            bare: The tag names of the attribute-less price params
 
-        weight = 1.0 # Default weight
+        Returns: PageScan: The collected candidates
 
-        # Check element attributes
-        if element.get('id') or element.get('class') or element.get('content'):
-            for indicator in self.product_indicators:
-                if indicator in str(element.get('id', '')).lower() or \
-                        indicator in ' '.join(element.get('class', [])).lower():
-                    weight *= 1.5  # Increase weight
+        """
+        queries = dict(self.meta_queries, **(queries or {}))
+        return scan_page(soup, self.pruned_tags, queries, bare, self.price_regex, PRICE_TAGS)
 
-        # Check content size
-        text = element.get_text(strip=True)
-        weight *= min(len(text) / 100, 3) # Normalize weight based on text length
+    def _price_from_scan(self, scan: PageScan):
+        """
+        Find the first div, span or p whose text is exactly a price.
+        Args:
+            scan: The candidates collected from the page
 
-        # Check depth in DOM
-        depth = len([p for p in element.parents])
-        weight /= max(depth, 1) # Avoid division by zero
+        Returns: str: The extracted price as a string.
 
-        return weight
+        """
+        if scan.prices:
+            return scan.prices[0][2] # The text of the first element matching a price format
 
-    def _find_product_container(self, soup) -> BeautifulSoup:
+    def _title_from_scan(self, scan: PageScan) -> tuple[str, bool]:
         """
-        Find the main product container using weighted scoring.
+        Find the title in the meta tags, or in the h1 of the main product container.
         Args:
-            soup: The BeautifulSoup object representing the parsed HTML content.
+            scan: The candidates collected from the page
 
-        Returns: BeautifulSoup: The main product container.
+        Returns: tuple: The extracted title and whether the DOM heuristics were used (the pruned tree is then
+        the one the param-driven lookups see)
 
         """
-        candidates = soup.find_all(['div', 'section', 'article', 'main']) # Possible product containers
-        max_weight = 0  # Initialize maximum weight
-        main_container = None # Initialize main container
-        # Iterate through candidates to find the one with the highest weight
-        for element in candidates:
-            weight = self._get_node_weight(element) # Calculate weight
-            if weight > max_weight:
-                max_weight = weight
-                main_container = element
-        # Return the main container or the entire soup if no suitable container is found
-        return main_container or soup
+        # Try to extract title from meta tags
+        for key in ('og:title', 'twitter:title', 'title'):
+            meta = scan.match(key)
+            if meta is not None and meta.has_attr('content'):
+                return meta['content'], False
+
+        container = self._find_product_container(scan) # Find the main product container
+        heading = scan.first_heading(container) # Find the title in the container
+        if heading is None:
+            print("Error extracting prices: no h1 in the product container")
+            return "", True
+        return visible_text(heading, self.pruned_tags, strip=True), True
 
     def get_price(self, soup):
         """
@@ -89,27 +121,7 @@ class DOMExtractor:
         Returns: str: The extracted price as a string.
 
         """
-        for tag in soup(['script', 'style', 'noscript', 'iframe',
-                         'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
-            tag.decompose() # Remove unnecessary tags from the soup object
-
-        # Get all elements with 'div', 'span', or 'p' tags
-        all_elements = soup.find_all(['div', 'span', 'p'], recursive=True)
-        # Iterate through all elements to find the price
-        for element in all_elements:
-            if isinstance(element, Tag):
-                # Get text and clean it from extra spaces
-                text = element.get_text().strip()
-
-
-                # Check if the text is exactly a price format
-                is_price = False
-                for pattern in self.PRICE_PATTERNS:
-                    if re.match(pattern, text):
-                        is_price = True
-
-                if is_price:
-                    return element.get_text().strip()
+        return self._price_from_scan(self._scan(soup))
 
     def get_title(self, soup):
         """
@@ -120,88 +132,244 @@ class DOMExtractor:
         Returns: str: The extracted title as a string.
 
         """
-        try:
-            # Try to extract title from meta tags
-            try:
-                title = soup.find('meta', property='og:title')['content']
-                return title
-            except:
-                pass
-            try:
-                title = soup.find('meta', property='twitter:title')['content']
-                return title
-            except:
-                pass
-            try:
-                title = soup.find('meta', {'name': 'title'})['content']
-                return title
-            except:
-                pass
+        return self._title_from_scan(self._scan(soup))[0]
 
-            # Clean up DOM
-            for tag in soup(['script', 'style', 'noscript', 'iframe',
-                             'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
-                tag.decompose() # Remove unnecessary tags from the soup object
+    @staticmethod
+    def _load_param(param: Optional[str]):
+        """
+        Decode a param sent to the API.
+        Args:
+            param: The JSON param with a 'tag' and JSON encoded 'attributes'
 
-            for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-                comment.extract() # Remove comments from the soup object
+        Returns: tuple: The tag name and the attributes, or None if there is no param
 
-            container = self._find_product_container(soup) # Find the main product container
-            seen_title = container.find('h1').get_text(strip=True) # Extract title from the container
+        """
+        if not param:
+            return None
+        param_ = json.loads(param)
+        return param_['tag'], json.loads(param_['attributes'])
+
+    def _ready_selector(self, price_param: Optional[str], recipe: Optional[Recipe] = None) -> Optional[str]:
+        """
+        Get the CSS selector whose presence means the rendered page shows the price.
+        Args:
+            price_param: The parameters for price extraction
+            recipe: The recipe used instead of the params
 
-            return seen_title
+        Returns: str: The CSS selector, or None to wait for any price-like text
 
-        except Exception as e:
-            print(f"Error extracting prices: {e}")
-            return ""
+        """
+        if recipe is not None:
+            price_query = recipe.elements['price']['tag'], recipe.elements['price']['attributes']
+        else:
+            try:
+                price_query = self._load_param(price_param)
+            except (ValueError, KeyError, TypeError):
+                return None # A broken param fails later, in extract_from_html
+        if not price_query or not price_query[1]:
+            return None # A bare tag (div, span...) is on the page long before the price
+        return param_selector(*price_query)
+
+    def _recipe(self, url: str, price_param: Optional[str], descr_param: Optional[str],
+                stock_param: Optional[str]) -> Optional[Recipe]:
+        """
+        Get the saved recipe of the domain of a URL, used when the request has no params.
+        """
+        if price_param or descr_param or stock_param:
+            return None # Explicit params win over the saved recipe
+        return get_recipes().for_url(url)
 
     def extract_values(self, url: str, price_param: Optional[str] = None, descr_param: Optional[str] = None,
-                       stock_param: Optional[str] = None) -> tuple[str | Any, str | Any, str | None, str | None]:
+                       stock_param: Optional[str] = None,
+                       max_age: Optional[float] = None) -> tuple[str | Any, str | Any, str | None, str | None]:
         """
-        Extract values from the given URL using Playwright , BeautifulSoup and the patterns as parameters.
+        Extract values from the given URL using BeautifulSoup and the patterns as parameters, or the saved recipe
+        of its domain when no params are given.
+        The page is fetched over plain HTTP first, unless its domain is known to need a browser, and rendered
+        with the browser pool when the HTTP page doesn't contain the requested elements.
         Args:
             url: The URL of the page to extract information from
             price_param: The parameters for price extraction
             descr_param: The parameters for description extraction
             stock_param: The parameters for stock extraction
+            max_age: The maximum age (in seconds) of a cached rendering of the page, 0 to render it again
 
         Returns: tuple: A tuple containing the extracted price, title, description, and stock
 
         """
-        with sync_playwright() as playwright:
-            browser = playwright.chromium.launch(
-                proxy={
-                    "server": "socks5://127.0.0.1:8899"
-                },
-                headless=False
-            )# Set headless to True for faster execution, but it's easily blocked by some sites
-            page = browser.new_page() # Create a new page in the browser
+        recipe = self._recipe(url, price_param, descr_param, stock_param)
+        cache = get_render_cache()
+        html_content = cache.get(url, max_age) # Reuse a recent rendering of the page
+        if html_content is None and self.http_first and get_strategies().use_http(url):
+            values = self._extract_over_http(url, price_param, descr_param, stock_param, recipe, max_age)
+            if values is not None:
+                return values
+        if html_content is None:
             try:
-                page.goto(url, timeout=30000) # Navigate to the URL with a timeout of 30 seconds
-                page.wait_for_timeout(2000) # Wait for 2 seconds to allow the page to load
-                html_content = page.content() # Get the HTML content of the page
+                # Render the page with a pooled browser, until the price shows up
+                html_content = get_pool().fetch_html(url, timeout=30000, profile=get_profile(url),
+                                                     ready_selector=self._ready_selector(price_param, recipe))
             except Exception as e:
                 print(f"Error loading page: {e}")
                 return []
-            finally:
-                browser.close() # Close the browser after extraction
+            cache.put(url, html_content)
+
+        if recipe is not None:
+            return self.extract_with_recipe(recipe, html_content)
+        return self.extract_from_html(html_content, price_param, descr_param, stock_param)
 
-        soup = BeautifulSoup(html_content, 'lxml') # Parse the HTML content with BeautifulSoup for the description, title, stock and price (without attributes)extraction
-        soup1 = BeautifulSoup(html_content, 'lxml') # Parse the HTML content with BeautifulSoup for the price extraction with get_price
-        price = self.get_price(soup1) # Extract price
-        title = self.get_title(soup) # Extract title
+    def extract_page(self, url: str, html_content: str, price_param: Optional[str] = None,
+                     descr_param: Optional[str] = None, stock_param: Optional[str] = None,
+                     require_matches: bool = False) -> tuple[str | Any, str | Any, str | None, str | None]:
+        """
+        Extract values from an already rendered page with the params, or with the saved recipe of its domain
+        when no params are given.
+        Args:
+            url: The URL of the page
+            html_content: The HTML content of the page
+            price_param: The parameters for price extraction
+            descr_param: The parameters for description extraction
+            stock_param: The parameters for stock extraction
+            require_matches: Raise MissingElementsError if an element is missing or no price is found
+
+        Returns: tuple: A tuple containing the extracted price, title, description, and stock
+
+        """
+        recipe = self._recipe(url, price_param, descr_param, stock_param)
+        if recipe is not None:
+            return self.extract_with_recipe(recipe, html_content, require_matches)
+        return self.extract_from_html(html_content, price_param, descr_param, stock_param, require_matches)
+
+    def extract_with_recipe(self, recipe: Recipe, html_content: str,
+                            require_matches: bool = False) -> tuple[str | Any, str | Any, str | None, str | None]:
+        """
+        Extract values from an already rendered page with the compiled selectors of a recipe, without the
+        DOM heuristics.
+        Args:
+            recipe: The recipe of the domain of the page
+            html_content: The HTML content of the page
+            require_matches: Raise MissingElementsError if an element of the recipe is missing or no price is found
+
+        Returns: tuple: A tuple containing the extracted price, title, description, and stock
+
+        """
+        with span('extract.recipe'): # Parse and selectors
+            values = recipe.extract(html_content, self.price_regex)
+        if require_matches:
+            missing = [field for field, value in values.items() if value is None]
+            if missing:
+                raise MissingElementsError(f"No element matches the {', '.join(missing)} of the {recipe.domain} recipe")
+            if not values['price']:
+                raise MissingElementsError("No price found")
+        return values['price'], values['title'] or '', values.get('description') or '', values.get('stock') or ''
+
+    def _extract_over_http(self, url: str, price_param: Optional[str], descr_param: Optional[str],
+                           stock_param: Optional[str], recipe: Optional[Recipe] = None,
+                           max_age: Optional[float] = None) -> Optional[tuple]:
+        """
+        Try to extract the values from a plain HTTP fetch of the page, and remember for the domain whether it worked.
+        The page is accepted when a price is found and every param (or recipe element) matches an element.
+        Args:
+            url: The URL of the page to extract information from
+            price_param: The parameters for price extraction
+            descr_param: The parameters for description extraction
+            stock_param: The parameters for stock extraction
+            recipe: The recipe used instead of the params
+            max_age: The maximum age (in seconds) of a cached HTTP fetch of the page, 0 to fetch it again
+
+        Returns: tuple: The extracted price, title, description, and stock, or None if the page needs a browser
+
+        """
+        def extract(html_content: str) -> tuple:
+            if recipe is not None:
+                return self.extract_with_recipe(recipe, html_content, require_matches=True)
+            return self.extract_from_html(html_content, price_param, descr_param, stock_param, require_matches=True)
+
+        cache = get_render_cache()
+        html_content = cache.get(url, max_age, kind=HTTP) # Cached apart from the renderings, never served as one
+        if html_content is not None:
+            try:
+                return extract(html_content)
+            except Exception:
+                pass # Not the elements of these params, the page is fetched again
+        with span('http.fetch'):
+            status, html_content = http_fetch(url)
+        if status in BLOCKED_STATUSES or html_content is not None and is_challenge(html_content):
+            print(f"HTTP fetch blocked for {url} (status {status})")
+            get_strategies().record(url, NEEDS_BROWSER)
+            return None
+        if html_content is None:
+            # Timeout, network error or unusable reply: the domain needs the browser after a few in a row
+            get_strategies().record_failure(url)
+            return None
+        try:
+            values = extract(html_content)
+        except Exception as e:
+            print(f"HTTP page not usable for {url}: {e}")
+            get_strategies().record(url, NEEDS_BROWSER)
+            return None
+        get_strategies().record(url, HTTP_OK)
+        cache.put(url, html_content, kind=HTTP)
+        return values
+
+    def extract_from_html(self, html_content: str, price_param: Optional[str] = None, descr_param: Optional[str] = None,
+                          stock_param: Optional[str] = None,
+                          require_matches: bool = False) -> tuple[str | Any, str | Any, str | None, str | None]:
+        """
+        Extract values from an already rendered page using BeautifulSoup and the patterns as parameters.
+        Args:
+            html_content: The HTML content of the page
+            price_param: The parameters for price extraction
+            descr_param: The parameters for description extraction
+            stock_param: The parameters for stock extraction
+            require_matches: Raise MissingElementsError if a param matches nothing or no price is found
+
+        Returns: tuple: A tuple containing the extracted price, title, description, and stock
+
+        """
+        with span('extract.parse'):
+            soup = BeautifulSoup(html_content, 'lxml') # Parse the HTML content once, the tree is never modified
+        with span('extract.heuristics'):
+            return self._extract_from_soup(soup, price_param, descr_param, stock_param, require_matches)
+
+    def _extract_from_soup(self, soup, price_param: Optional[str], descr_param: Optional[str],
+                           stock_param: Optional[str], require_matches: bool) -> tuple:
+        """
+        Extract values from a parsed page, see extract_from_html.
+        """
+        price_query = self._load_param(price_param) # Load the price parameters
+        descr_query = self._load_param(descr_param) # Load the description parameters
+        stock_query = self._load_param(stock_param) # Load the stock parameters
+        queries = {}
+        bare = frozenset()
+        if price_query:
+            if price_query[1]:
+                queries['price'] = price_query
+            else:
+                bare = frozenset([price_query[0]]) # Price elements without any attributes
+        if descr_query:
+            queries['description'] = descr_query
+        if stock_query:
+            queries['stock'] = stock_query
+        scan = self._scan(soup, queries, bare) # Collect all the candidates in a single traversal
+
+        price = self._price_from_scan(scan) # Extract price
+        title, pruned = self._title_from_scan(scan) # Extract title
+        # The param lookups ignore the pruned tags when the title came from the DOM heuristics
+        skip = self.pruned_tags if pruned else frozenset()
+        if require_matches:
+            missing = [key for key in queries if scan.match(key, pruned) is None]
+            if missing:
+                raise MissingElementsError(f"No element matches the {', '.join(missing)} param")
         description = '' # Initialize description
         stock = '' # Initialize stock
         # Extract price using the provided parameters
-        if price_param:
-            param_ = json.loads(price_param) # Load the price parameters
-            attributes = json.loads(param_['attributes']) # Load the attributes for price extraction
-            # Find elements with the specified tag and attributes
-            if attributes:
+        if price_query:
+            if price_query[1]:
                 # Find elements with the specified tag and attributes
-                element = soup.find(name=param_['tag'], attrs=attributes)
+                element = scan.match('price', pruned)
                 # Extract the currency element from the meta tag if it exists
-                currency_element = soup.find(name="meta", attrs={'property': 'product:price:currency'})
+                currency_element = scan.match('currency', pruned)
                 # Check if the element has the 'content' attribute and the currency element is present
                 if (element.has_attr('content') and currency_element):
                     # Format the price with commas and replace '.' with ','
@@ -209,38 +377,31 @@ class DOMExtractor:
                     # Append the currency to the price
                     price += " " + currency_element['content']
                 else:
-                    price = element.get_text().strip()
+                    price = visible_text(element, skip).strip()
             else:
-                # Find elements without any attributes
-                all_prices = soup1.find_all(lambda tag: tag.name == param_['tag'] and not tag.attrs)
-                # Iterate through all elements to find the price
-                for element in all_prices:
-                    if (isinstance(element, Tag)):
-                        text = element.get_text()
-                        for pattern in self.PRICE_PATTERNS:
-                            if re.match(pattern, text):
-                                price = element.get_text().strip()
-                                break
+                # Iterate through the elements without any attributes to find the price
+                for element in scan.bare.get(price_query[0], []):
+                    text = visible_text(element, self.pruned_tags)
+                    if self.price_regex.match(text):
+                        price = text.strip()
         # Extract description using the provided parameters
-        if descr_param:
-            descr_param_ = json.loads(descr_param)# Load the description parameters
-            attributes = json.loads(descr_param_['attributes'])# Load the attributes for description extraction
-            element = soup.find(name=descr_param_['tag'], attrs=attributes)# Find elements with the specified tag and attributes
+        if descr_query:
+            element = scan.match('description', pruned) # Find elements with the specified tag and attributes
             if (element.has_attr('content')):
                 description = element['content'] # Extract the content attribute if it exists
             else:
-                description = element.get_text()# Extract the text content if the content attribute does not exist
+                description = visible_text(element, skip) # Extract the text content if the content attribute does not exist
         # Extract stock using the provided parameters
-        if stock_param:
-            stock_param_ = json.loads(stock_param)# Load the stock parameters
-            print(stock_param_)
-            attributes = json.loads(stock_param_['attributes'])# Load the attributes for stock extraction
-            element = soup.find(name=stock_param_['tag'], attrs=attributes)# Find elements with the specified tag and attributes
+        if stock_query:
+            print(stock_query)
+            element = scan.match('stock', pruned) # Find elements with the specified tag and attributes
             if (element.has_attr('content')):
-                stock = element['content']# Extract the content attribute if it exists
+                stock = element['content'] # Extract the content attribute if it exists
             else:
-                stock = element.get_text() # Extract the text content if the content attribute does not exist
+                stock = visible_text(element, skip) # Extract the text content if the content attribute does not exist
 
+        if require_matches and not price:
+            raise MissingElementsError("No price found")
         return price, title, description, stock
 
 
@@ -1,20 +1,98 @@
 """
 This script is a Flask web application that provides several endpoints for extracting price patterns and values from web pages.
 """
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from compare import compare_product
-from flask_session import Session
+from compare_job import get_job, start_job
+from encoder import get_encoder
+from interaction_log import close_interaction_log, get_interaction_log
 from Pattern_extractor import extract_pattern
 from urllib.parse import urlparse
+import atexit
 import os
+import threading
+import time
+from browser_pool import get_pool, close_pool
+from metrics import get_metrics, span
+from render_cache import get_render_cache
+from fetch_strategy import get_strategies
+from recipe_registry import FIELDS, get_recipes
 from Values_extractor import DOMExtractor
+from batch_extractor import BatchExtraction, stream_ndjson
 from param_test import test_method
 
 
 app = Flask(__name__) # Initialize Flask app
-app.config['SESSION_TYPE'] = 'filesystem' # Configure session type
-Session(app) # Initialize session
 extractor = DOMExtractor() # Initialize DOMExtractor
+get_pool() # Start the shared browser pool so the first request doesn't pay for the browser launch
+atexit.register(close_pool) # Close the browsers when the server stops
+interactions = get_interaction_log() # Append-only log of the extractions, written in the background
+atexit.register(close_interaction_log) # Write the queued interactions when the server stops
+if os.environ.get('ENCODER_PRELOAD', '1') == '1':
+    # Load and warm up the compare model in the background, /api/compare waits for it if needed
+    threading.Thread(target=get_encoder().warmup, name='encoder-warmup', daemon=True).start()
+metrics = get_metrics() # Stage timings and request counters, exported by /metrics
+
+
+def pool_metrics() -> list:
+    # The state of the browser pool, read when /metrics is scraped
+    stats = get_pool().stats()
+    return [('scraper_browsers_open', {}, stats['open_browsers']), ('scraper_browser_pool_size', {}, stats['size']),
+            ('scraper_browser_queued_jobs', {}, stats['queued']),
+            ('scraper_browser_launches_total', {}, stats['launches']), ('scraper_browser_pages_total', {}, stats['pages'])]
+
+
+def render_cache_metrics() -> list:
+    # The counters of the render cache, read when /metrics is scraped
+    stats = get_render_cache().stats()
+    return [('scraper_render_cache_total', {'result': result}, stats[result])
+            for result in ('hits', 'disk_hits', 'misses', 'evictions')] + \
+           [('scraper_render_cache_entries', {}, stats['entries']), ('scraper_render_cache_bytes', {}, stats['bytes'])]
+
+
+def interaction_log_metrics() -> list:
+    # The counters of the interaction log, read when /metrics is scraped
+    stats = interactions.stats()
+    return [('scraper_interactions_total', {'result': result}, stats[result])
+            for result in ('logged', 'written', 'dropped')] + [('scraper_interaction_log_queued', {}, stats['queued'])]
+
+
+metrics.register(pool_metrics)
+metrics.register(render_cache_metrics)
+metrics.register(interaction_log_metrics)
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    metrics.inc('scraper_in_flight_requests', (('endpoint', request.endpoint or 'unknown'),))
+
+
+@app.after_request
+def count_request(response):
+    # The request is in flight until its response is closed: the end of the stream for the streamed ones
+    labels = (('endpoint', request.endpoint or 'unknown'),)
+    start = g.metrics_start
+
+    def finish():
+        metrics.inc('scraper_in_flight_requests', labels, -1)
+        metrics.observe('scraper_request_seconds', time.perf_counter() - start, labels)
+
+    metrics.inc('scraper_requests_total', labels + (('status', str(response.status_code)),))
+    response.call_on_close(finish)
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Export the stage timings, request counters, in-flight requests, open browsers and render cache counters in the
+    Prometheus text format.
+    Returns: Response: The metrics as text
+
+    """
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/extract-patterns', methods=['GET'])
 def extract_patterns():
     """
@@ -35,8 +113,8 @@ def extract_patterns():
         except ValueError:
             return jsonify({'error': 'Invalid URL'}), 400
 
-        # Extract prices
-        prices,description,stock = extract_pattern(url)
+        # Extract prices (max_age: maximum age in seconds of a cached rendering of the page)
+        prices,description,stock = extract_pattern(url, max_age=request.args.get('max_age', type=float))
 
         if not prices:
             return jsonify({'error': 'No prices found'}), 404
@@ -68,12 +146,12 @@ def extract_patterns():
             ]
         }
 
-        # Save interaction in session (it's possible to make a log file out of it)
-        if 'interactions' not in session:
-            session['interactions'] = []
-        session['interactions'].append(response)
+        # Log the interaction (see /api/interactions)
+        interactions.append('extract_patterns', url, request.remote_addr, prices=response['prices'],
+                            description=response['description'], stock=response['stock'])
 
-        return jsonify(response)
+        with span('api.serialize'):
+            return jsonify(response)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -90,6 +168,7 @@ def extract_price():
         param = request.args.get('param') # Get param from request
         descr_param = request.args.get('descr_param') # Get descr_param from request
         stock_param = request.args.get('stock_param') or None # Get stock_param from request or None if not provided
+        max_age = request.args.get('max_age', type=float) # Maximum age in seconds of a cached rendering of the page
         # Validate URL
         if not url:
             return jsonify({'error': 'URL is required'}), 400
@@ -105,45 +184,66 @@ def extract_price():
 
         # Extract values using DOMExtractor
         if not param:
-            price, title, description, stock = extractor.extract_values(url)
+            price, title, description, stock = extractor.extract_values(url, max_age=max_age)
         elif param and not descr_param:
             if (stock_param):
-                price, title, description, stock = extractor.extract_values(url, param, stock_param)
+                price, title, description, stock = extractor.extract_values(url, param, stock_param, max_age=max_age)
             else:
-                price, title, description, stock = extractor.extract_values(url, param)
+                price, title, description, stock = extractor.extract_values(url, param, max_age=max_age)
         else:
             if (stock_param):
-                price, title, description, stock = extractor.extract_values(url, param, descr_param, stock_param)
+                price, title, description, stock = extractor.extract_values(url, param, descr_param, stock_param, max_age=max_age)
             else:
-                price, title, description, stock = extractor.extract_values(url, param, descr_param)
+                price, title, description, stock = extractor.extract_values(url, param, descr_param, max_age=max_age)
 
         if not price:
             return jsonify({'error': 'No price found'}), 404
 
-        # Save interaction in session (you can also save it in a log file)
-        if 'interactions' not in session:
-            session['interactions'] = []
-        # Before saving to session, ensure data is serializable
-        session['interactions'].append({
-            'url': url,
-            'title': str(title) if title else '',
-            'price': str(price) if price else '',
-            'description': str(description) if description else '',
-            'stock': str(stock) if stock else ''
-        })
+        # Log the interaction (see /api/interactions), ensuring the data is serializable
+        interactions.append('extract_price', url, request.remote_addr,
+                            title=str(title) if title else '',
+                            price=str(price) if price else '',
+                            description=str(description) if description else '',
+                            stock=str(stock) if stock else '')
         # Format response
-        return jsonify({
-            'success': True,
-            'title': title,
-            'price': price.replace("TTC", ""), # Remove "TTC" from price if present
-            'description': description,
-            'descr_param': descr_param,
-            'stock': stock,
-            'url': url
-        })
+        with span('api.serialize'):
+            return jsonify({
+                'success': True,
+                'title': title,
+                'price': price.replace("TTC", ""), # Remove "TTC" from price if present
+                'description': description,
+                'descr_param': descr_param,
+                'stock': stock,
+                'url': url
+            })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+@app.route('/api/extract-price/batch', methods=['POST'])
+def extract_price_batch():
+    """
+    Extract prices from a list of URLs, rendered concurrently (see batch_extractor.py).
+    The body is a JSON object with an 'items' list, each item having a 'url' and optional 'param', 'descr_param'
+    and 'stock_param' (same format as /api/extract-price), and optional 'max_concurrency' and 'per_host' limits.
+    Returns: Response: NDJSON stream with one result per item, in completion order
+
+    """
+    body = request.get_json(silent=True) or {}
+    items = body.get('items')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'items must be a non-empty list'}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'Each item must be an object with a url'}), 400
+    try:
+        batch = BatchExtraction(
+            items, extractor,
+            max_concurrency=int(body.get('max_concurrency', os.environ.get('BATCH_MAX_CONCURRENCY', 8))),
+            per_host=int(body.get('per_host', os.environ.get('BATCH_PER_HOST', 2))),
+        )
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_concurrency and per_host must be integers'}), 400
+    return Response(stream_with_context(stream_ndjson(batch.start())), mimetype='application/x-ndjson')
+
 @app.route('/api/param_test', methods=['GET'])
 def param_test():
     try:
@@ -166,11 +266,91 @@ def param_test():
 @app.route('/api/interactions', methods=['GET'])
 def get_interactions():
     """
-    Get the list of interactions stored in the session. Possible to use it to make a log file
-    Returns: jsonify: JSON response containing the list of interactions
+    Get the logged interactions of all the clients, newest first, one page at a time (see interaction_log.py).
+    The optional parameters are 'limit' (50 by default, at most 500), 'before' (the 'next_before' cursor of the
+    previous page), and the filters 'endpoint' (extract_price or extract_patterns), 'domain', 'url' (a part of the
+    URL), 'client' (the client address), 'since' and 'until' (Unix times).
+    Returns: jsonify: JSON response containing the interactions and the cursor of the next page (null on the last)
+
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        before = request.args.get('before', type=int)
+        since = request.args.get('since', type=float)
+        until = request.args.get('until', type=float)
+    except ValueError:
+        return jsonify({'error': 'limit and before must be integers, since and until numbers'}), 400
+    page, next_before = interactions.query(limit, before, request.args.get('endpoint'), request.args.get('domain'),
+                                           request.args.get('url'), request.args.get('client'), since, until)
+    return jsonify({'interactions': page, 'next_before': next_before})
 
+@app.route('/api/render-cache', methods=['GET'])
+def render_cache_stats():
     """
-    return jsonify(session.get('interactions', []))
+    Get the counters of the rendered pages cache shared by /api/extract-patterns and /api/extract-price.
+    Returns: jsonify: JSON response containing the hits, misses and size of the cache
+
+    """
+    return jsonify(get_render_cache().stats())
+
+@app.route('/api/fetch-strategies', methods=['GET'])
+def fetch_strategies():
+    """
+    Get the fetch decision learned for every domain ("http-ok" or "needs-browser", see fetch_strategy.py).
+    Returns: jsonify: JSON response containing the decisions by domain
+
+    """
+    return jsonify(get_strategies().snapshot())
+
+@app.route('/api/recipes', methods=['GET'])
+def list_recipes():
+    """
+    Get the saved extraction recipes (see recipe_registry.py).
+    Returns: jsonify: JSON response containing the recipes
+
+    """
+    return jsonify(get_recipes().snapshot())
+
+@app.route('/api/recipes', methods=['POST'])
+def save_recipe():
+    """
+    Save the extraction recipe of a domain. /api/extract-price uses it for the pages of the domain when no params
+    are sent. The body is a JSON object with the 'url' of a page of the shop and the chosen 'price', 'description'
+    and 'stock' items of the /api/extract-patterns response (each with a 'tag' and 'attributes'), and optionally
+    'title' and 'currency' elements.
+    Returns: jsonify: JSON response containing the saved recipe
+
+    """
+    body = request.get_json(silent=True) or {}
+    url = body.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    try:
+        recipe = get_recipes().save(url, {field: body.get(field) for field in FIELDS})
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return jsonify({'error': f'Invalid recipe: {e}'}), 400
+    return jsonify(recipe.to_dict()), 201
+
+@app.route('/api/recipes/<domain>', methods=['DELETE'])
+def delete_recipe(domain):
+    """
+    Delete the extraction recipe of a domain.
+    Returns: jsonify: JSON response telling whether the domain had a recipe
+
+    """
+    if not get_recipes().delete(domain):
+        return jsonify({'error': 'No recipe for this domain'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/recipes/reload', methods=['POST'])
+def reload_recipes():
+    """
+    Reload and compile the recipes from the database (they are also reloaded when another process changes them).
+    Returns: jsonify: JSON response containing the number of recipes
+
+    """
+    get_recipes().reload()
+    return jsonify({'success': True, 'recipes': len(get_recipes().snapshot())})
 
 @app.route('/api/compare', methods=['GET'])
 def compare():
@@ -186,12 +366,47 @@ def compare():
         database = request.args.get('database')
         id_target = request.args.get('id_target')
         database_prefix = request.args.get('database_prefix')
+        incremental = request.args.get('incremental', '0') == '1' # Only match the history rows without a relation
 
-        result = compare_product(host, user, password, database, id_target, database_prefix)
+        result = compare_product(host, user, password, database, id_target, database_prefix, incremental=incremental)
         return jsonify({'success': True, 'result': result})
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+@app.route('/api/compare/jobs', methods=['POST'])
+def start_compare_job():
+    """
+    Start a bulk compare of several targets in the background (see compare_job.py).
+    The body is a JSON object with the connection settings of /api/compare ('host', 'user', 'passwd', 'database',
+    'database_prefix'), 'targets' (a list of id_target or "all"), and optional 'incremental' and 'workers'.
+    Returns: jsonify: JSON response containing the job status, with the job id to poll
+
+    """
+    body = request.get_json(silent=True) or {}
+    targets = body.get('targets')
+    if targets != 'all' and not (isinstance(targets, list) and targets):
+        return jsonify({'error': 'targets must be a non-empty list of id_target or "all"'}), 400
+    try:
+        job = start_job(body.get('host'), body.get('user'), body.get('passwd'), body.get('database'),
+                        body.get('database_prefix') or '', targets=None if targets == 'all' else targets,
+                        incremental=bool(body.get('incremental')), workers=body.get('workers') and int(body['workers']))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'targets and workers must be integers'}), 400
+    return jsonify({'success': True, 'job': job.status()}), 202
+
+@app.route('/api/compare/jobs/<job_id>', methods=['GET'])
+def compare_job_status(job_id):
+    """
+    Get the state of a bulk compare job and the progress and timings of each of its targets.
+    Returns: jsonify: JSON response containing the job status
+
+    """
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f'No compare job {job_id}'}), 404
+    return jsonify({'success': True, 'job': job.status()})
+
 if __name__ == '__main__':
     # Set the port from environment variable or default to 8000
     port = int(os.environ.get('PORT', 8000))
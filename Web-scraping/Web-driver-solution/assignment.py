@@ -0,0 +1,152 @@
+"""
+The one-to-one assignment of price history rows to target products used by compare.py.
+Each history row comes with its top-k candidate products (from the vector index); a product is given to at
+most one row, and the rows left without a product keep their most similar one, as before. A row without any
+valid candidate (-1 everywhere) is left at -1: the callers drop it instead of relating it to a product.
+All the solvers work on the sparse (rows x k) candidate lists, never on the full similarity matrix:
+- 'auction': Bertsekas' auction algorithm, maximizes the total similarity (within rows x eps of the optimum)
+- 'greedy': the candidate pairs by decreasing similarity, in O(M.k log(M.k)), independent of the row order
+- 'rows': the previous behaviour, rows in table order each taking their best free candidate
+"""
+import numpy as np
+
+METHODS = ('auction', 'greedy', 'rows')
+
+
+def _fallback(candidates: np.ndarray, assigned: np.ndarray) -> np.ndarray:
+    """
+    Give the rows without a product their most similar valid candidate, -1 if they have none.
+    """
+    missing = np.flatnonzero(assigned < 0)
+    if len(missing) and candidates.shape[1]:
+        valid = candidates[missing] >= 0 # The -1 padding of the index search or the candidates not in the products
+        first = valid.argmax(axis=1)
+        assigned[missing] = np.where(valid.any(axis=1), candidates[missing, first], -1)
+    return assigned
+
+
+def assign_rows(candidates: np.ndarray) -> np.ndarray:
+    """
+    Rows in order, each taking its best candidate that no previous row took.
+    Args:
+        candidates: The candidate products of each row (rows x k, best first, -1 for no candidate)
+
+    Returns: np.ndarray: The product of each row, -1 for the rows without any candidate
+
+    """
+    assigned = np.full(len(candidates), -1, dtype=np.int64)
+    taken = set()
+    for row, row_candidates in enumerate(candidates.tolist()):
+        for product in row_candidates:
+            if product >= 0 and product not in taken:
+                assigned[row] = product
+                taken.add(product)
+                break
+    return _fallback(candidates, assigned)
+
+
+def assign_greedy(scores: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    """
+    Take the candidate pairs by decreasing similarity, skipping the rows and products already assigned.
+    Args:
+        scores: The similarity of each candidate (rows x k)
+        candidates: The candidate products of each row (rows x k, -1 for no candidate)
+
+    Returns: np.ndarray: The product of each row, -1 for the rows without any candidate
+
+    """
+    rows, columns = np.nonzero(candidates >= 0)
+    order = np.argsort(-scores[rows, columns], kind='stable')
+    assigned = [-1] * len(candidates)
+    taken = set()
+    for row, product in zip(rows[order].tolist(), candidates[rows[order], columns[order]].tolist()):
+        if assigned[row] < 0 and product not in taken:
+            assigned[row] = product
+            taken.add(product)
+    return _fallback(candidates, np.array(assigned, dtype=np.int64))
+
+
+def assign_auction(scores: np.ndarray, candidates: np.ndarray, n_products: int, eps: float = 1e-3,
+                   max_rounds: int = 10000) -> np.ndarray:
+    """
+    Maximize the total similarity of the assigned pairs with the auction algorithm.
+    Every unassigned row bids for its best candidate (similarity minus price) at the same time, raising the
+    price of the product by the gap with its second best option plus eps. A row whose best option is to stay
+    without a product drops out. Each row has this private "no product" option valued at 0, so rows with more
+    similar rivals give up instead of bidding forever.
+    Args:
+        scores: The similarity of each candidate (rows x k)
+        candidates: The candidate products of each row (rows x k, -1 for no candidate)
+        n_products: The number of products
+        eps: The minimum bid increment (the result is within rows x eps of the optimal total similarity)
+        max_rounds: The maximum number of bidding rounds, the remaining rows then use the greedy solver
+
+    Returns: np.ndarray: The product of each row, -1 for the rows without any candidate
+
+    """
+    m, k = candidates.shape
+    valid = candidates >= 0
+    values = np.where(valid, scores, -np.inf).astype(np.float64)
+    safe = np.where(valid, candidates, 0)
+    prices = np.zeros(n_products, dtype=np.float64)
+    owner = np.full(n_products, -1, dtype=np.int64) # Row holding each product
+    assigned = np.full(m, -1, dtype=np.int64)
+    active = np.arange(m) # Rows still bidding
+    for _ in range(max_rounds):
+        if not len(active):
+            break
+        net = values[active] - prices[safe[active]]
+        if k > 1:
+            top2 = np.argpartition(-net, 1, axis=1)[:, :2]
+            pair = np.take_along_axis(net, top2, axis=1)
+            best_column = np.where(pair[:, 0] >= pair[:, 1], top2[:, 0], top2[:, 1])
+            best, second = pair.max(axis=1), np.maximum(pair.min(axis=1), 0.0)
+        else:
+            best, second, best_column = net[:, 0], np.zeros(len(active)), np.zeros(len(active), dtype=np.int64)
+        # Rows whose best option is no product drop out
+        bidding = best > 0
+        active = active[bidding]
+        if not len(active):
+            break
+        products = safe[active, best_column[bidding]]
+        bids = prices[products] + (best[bidding] - second[bidding]) + eps
+        # Each product goes to its highest bidder of the round
+        order = np.lexsort((-bids, products))
+        winners = order[np.concatenate([[True], products[order][1:] != products[order][:-1]])]
+        won_products = products[winners]
+        previous = owner[won_products]
+        assigned[previous[previous >= 0]] = -1
+        owner[won_products] = active[winners]
+        assigned[active[winners]] = won_products
+        prices[won_products] = bids[winners]
+        # The outbid owners and the losers of the round bid again
+        losers = np.setdiff1d(active, active[winners], assume_unique=True)
+        active = np.concatenate([losers, previous[previous >= 0]])
+    else:
+        # Too many rounds: finish the remaining rows greedily on the free products
+        free = candidates.copy()
+        free[np.isin(free, np.flatnonzero(owner >= 0))] = -1
+        remaining = assigned < 0
+        assigned[remaining] = assign_greedy(scores[remaining], free[remaining])
+    return _fallback(candidates, assigned)
+
+
+def assign(scores: np.ndarray, candidates: np.ndarray, n_products: int, method: str = 'auction') -> np.ndarray:
+    """
+    Assign one product to each row.
+    Args:
+        scores: The similarity of each candidate (rows x k, best first)
+        candidates: The candidate products of each row (rows x k, best first, -1 for no candidate)
+        n_products: The number of products
+        method: 'auction', 'greedy' or 'rows' (see the module documentation)
+
+    Returns: np.ndarray: The product of each row, -1 for the rows without any candidate
+
+    """
+    if method == 'auction':
+        return assign_auction(scores, candidates, n_products)
+    if method == 'greedy':
+        return assign_greedy(scores, candidates)
+    if method == 'rows':
+        return assign_rows(candidates)
+    raise ValueError(f"Unknown assignment method {method!r}, expected one of {', '.join(METHODS)}")
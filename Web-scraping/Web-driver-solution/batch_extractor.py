@@ -0,0 +1,180 @@
+"""
+Batch price extraction: render many URLs concurrently with Playwright's async API and hand out
+the results as soon as each page is done.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+
+from playwright.async_api import async_playwright
+
+from Values_extractor import DOMExtractor
+
+_DONE = object() # Marks the end of the results queue
+
+
+def _as_param(value) -> Optional[str]:
+    """
+    Accept a param either as the JSON string used by /api/extract-price or as an already decoded object.
+    Args:
+        value: The param from the batch item
+
+    Returns: str: The param as a JSON string, or None
+
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value.get('attributes'), dict):
+        value = dict(value, attributes=json.dumps(value['attributes']))
+    return json.dumps(value)
+
+
+class BatchExtraction:
+    """
+    A batch of extractions running in a background thread with its own event loop.
+    Pages are rendered concurrently, with a global limit and a limit per host, and every result is
+    pushed to a queue as soon as it is ready so a slow page doesn't hold back the rest of the batch.
+    """
+    def __init__(self, items: list, extractor: DOMExtractor, max_concurrency: int = 8, per_host: int = 2,
+                 timeout: int = 30000, wait: int = 2000):
+        """
+        Args:
+            items: The batch items, dictionaries with a 'url' and optional 'param', 'descr_param' and 'stock_param'
+            extractor: The extractor used to parse the rendered pages
+            max_concurrency: The maximum number of pages rendered at the same time
+            per_host: The maximum number of pages rendered at the same time for one host
+            timeout: The navigation timeout in milliseconds
+            wait: The time to wait after the navigation, in milliseconds
+        """
+        self.items = items
+        self.extractor = extractor
+        self.max_concurrency = max_concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.wait = wait
+        self._results = queue.Queue()
+        self._loop = None
+        self._task = None
+        self._thread = threading.Thread(target=self._run, name='batch-extraction', daemon=True)
+
+    def start(self) -> 'BatchExtraction':
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Stop rendering the remaining pages (e.g. when the client disconnected).
+        """
+        if self._loop is not None and self._task is not None and not self._loop.is_closed():
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                pass # The batch finished in the meantime
+
+    def results(self) -> Iterator[dict]:
+        """
+        Iterate over the results in completion order.
+        Returns: Iterator[dict]: One result per batch item
+
+        """
+        while True:
+            result = self._results.get()
+            if result is _DONE:
+                return
+            yield result
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._task = self._loop.create_task(self._run_batch())
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self._results.put({'success': False, 'error': f'Batch failed: {e}'})
+        finally:
+            self._loop.close()
+            self._results.put(_DONE)
+
+    async def _run_batch(self):
+        global_limit = asyncio.Semaphore(self.max_concurrency)
+        host_limits = {}
+        async with async_playwright() as playwright:
+            launch_options = {'headless': os.environ.get('BROWSER_HEADLESS', '0') == '1'}
+            proxy = os.environ.get('PROXY_SERVER', "socks5://127.0.0.1:8899")
+            if proxy:
+                launch_options['proxy'] = {"server": proxy}
+            browser = await playwright.chromium.launch(**launch_options)
+            try:
+                context = await browser.new_context(ignore_https_errors=True)
+                tasks = []
+                for index, item in enumerate(self.items):
+                    host = urlparse(item.get('url') or '').netloc
+                    if host not in host_limits:
+                        host_limits[host] = asyncio.Semaphore(self.per_host)
+                    tasks.append(asyncio.create_task(
+                        self._extract_item(context, index, item, global_limit, host_limits[host])))
+                await asyncio.gather(*tasks)
+            finally:
+                await browser.close()
+
+    async def _extract_item(self, context, index: int, item: dict, global_limit, host_limit):
+        url = item.get('url')
+        result = {'index': index, 'url': url}
+        start = time.perf_counter()
+        try:
+            parsed = urlparse(url or '')
+            if not all([parsed.scheme, parsed.netloc]):
+                raise ValueError('Invalid URL format')
+            async with host_limit, global_limit:
+                page = await context.new_page()
+                try:
+                    await page.goto(url, timeout=self.timeout)
+                    if self.wait:
+                        await page.wait_for_timeout(self.wait)
+                    html_content = await page.content()
+                finally:
+                    await page.close()
+            # Parse outside the event loop so the other pages keep rendering
+            price, title, description, stock = await asyncio.to_thread(
+                self.extractor.extract_page, url, html_content, _as_param(item.get('param')),
+                _as_param(item.get('descr_param')), _as_param(item.get('stock_param')))
+            if price:
+                result.update({
+                    'success': True,
+                    'title': title,
+                    'price': price.replace("TTC", ""), # Remove "TTC" from price if present
+                    'description': description,
+                    'stock': stock,
+                })
+            else:
+                result.update({'success': False, 'error': 'No price found'})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result.update({'success': False, 'error': str(e)})
+        result['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        self._results.put(result)
+
+
+def stream_ndjson(batch: BatchExtraction) -> Iterator[str]:
+    """
+    Stream the results of a batch as NDJSON, cancelling the batch if the client goes away.
+    Args:
+        batch: The started batch
+
+    Returns: Iterator[str]: One JSON line per result
+
+    """
+    try:
+        for result in batch.results():
+            yield json.dumps(result) + '\n'
+    finally:
+        batch.cancel()
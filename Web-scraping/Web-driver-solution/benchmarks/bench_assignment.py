@@ -0,0 +1,143 @@
+"""
+Compare the assignment solvers of assignment.py with the previous collision loop (a full argsort of the
+similarity column at every collision) on synthetic history rows whose true product is known, at 1k, 10k and
+100k rows: time, accuracy (rows given their true product), mean similarity and distinct products used.
+It first checks that the rows without a valid candidate (the -1 padding of the index search, or candidates
+missing from the products) are left at -1 by every solver, and exits with an error if one isn't.
+
+Usage: python benchmarks/bench_assignment.py [--sizes 1000 10000 100000] [--k 10]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from assignment import METHODS, assign
+from vector_index import _normalize
+
+
+def previous_assignment(products: np.ndarray, history: np.ndarray) -> np.ndarray:
+    """
+    The assignment of compare_product before the sparse candidates, on the dense similarity matrix.
+    """
+    similarities = _normalize(products) @ _normalize(history).T
+    most_similar_indices = similarities.argmax(axis=0)
+    assigned_indices = set()
+    for i in range(len(most_similar_indices)):
+        if most_similar_indices[i] in assigned_indices:
+            sorted_similarities = np.argsort(-similarities[:, i])
+            for idx in sorted_similarities:
+                if idx not in assigned_indices:
+                    most_similar_indices[i] = idx
+                    assigned_indices.add(idx)
+                    break
+        else:
+            assigned_indices.add(most_similar_indices[i])
+    return most_similar_indices
+
+
+def exact_top_k(products: np.ndarray, history: np.ndarray, k: int, chunk: int = 2048):
+    """
+    The exact top-k candidates of each history row (the assignment is measured apart from the index recall).
+    """
+    products, history = _normalize(products), _normalize(history)
+    scores = np.empty((len(history), k), dtype=np.float32)
+    candidates = np.empty((len(history), k), dtype=np.int64)
+    for start in range(0, len(history), chunk):
+        block = history[start:start + chunk] @ products.T
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        scores[start:start + chunk] = np.take_along_axis(top_scores, order, axis=1)
+        candidates[start:start + chunk] = np.take_along_axis(top, order, axis=1)
+    return scores, candidates
+
+
+def optimal_assignment(scores: np.ndarray, candidates: np.ndarray, n_products: int) -> np.ndarray:
+    """
+    The maximum total similarity one-to-one assignment (dense Hungarian solver), for the quality reference.
+    """
+    from scipy.optimize import linear_sum_assignment
+    weights = np.zeros((len(candidates), n_products))
+    rows = np.repeat(np.arange(len(candidates)), candidates.shape[1])
+    weights[rows, candidates.ravel()] = np.maximum(scores.ravel(), 0)
+    matched_rows, matched_products = linear_sum_assignment(weights, maximize=True)
+    assigned = candidates[:, 0].copy()
+    keep = weights[matched_rows, matched_products] > 0
+    assigned[matched_rows[keep]] = matched_products[keep]
+    return assigned
+
+
+def check_missing_candidates(rng, rows: int = 1000, k: int = 5, n_products: int = 300) -> list:
+    """
+    Run the solvers on candidates padded with -1: rows with no candidate at all, and rows whose first candidates
+    are -1. The first ones must get -1, the others one of their valid candidates.
+    Returns: list: Description of each failure
+
+    """
+    scores = np.sort(rng.random((rows, k)), axis=1)[:, ::-1].copy()
+    candidates = rng.integers(0, n_products, (rows, k))
+    candidates[:100] = -1 # No candidate
+    candidates[100:200, :2] = -1 # Missing first candidates
+    candidates[200:300, 3:] = -1 # Padding of the index search
+    failures = []
+    for method in METHODS:
+        assigned = assign(scores, candidates, n_products, method)
+        if (assigned[:100] != -1).any():
+            failures.append(f"{method}: rows without candidates were given a product")
+        valid = (assigned[100:] >= 0) & (assigned[100:, None] == candidates[100:]).any(axis=1)
+        if not valid.all():
+            failures.append(f"{method}: {np.sum(~valid)} rows given a product outside their valid candidates")
+    return failures
+
+
+def report(name: str, elapsed: float, assigned: np.ndarray, truth: np.ndarray, products: np.ndarray,
+           history: np.ndarray):
+    similarity = np.einsum('ij,ij->i', _normalize(products)[assigned], _normalize(history))
+    print(f"  {name:<22}{elapsed:9.3f}s  accuracy {np.mean(assigned == truth):.4f}  "
+          f"mean similarity {similarity.mean():.4f}  distinct products {len(np.unique(assigned))}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dim', type=int, default=64)
+    parser.add_argument('--previous-max', type=int, default=10000, help='Largest size run with the previous loop')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    failures = check_missing_candidates(rng)
+    if failures:
+        print("FAILED:\n  " + '\n  '.join(failures))
+        sys.exit(1)
+    print("Rows without a valid candidate are left unassigned by every solver")
+    for size in args.sizes:
+        # As many history rows as products: each product is scraped once, by a competitor wording it differently.
+        # Products come in families of close variants (colours, capacities) that compete for the same rows.
+        families = rng.standard_normal((max(size // 5, 1), args.dim)).astype(np.float32)
+        products = families[rng.integers(0, len(families), size)] + \
+            0.12 * rng.standard_normal((size, args.dim)).astype(np.float32)
+        truth = rng.permutation(size)
+        history = products[truth] + 0.3 * rng.standard_normal((size, args.dim)).astype(np.float32)
+        scores, candidates = exact_top_k(products, history, args.k)
+        print(f"{size} rows, {size} products, top-{args.k} candidates")
+        if size <= args.previous_max:
+            start = time.perf_counter()
+            assigned = previous_assignment(products, history)
+            report('previous (dense)', time.perf_counter() - start, assigned, truth, products, history)
+        if size <= 5000:
+            start = time.perf_counter()
+            assigned = optimal_assignment(scores, candidates, size)
+            report('optimal (Hungarian)', time.perf_counter() - start, assigned, truth, products, history)
+        for method in METHODS:
+            start = time.perf_counter()
+            assigned = assign(scores, candidates, size, method)
+            report(method, time.perf_counter() - start, assigned, truth, products, history)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare the per-URL latency of the shared browser pool against launching a browser for every request.
+
+Usage: python benchmarks/bench_browser_pool.py [--requests 20] [--size 2]
+"""
+import argparse
+import statistics
+import time
+
+from fixture_server import FixtureServer
+from playwright.sync_api import sync_playwright
+
+from browser_pool import BrowserPool
+
+
+def launch_per_request(url: str) -> str:
+    """
+    Render a page the way the extractors did before the pool: one browser per request.
+    """
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(headless=True)
+        page = browser.new_page()
+        try:
+            page.goto(url, timeout=30000)
+            return page.content()
+        finally:
+            browser.close()
+
+
+def report(name: str, latencies: list):
+    latencies = sorted(latencies)
+    print(f"{name:<20} mean {statistics.mean(latencies) * 1000:8.1f} ms   "
+          f"p50 {latencies[len(latencies) // 2] * 1000:8.1f} ms   "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--size', type=int, default=2)
+    args = parser.parse_args()
+
+    with FixtureServer() as server:
+        url = server.url('product_small.html')
+
+        latencies = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            launch_per_request(url)
+            latencies.append(time.perf_counter() - start)
+        report('browser per request', latencies)
+
+        pool = BrowserPool(size=args.size, proxy=None, headless=True)
+        try:
+            pool.fetch_html(url, wait=0) # Warm up
+            latencies = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                pool.fetch_html(url, wait=0)
+                latencies.append(time.perf_counter() - start)
+            report('browser pool', latencies)
+            print(pool.stats())
+        finally:
+            pool.close()
+
+
+if __name__ == '__main__':
+    main()
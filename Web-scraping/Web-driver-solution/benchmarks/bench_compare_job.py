@@ -0,0 +1,99 @@
+"""
+Compare refreshing many targets with one /api/compare call per target against one bulk compare job
+(compare_job.py), on the SQLite stand-in (benchmarks/sql_standin.py): total time, statements sent and texts
+embedded. The relations saved by both must be the same (up to rows tied on similarity).
+
+--hashing-encoder replaces the SentenceTransformer model with benchmarks/hashing_model.py.
+
+Usage: python benchmarks/bench_compare_job.py [--targets 50] [--products 500] [--history 5000] [--workers 4]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from hashing_model import use_hashing_model
+from sql_standin import StandInConnection, create_dataset
+
+from compare import compare_product
+from compare_job import CompareJob
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', type=int, default=50)
+    parser.add_argument('--products', type=int, default=500, help='Products per target')
+    parser.add_argument('--history', type=int, default=5000, help='Price history rows per target')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--hashing-encoder', action='store_true')
+    args = parser.parse_args()
+    if args.hashing_encoder:
+        use_hashing_model()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'compare.db')
+        create_dataset(StandInConnection(database), targets=args.targets, products=args.products,
+                       history=args.history)
+        print(f"{args.targets} targets, {args.products * args.targets} products, "
+              f"{args.history * args.targets} price history rows, {os.cpu_count()} CPUs")
+        connections = []
+
+        def connect() -> StandInConnection:
+            connections.append(StandInConnection(database))
+            return connections[-1]
+
+        def relations() -> list:
+            connection = StandInConnection(database)
+            saved = connection.sqlite.execute(
+                'SELECT id_history, id_product FROM product_history_relation ORDER BY id_history').fetchall()
+            connection.sqlite.execute('DELETE FROM product_history_relation')
+            connection.sqlite.commit()
+            return saved
+
+        # One call per target, as N /api/compare requests do
+        os.environ['VECTOR_INDEX_DIR'] = os.path.join(directory, 'per_target')
+        start = time.perf_counter()
+        encoded = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for id_target in range(1, args.targets + 1):
+                result = compare_product(None, None, None, None, id_target, '', db=connect())
+                encoded += result['encoded_products'] + result['encoded_history']
+        per_target_time = time.perf_counter() - start
+        per_target = relations()
+        print(f"  one call per target  {per_target_time:7.2f}s  {sum(c.round_trips for c in connections):>6} statements"
+              f"  {encoded:>8} texts embedded")
+
+        # One bulk job
+        os.environ['VECTOR_INDEX_DIR'] = os.path.join(directory, 'job')
+        connections.clear()
+        job = CompareJob('', targets=None, workers=args.workers, connect=connect).start()
+        job.wait()
+        status = job.status()
+        if status['state'] != 'done':
+            print(f"FAILED: the job ended in state {status['state']}: {status['error']}")
+            sys.exit(1)
+        print(f"  bulk job             {status['timings']['total_s']:7.2f}s  "
+              f"{sum(c.round_trips for c in connections):>6} statements  {status['counts']['unique_texts']:>8} "
+              f"texts embedded")
+        print(f"    load {status['timings']['load_s']}s, encode {status['timings']['encode_s']}s, "
+              f"match {status['timings']['match_s']}s ({args.workers} workers)")
+        failed = [target for target, target_status in status['targets'].items() if target_status['state'] != 'done']
+        if failed:
+            print(f"FAILED: targets not done: {failed}")
+            sys.exit(1)
+        # Rows with exactly the same similarity (e.g. the same words in another order with the hashing model) may
+        # swap products: the matrix products round differently with the shape of the batches
+        job_relations = relations()
+        same = sum(a == b for a, b in zip(job_relations, per_target))
+        print(f"  same relations: {same}/{len(per_target)}")
+        if len(job_relations) != len(per_target) or same < 0.999 * len(per_target):
+            print("FAILED: the job saved different relations")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare the peak memory (RSS) of a full compare_product run before and after the streaming loader, on a
+synthetic price history table of 1M rows in the SQLite stand-in (benchmarks/sql_standin.py).
+Each implementation runs in its own process, and the relations they save must be the same.
+
+--hashing-encoder replaces the SentenceTransformer model with benchmarks/hashing_model.py: the memory of the
+model weights is then not included.
+
+Usage: python benchmarks/bench_compare_memory.py [--history 1000000] [--products 10000] [--hashing-encoder]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from hashing_model import use_hashing_model
+from sql_standin import StandInConnection, create_dataset
+
+
+def current_rss_mb() -> float:
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def child(implementation: str, database: str, hashing_encoder: bool):
+    """
+    Run one compare_product and print its peak RSS as JSON.
+    """
+    if implementation == 'previous':
+        from legacy_compare import compare_product
+    else:
+        from compare import compare_product
+    from encoder import get_encoder
+
+    if hashing_encoder:
+        use_hashing_model()
+    get_encoder().load()
+    connection = StandInConnection(database)
+    baseline = current_rss_mb()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = compare_product(None, None, None, None, 1, '', db=connection)
+    print(json.dumps({
+        'seconds': time.perf_counter() - start,
+        'baseline_mb': baseline,
+        'peak_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'history': result['history'],
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--history', type=int, default=1000000)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--hashing-encoder', action='store_true')
+    parser.add_argument('--child', choices=['previous', 'streaming'], help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.db, args.hashing_encoder)
+        return
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'compare.db')
+        connection = StandInConnection(database)
+        create_dataset(connection, products=args.products, history=args.history)
+        print(f"{args.products} products, {args.history} price history rows "
+              f"({os.path.getsize(database) / 2 ** 20:.0f} MB SQLite file)")
+        relations = {}
+        for implementation in ('previous', 'streaming'):
+            connection.sqlite.execute('DELETE FROM product_history_relation')
+            connection.sqlite.commit()
+            environment = dict(os.environ, VECTOR_INDEX_DIR=os.path.join(directory, implementation))
+            command = [sys.executable, os.path.abspath(__file__), '--child', implementation, '--db', database]
+            if args.hashing_encoder:
+                command.append('--hashing-encoder')
+            output = subprocess.run(command, env=environment, capture_output=True, text=True)
+            if output.returncode < 0:
+                # Killed, usually by the kernel when the machine runs out of memory
+                print(f"  {implementation:<10} killed by signal {-output.returncode} (out of memory?)")
+                continue
+            if output.returncode:
+                print(output.stderr)
+                sys.exit(1)
+            stats = json.loads(output.stdout.strip().splitlines()[-1])
+            print(f"  {implementation:<10} {stats['seconds']:7.1f}s  peak RSS {stats['peak_mb']:7.0f} MB "
+                  f"(+{stats['peak_mb'] - stats['baseline_mb']:.0f} MB over the {stats['baseline_mb']:.0f} MB "
+                  f"before the call)")
+            relations[implementation] = connection.sqlite.execute(
+                'SELECT id_history, id_product FROM product_history_relation ORDER BY id_history').fetchall()
+        if len(relations) == 2 and relations['previous'] != relations['streaming']:
+            failures += 1
+            different = sum(a != b for a, b in zip(relations['previous'], relations['streaming']))
+            print(f"FAILED: {different} relations differ")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Product container scoring benchmark.
+Checks that the one-pass scorer picks the same container as the previous scorer (get_text and parents for
+every candidate) on the fixture corpus and on synthetic nested pages, for both parsers, and compares their timings.
+The copy of the scorer in price.py (DOMPriceExtractor) is checked too.
+
+Usage: python benchmarks/bench_container_scoring.py [--depths 50 200 800]
+"""
+import argparse
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+from fixture_server import load_corpus
+from legacy_extractor import LegacyDOMExtractor
+
+from Values_extractor import DOMExtractor
+from dom_scan import find_product_container
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from price import DOMPriceExtractor
+
+
+def nested_page(depth: int, products: int = 50) -> str:
+    """
+    Build a page whose product sits under many nested wrappers, next to a list of related products.
+    """
+    related = ''.join(f'<div class="item"><h2>Produit {i}</h2><p>Description du produit {i}, garantie 1 an.</p></div>'
+                      for i in range(products))
+    return ('<html><body>' + ''.join(f'<div class="wrap-{i}">' for i in range(depth)) +
+            '<section class="product-detail"><h1>Produit principal</h1><p>' + 'Description. ' * 40 + '</p>'
+            '<span class="price">1 299,000 DT</span></section>' + '</div>' * depth +
+            f'<div class="related">{related}</div></body></html>')
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--depths', type=int, nargs='+', default=[50, 200, 800])
+    args = parser.parse_args()
+
+    legacy, extractor, price_extractor = LegacyDOMExtractor(), DOMExtractor(), DOMPriceExtractor()
+    pages = {name.split('#')[0]: html for name, html, *_ in load_corpus()}
+    pages.update({f'nested depth {depth}': nested_page(depth) for depth in args.depths})
+
+    mismatches = 0
+    print(f"{'page':<24}{'parser':>12}{'legacy ms':>12}{'one-pass ms':>14}{'speedup':>10}")
+    for name, html in pages.items():
+        for features in ('lxml', 'html.parser'):
+            soup = BeautifulSoup(html, features)
+            # DOMExtractor: the scorer runs during the traversal, on the unmodified tree
+            container = extractor._find_product_container(extractor._scan(soup))
+            found = container[0] if container else None
+            # DOMPriceExtractor: the scorer runs on the cleaned tree
+            for tag in soup(list(extractor.pruned_tags)):
+                tag.decompose()
+            expected, legacy_time = timed(legacy._find_product_container, soup)
+            expected = None if expected is soup else expected
+            cleaned, new_time = timed(find_product_container, soup, extractor.product_indicators)
+            priced = price_extractor._find_product_container(soup)
+            if found is not expected or cleaned is not expected or (None if priced is soup else priced) is not expected:
+                mismatches += 1
+                print(f"MISMATCH {name} ({features})")
+            print(f"{name:<24}{features:>12}{legacy_time * 1000:12.2f}{new_time * 1000:14.2f}"
+                  f"{legacy_time / new_time:9.2f}x")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
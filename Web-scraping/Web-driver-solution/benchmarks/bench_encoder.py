@@ -0,0 +1,69 @@
+"""
+Measure where a compare call spends its time: loading the SentenceTransformer model (once per process with
+the resident encoder) and encoding the texts, with and without the deduplication of repeated texts.
+The texts are synthetic catalogue and price history rows where, as in real scraping data, the same product
+appears many times.
+
+Usage: python benchmarks/bench_encoder.py [--rows 5000] [--distinct 800] [--batch-size 64]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from encoder import Encoder
+
+WORDS = ['climatiseur', 'samsung', 'inverter', 'btu', 'trottinette', 'electrique', 'pliable', 'noir', 'blanc',
+         'smartphone', 'ecran', 'pouces', 'go', 'ram', 'stockage', 'lave', 'linge', 'kg', 'refrigerateur', 'litres']
+
+
+def synthetic_texts(rows: int, distinct: int, seed: int = 0) -> list:
+    """
+    Build the texts compare_product encodes (title three times, description, price) for rows drawn among
+    a number of distinct products.
+    """
+    rng = random.Random(seed)
+    products = []
+    for index in range(distinct):
+        title = ' '.join(rng.choice(WORDS) for _ in range(6)) + f' {index}'
+        description = ' '.join(rng.choice(WORDS) for _ in range(25))
+        products.append(f"{title} {title} {title} {description} {rng.randint(50, 5000)}.000")
+    return [rng.choice(products) for _ in range(rows)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--distinct', type=int, default=800)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args()
+
+    texts = synthetic_texts(args.rows, args.distinct)
+    encoder = Encoder(batch_size=args.batch_size)
+    encoder.load()
+    start = time.perf_counter()
+    encoder.load() # Already resident: free
+    second_load = time.perf_counter() - start
+    encoder.warmup()
+
+    start = time.perf_counter()
+    every_row = encoder.model.encode(texts, batch_size=args.batch_size, convert_to_numpy=True)
+    all_time = time.perf_counter() - start
+    start = time.perf_counter()
+    unique_rows = encoder.encode(texts)
+    unique_time = time.perf_counter() - start
+
+    print(f"model load: {encoder.load_seconds:.2f}s (first), {second_load * 1000:.3f} ms (resident)")
+    print(f"encode {len(texts)} rows one by one:       {all_time:8.2f}s")
+    print(f"encode {len(set(texts))} unique texts, mapped back: {unique_time:8.2f}s  x{all_time / unique_time:.1f}")
+    if not np.allclose(every_row, unique_rows, atol=1e-5):
+        print("FAILED: the deduplicated vectors differ from the per-row vectors")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
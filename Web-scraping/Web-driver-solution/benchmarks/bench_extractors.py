@@ -0,0 +1,199 @@
+"""
+Micro-benchmark suite of the extraction stages, on the saved pages of benchmarks/fixtures, without browser or
+network:
+- parse: BeautifulSoup(html, 'lxml')
+- DOMExtractor.get_price / DOMExtractor.get_title, on a parsed page
+- extract_pattern: the parse and scan phase (extract_pattern_from_html)
+- extract_from_html: DOMExtractor's whole extraction, for each case of corpus.json (with its params, including the
+  cases that raise)
+- DOMPriceExtractor.get_price / DOMPriceExtractor.get_title (price.py), on a page parsed with html.parser
+For each stage and page it reports the ms per page (best of --repeat runs), the peak of the memory allocated
+during the run and the memory still allocated after it (tracemalloc, in a separate run from the timed ones), then
+the peak RSS of the process.
+
+--check compares them with the stored baseline (fixtures/extraction_baseline.json) and exits with an error when a
+stage is more than --tolerance slower on the pages (geometric mean) or allocates more than --memory-tolerance over
+its peak on a page. The timings are scaled by a calibration loop run between them, also stored in the baseline, so a
+baseline stored on another machine (or on a busier one) still applies.
+--update-baseline stores the current results as the baseline.
+
+Usage: python benchmarks/bench_extractors.py [--repeat 7] [--check | --update-baseline] [--stages parse ...]
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+from bs4 import BeautifulSoup
+from bench_values_extractor import run as extract
+from fixture_server import FIXTURES_DIR, load_corpus
+
+from Pattern_extractor import extract_pattern_from_html
+from Values_extractor import DOMExtractor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from price import DOMPriceExtractor
+
+BASELINE = os.path.join(FIXTURES_DIR, 'extraction_baseline.json')
+
+
+def calibrate() -> float:
+    """
+    The time of a short fixed workload close to the stages' (Python string and dict work), in milliseconds.
+    """
+    start = time.perf_counter()
+    counts = {}
+    for i in range(5000):
+        key = f'tag-{i % 997}'
+        counts[key] = counts.get(key, 0) + len(key.split('-'))
+    return (time.perf_counter() - start) * 1000
+
+
+def stages() -> dict:
+    """
+    The stages, each a (prepare, run) pair: prepare(html) builds the input of one run outside the measure,
+    run(input, params) is measured.
+    """
+    extractor, price_extractor = DOMExtractor(), DOMPriceExtractor()
+    parsed = lambda html: BeautifulSoup(html, 'lxml')
+    parsed_for_price = lambda html: BeautifulSoup(html, 'html.parser') # As price.py parses
+    return {
+        'parse': (lambda html: html, lambda html, params: BeautifulSoup(html, 'lxml')),
+        'DOMExtractor.get_price': (parsed, lambda soup, params: extractor.get_price(soup)),
+        'DOMExtractor.get_title': (parsed, lambda soup, params: extractor.get_title(soup)),
+        'extract_pattern': (lambda html: html, lambda html, params: extract_pattern_from_html(html)),
+        'extract_from_html': (lambda html: html, lambda html, params: extract(extractor, html, *params)),
+        # The DOMPriceExtractor methods remove tags from the page: each run gets its own copy
+        'DOMPriceExtractor.get_price': (parsed_for_price, lambda soup, params: price_extractor.get_price(soup)),
+        'DOMPriceExtractor.get_title': (parsed_for_price, lambda soup, params: price_extractor.get_title(soup)),
+    }
+
+
+def cases(stage: str) -> list:
+    # extract_from_html runs every case of the corpus, the other stages every page once
+    corpus = load_corpus()
+    if stage == 'extract_from_html':
+        return [(name, html, params) for name, html, *params in corpus]
+    pages = {}
+    for name, html, *_ in corpus:
+        pages.setdefault(name.split('#')[0], html)
+    return [(name, html, ()) for name, html in pages.items()]
+
+
+def measure(prepare, run, html: str, params, repeat: int) -> dict:
+    """
+    Time a stage on a page, then trace its allocations.
+    The speed of a shared machine drifts during a run: the calibration runs between the timed runs, so the timings
+    are compared with the baseline at the speed the machine had then.
+    Returns: dict: ms (best run), calibration_ms (best calibration), peak_kb and retained_kb
+
+    """
+    timings, calibrations = [], []
+    with contextlib.redirect_stdout(io.StringIO()): # The extractors print debugging information
+        for _ in range(repeat):
+            value = prepare(html)
+            gc.collect() # The garbage of the previous run isn't collected during this one
+            calibrations.extend(calibrate() for _ in range(3))
+            start = time.perf_counter()
+            run(value, params)
+            timings.append(time.perf_counter() - start)
+        value = prepare(html)
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        result = run(value, params) # Kept until the memory is read, like the caller would
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    del result
+    return {'ms': min(timings) * 1000, 'calibration_ms': min(calibrations), 'peak_kb': (peak - before) / 1024,
+            'retained_kb': (current - before) / 1024}
+
+
+def slowdown(result: dict, reference: dict) -> float:
+    # The time of a run over the baseline's, at the same machine speed
+    return result['ms'] / result['calibration_ms'] / (reference['ms'] / reference['calibration_ms'])
+
+
+def compare(results: dict, baseline: dict, tolerance: float, memory_tolerance: float) -> list:
+    """
+    The regressions of the results against the baseline: the stages slower on their pages (the geometric mean of the
+    slowdowns, one page alone is mostly noise), and the pages that allocate more.
+    Args:
+        results: The measures of each stage and page
+        baseline: The stored baseline
+        tolerance: The allowed slowdown
+        memory_tolerance: The allowed growth of the peak memory
+
+    Returns: list: Description of each regression
+
+    """
+    regressions, slowdowns = [], defaultdict(list)
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        slowdowns[key.split(' ')[0]].append(slowdown(result, reference))
+        if result['peak_kb'] > reference['peak_kb'] * (1 + memory_tolerance) + 16:
+            regressions.append(f"{key}: peak {result['peak_kb']:.0f} KB, baseline {reference['peak_kb']:.0f} KB")
+    for stage, ratios in slowdowns.items():
+        ratio = statistics.geometric_mean(ratios)
+        if ratio > 1 + tolerance:
+            regressions.append(f"{stage}: {ratio:.2f}x the baseline time")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--stages', nargs='+', help='Only run these stages')
+    parser.add_argument('--check', action='store_true', help='Fail on a regression against the baseline')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.3, help='Allowed slowdown, 0.3 for 30%%')
+    parser.add_argument('--memory-tolerance', type=float, default=0.2, help='Allowed growth of the peak memory')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.check:
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'stage':<30}{'page':<26}{'ms/page':>9}{'peak KB':>10}{'retained KB':>13}{'vs baseline':>13}")
+    for stage, (prepare, run) in stages().items():
+        if args.stages and stage not in args.stages:
+            continue
+        total = 0.0
+        for name, html, params in cases(stage):
+            result = results[f'{stage} {name}'] = measure(prepare, run, html, params, args.repeat)
+            total += result['ms']
+            reference = baseline.get(f'{stage} {name}')
+            ratio = f"{slowdown(result, reference):12.2f}x" if reference else ''
+            print(f"{stage:<30}{name:<26}{result['ms']:9.2f}{result['peak_kb']:10.0f}{result['retained_kb']:13.0f}{ratio}")
+        print(f"{stage:<30}{'total':<26}{total:9.2f}")
+    print(f"Peak RSS of the process {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+    if args.update_baseline:
+        stored = {}
+        if os.path.exists(BASELINE) and args.stages:
+            with open(BASELINE) as f:
+                stored = json.load(f) # The stages that didn't run keep their baseline
+        stored.update({key: {name: round(value, 3) for name, value in result.items()} for key, result in results.items()})
+        with open(BASELINE, 'w') as f:
+            json.dump(stored, f, indent=1, sort_keys=True)
+        print(f"Baseline stored in {BASELINE}")
+    if baseline:
+        regressions = compare(results, baseline, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print(f"FAILED: {len(regressions)} regression(s) past the baseline\n  " + '\n  '.join(regressions))
+            sys.exit(1)
+        print("No regression past the baseline")
+
+if __name__ == '__main__':
+    main()
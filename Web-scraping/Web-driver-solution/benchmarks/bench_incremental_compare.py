@@ -0,0 +1,65 @@
+"""
+Show that an incremental /api/compare run costs O(new rows): after a full run, new price history rows are
+scraped and the incremental run only fetches, encodes and matches those, reusing the product vectors cached
+in the target's vector index.
+The database is a SQLite stand-in for MySQL (benchmarks/sql_standin.py).
+
+Usage: python benchmarks/bench_incremental_compare.py [--products 2000] [--history 20000] [--new 200]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from sql_standin import StandInConnection, add_history, create_dataset
+
+from compare import compare_product
+
+
+def timed_run(connection: StandInConnection, incremental: bool) -> tuple[dict, float]:
+    connection.reset_counters()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = compare_product(None, None, None, None, 1, '', incremental=incremental, db=connection)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--history', type=int, default=20000)
+    parser.add_argument('--new', type=int, default=200, help='History rows added before each incremental run')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ['VECTOR_INDEX_DIR'] = directory
+        connection = StandInConnection()
+        create_dataset(connection, products=args.products, history=args.history)
+        print(f"{'run':<34}{'time s':>8}{'fetched':>10}{'encoded products':>18}{'encoded history':>17}")
+        runs = [('full', False, 0), ('incremental, nothing new', True, 0),
+                (f'incremental, {args.new} new rows', True, args.new),
+                (f'incremental, {args.new * 10} new rows', True, args.new * 10)]
+        failures = 0
+        for name, incremental, new_rows in runs:
+            if new_rows:
+                add_history(connection, '', new_rows, seed=new_rows)
+            result, elapsed = timed_run(connection, incremental)
+            print(f"{name:<34}{elapsed:8.2f}{connection.rows_fetched:10d}{result['encoded_products']:18d}"
+                  f"{result['encoded_history']:17d}")
+            if incremental and (result['encoded_history'] != new_rows or result['encoded_products'] != 0):
+                failures += 1
+                print(f"FAILED: expected {new_rows} encoded history rows and no product")
+        matched = connection.sqlite.execute('SELECT COUNT(*) FROM product_history_relation').fetchone()[0]
+        total = connection.sqlite.execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+        print(f"relations: {matched} for {total} history rows")
+        if matched != total:
+            failures += 1
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
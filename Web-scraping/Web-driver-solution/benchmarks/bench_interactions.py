@@ -0,0 +1,138 @@
+"""
+Measure the request latency of logging an interaction, as more interactions were logged:
+- session: the previous storage, the interactions list of a filesystem Flask-Session (needs flask_session, the
+  previous dependency), loaded and saved whole by every request of the client
+- log: the append-only log of interaction_log.py, written by its background thread
+Each app serves a request logging the extract-patterns result of product_small.html, after N interactions were
+already logged by the same client. Then it times /api/interactions queries on the log: the first page, a page
+further back with the cursor and a filtered page.
+
+Usage: python benchmarks/bench_interactions.py [--sizes 0 1000 5000 20000] [--requests 50]
+"""
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import tempfile
+import time
+
+from fixture_server import FIXTURES_DIR
+from flask import Flask, jsonify, request, session
+from flask_session import Session
+
+from interaction_log import InteractionLog
+from Pattern_extractor import extract_pattern_from_html
+
+URL = 'http://shop.example.com/product_small.html'
+
+
+def interaction() -> dict:
+    # The values extract_patterns logs for product_small.html
+    with open(os.path.join(FIXTURES_DIR, 'product_small.html'), encoding='utf-8') as f:
+        html = f.read()
+    with contextlib.redirect_stdout(io.StringIO()): # The extractor prints debugging information
+        prices, description, stock = extract_pattern_from_html(html)
+    return {
+        'prices': [{'price': item['price'], 'tag': item['tag_name'], 'attributes': item['attributes']} for item in prices],
+        'description': [{'text_content': item['text_content'], 'tag': item['tag_name'], 'attributes': item['attributes']}
+                        for item in description],
+        'stock': [{'stock': item['text_content'], 'tag': item['tag_name'], 'attributes': item['attributes']}
+                  for item in stock],
+    }
+
+
+def session_app(directory: str, values: dict) -> Flask:
+    app = Flask(__name__)
+    app.config.update(SESSION_TYPE='filesystem', SESSION_FILE_DIR=directory, SESSION_FILE_THRESHOLD=10 ** 9)
+    Session(app)
+
+    @app.route('/extract')
+    def extract():
+        # As api.py logged the interactions before the log
+        if 'interactions' not in session:
+            session['interactions'] = []
+        session['interactions'].append(dict(values, url=URL))
+        return jsonify(values)
+
+    @app.route('/fill')
+    def fill():
+        session['interactions'] = [dict(values, url=URL) for _ in range(int(request.args['n']))]
+        return jsonify(len(session['interactions']))
+
+    return app
+
+
+def log_app(log: InteractionLog, values: dict) -> Flask:
+    app = Flask(__name__)
+
+    @app.route('/extract')
+    def extract():
+        log.append('extract_patterns', URL, request.remote_addr, **values)
+        return jsonify(values)
+
+    return app
+
+
+def median_ms(client, path: str, requests: int) -> float:
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        client.get(path).close()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 1000, 5000, 20000],
+                        help='Interactions logged before the timed requests')
+    parser.add_argument('--requests', type=int, default=50, help='Timed requests per size')
+    args = parser.parse_args()
+    values = interaction()
+
+    print(f"{'logged':>8}{'session ms':>12}{'log ms':>10}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            client = session_app(os.path.join(directory, 'sessions'), values).test_client()
+            client.get(f'/fill?n={size}').close()
+            session_ms = median_ms(client, '/extract', args.requests)
+
+            log = InteractionLog(os.path.join(directory, 'log'), segment_bytes=4 * 1024 * 1024)
+            for _ in range(size):
+                log.append('extract_patterns', URL, '127.0.0.1', **values)
+            log.flush(60)
+            log_ms = median_ms(log_app(log, values).test_client(), '/extract', args.requests)
+            log.close()
+        print(f"{size:>8}{session_ms:12.2f}{log_ms:10.2f}")
+
+    # The queries of /api/interactions on a log of the largest size, with a few other domains and clients
+    size = max(args.sizes)
+    with tempfile.TemporaryDirectory() as directory:
+        log = InteractionLog(directory, segment_bytes=4 * 1024 * 1024)
+        for i in range(size):
+            log.append('extract_patterns', URL if i % 10 else 'http://www.other.example.org/item', f'10.0.0.{i % 4}',
+                       **values)
+        log.flush(60)
+        page, cursor = log.query(50)
+        queries = {
+            'first page': lambda: log.query(50),
+            'next page': lambda: log.query(50, before=cursor),
+            'page from the middle': lambda: log.query(50, before=size // 2),
+            'domain filter': lambda: log.query(50, domain='other.example.org'),
+            'client and domain filters': lambda: log.query(50, domain='other.example.org', client='10.0.0.2'),
+        }
+        stats = log.stats()
+        print(f"\n/api/interactions on {size} interactions ({stats['rotations'] + 1} segments written)")
+        for name, query in queries.items():
+            timings = []
+            for _ in range(args.requests):
+                start = time.perf_counter()
+                query()
+                timings.append(time.perf_counter() - start)
+            print(f"{name:<28}{statistics.median(timings) * 1000:8.2f} ms")
+        log.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Measure the overhead of the stage metrics (metrics.py):
+- the cost of an empty span, with the metrics enabled and disabled (METRICS_ENABLED=0)
+- DOMExtractor.extract_from_html and extract_pattern_from_html on the fixture corpus, with and without metrics, and
+  the cost of the spans they record (the difference of the timings is below the noise of most machines)
+- the time to render /metrics once the stages of every corpus page were recorded, with 8 threads recording spans
+
+Usage: python benchmarks/bench_metrics.py [--repeat 7]
+"""
+import argparse
+import contextlib
+import io
+import threading
+import time
+
+from fixture_server import load_corpus
+
+from metrics import get_metrics, span
+from Pattern_extractor import extract_pattern_from_html
+from Values_extractor import DOMExtractor
+
+
+def best_time(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def empty_spans(count: int):
+    for _ in range(count):
+        with span('bench.empty'):
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=7)
+    args = parser.parse_args()
+    metrics = get_metrics()
+    extractor = DOMExtractor()
+    corpus = load_corpus()
+
+    def extract_corpus():
+        with contextlib.redirect_stdout(io.StringIO()): # The extractors print debugging information
+            for _, html, *params in corpus:
+                try:
+                    extractor.extract_from_html(html, *params)
+                except Exception:
+                    pass # Some cases of the corpus raise on purpose
+            for _, html, *_ in corpus:
+                extract_pattern_from_html(html)
+
+    count = 100000
+    results = {}
+    for enabled in (False, True, False, True): # Interleaved, so a drift of the machine speed hits both
+        metrics.enabled = enabled
+        span_s = best_time(lambda: empty_spans(count), args.repeat) / count
+        corpus_s = best_time(extract_corpus, args.repeat)
+        previous = results.get(enabled, (float('inf'), float('inf')))
+        results[enabled] = (min(previous[0], span_s), min(previous[1], corpus_s))
+
+    (span_off, corpus_off), (span_on, corpus_on) = results[False], results[True]
+    before = sum(sum(histogram.counts) for histogram in metrics._histograms.values())
+    extract_corpus()
+    spans = sum(sum(histogram.counts) for histogram in metrics._histograms.values()) - before
+    print(f"empty span: {span_off * 1e9:.0f} ns disabled, {span_on * 1e9:.0f} ns enabled")
+    print(f"corpus ({len(corpus)} extract_from_html + {len(corpus)} extract_pattern_from_html): "
+          f"{corpus_off * 1000:.1f} ms without metrics, {corpus_on * 1000:.1f} ms with metrics "
+          f"({(corpus_on / corpus_off - 1) * 100:+.2f}%, mostly the noise of the machine)")
+    print(f"{spans} spans per run of the corpus: {spans * span_on * 1000:.3f} ms, "
+          f"{spans * span_on / corpus_off * 100:.3f}% of the extraction time")
+
+    metrics.enabled = True
+    threads = [threading.Thread(target=empty_spans, args=(count // 8,)) for _ in range(8)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    contended = (time.perf_counter() - start) / count
+    start = time.perf_counter()
+    text = metrics.render()
+    render_s = time.perf_counter() - start
+    print(f"span with 8 threads recording: {contended * 1e9:.0f} ns")
+    print(f"/metrics: {render_s * 1000:.2f} ms for {len(text.splitlines())} lines")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Price detection benchmark.
+Checks that extract_pattern finds the same prices as the previous implementation on the fixture corpus,
+then compares the price detection of both implementations on synthetic pages of growing size.
+
+Usage: python benchmarks/bench_price_detection.py [--sizes 10000 100000 1000000] [--legacy-max 100000]
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+from fixture_server import load_corpus
+from legacy_extractor import legacy_extract_pattern_from_html
+
+from Pattern_extractor import PRICE_PATTERNS, PRICE_REGEX, PRUNED_TAGS, extract_pattern_from_html
+from dom_scan import scan_page
+
+
+def synthetic_page(nodes: int, seed: int = 0) -> str:
+    """
+    Build a product listing page with about the given number of elements, nested a few levels deep.
+    """
+    rng = random.Random(seed)
+    blocks = []
+    count = 0
+    while count < nodes:
+        price = f"{rng.randint(1, 9)} {rng.randint(0, 999):03d},{rng.randint(0, 999):03d} DT"
+        blocks.append(
+            f'<div class="product-item"><div class="details"><div class="name"><span>Produit {count}</span></div>'
+            f'<div class="price-box"><p><span class="price">{price}</span></p></div>'
+            f'<ul><li><a href="/p/{count}">Voir</a></li></ul><p>Garantie {rng.randint(1, 3)} ans</p></div></div>')
+        count += 11
+    return f'<html><head><title>Liste</title></head><body><main class="content">{"".join(blocks)}</main></body></html>'
+
+
+def legacy_detection(soup) -> list:
+    """
+    The previous price loop of extract_pattern: decompose, then get_text() and every pattern on all the elements.
+    """
+    for tag in soup(list(PRUNED_TAGS)):
+        tag.decompose()
+    prices = []
+    for element in soup.find_all(True, recursive=True):
+        text = element.get_text().strip()
+        if any(re.match(pattern, text) for pattern in PRICE_PATTERNS) and element.attrs:
+            prices.append(text)
+    return prices
+
+
+def detection(soup) -> list:
+    scan = scan_page(soup, PRUNED_TAGS, price_regex=PRICE_REGEX, price_tags=None)
+    return [text for _, element, text in scan.prices if element.attrs]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help='Largest page measured with the previous implementation (it is quadratic)')
+    args = parser.parse_args()
+
+    mismatches = 0
+    for name, html, *_ in load_corpus():
+        if legacy_extract_pattern_from_html(html) != extract_pattern_from_html(html):
+            mismatches += 1
+            print(f"MISMATCH {name}")
+    print(f"extract_pattern: {'same results' if not mismatches else f'{mismatches} mismatches'} on the fixture corpus")
+
+    print(f"{'elements':>10}{'legacy ms':>14}{'linear ms':>14}{'prices':>10}")
+    for size in args.sizes:
+        html = synthetic_page(size)
+        soup = BeautifulSoup(html, 'lxml')
+        elements = len(soup.find_all(True))
+        start = time.perf_counter()
+        prices = detection(soup)
+        linear = time.perf_counter() - start
+        legacy = '-'
+        if size <= args.legacy_max:
+            start = time.perf_counter()
+            expected = legacy_detection(soup)
+            legacy = f"{(time.perf_counter() - start) * 1000:.1f}"
+            if expected != prices:
+                mismatches += 1
+                print(f"MISMATCH synthetic page of {size} elements")
+        print(f"{elements:>10}{legacy:>14}{linear * 1000:>14.1f}{len(prices):>10}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Compare the extraction with a saved domain recipe (compiled XPath selectors, no heuristics) to the current
+param-driven extraction on the fixture corpus, check that both return the same values, and check that a
+recipe saved by another connection is picked up without a restart.
+
+Usage: python benchmarks/bench_recipes.py [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from fixture_server import FIXTURES_DIR, load_corpus
+
+from Values_extractor import DOMExtractor
+from recipe_registry import RecipeRegistry
+
+
+def best_time(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # The extractor prints debugging information
+            function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with open(os.path.join(FIXTURES_DIR, 'corpus.json')) as f:
+        cases = json.load(f)
+    extractor = DOMExtractor()
+    failures = 0
+    total_params = total_recipe = 0.0
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'recipes.db')
+        registry = RecipeRegistry(path)
+        print(f"{'case':<28}{'params ms':>12}{'recipe ms':>12}{'speedup':>10}")
+        for case, (name, html, *params) in zip(cases, load_corpus()):
+            if not case.get('param'):
+                continue # A recipe always has a price element
+            recipe = registry.save('https://shop.example/', {
+                'price': case['param'], 'description': case.get('descr_param'), 'stock': case.get('stock_param')})
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = extractor.extract_from_html(html, *params)
+            actual = extractor.extract_with_recipe(recipe, html)
+            if expected != actual:
+                failures += 1
+                print(f"MISMATCH {name}\n  expected {expected!r}\n  actual   {actual!r}")
+            params_time = best_time(lambda: extractor.extract_from_html(html, *params), args.repeat)
+            recipe_time = best_time(lambda: extractor.extract_with_recipe(recipe, html), args.repeat)
+            total_params += params_time
+            total_recipe += recipe_time
+            print(f"{name:<28}{params_time * 1000:12.2f}{recipe_time * 1000:12.2f}{params_time / recipe_time:9.2f}x")
+        print(f"{'total':<28}{total_params * 1000:12.2f}{total_recipe * 1000:12.2f}{total_params / total_recipe:9.2f}x")
+
+        # Hot reload: another process (here another connection) saves a recipe
+        RecipeRegistry(path).save('https://other-shop.example/', {'price': {'tag': 'span', 'attributes': {'class': 'price'}}})
+        start = time.perf_counter()
+        reloaded = registry.for_url('https://www.other-shop.example/product')
+        lookup = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(1000):
+            registry.for_url('https://other-shop.example/product')
+        print(f"hot reload: {'ok' if reloaded else 'FAILED'} ({lookup * 1000:.2f} ms), "
+              f"lookup without changes: {(time.perf_counter() - start) * 1000:.3f} us")
+        if reloaded is None:
+            failures += 1
+    if failures:
+        print(f"{failures} check(s) failed")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Run the usual extract-patterns then extract-price flow against the local fixture site and check that the
+second request is served from the render cache, without touching the browser or the site.
+
+Usage: python benchmarks/bench_render_cache.py [--disk-dir /tmp/render-cache]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+os.environ.setdefault('PROXY_SERVER', '') # The fixture site is local
+os.environ.setdefault('BROWSER_HEADLESS', '1')
+
+from fixture_server import FixtureServer
+
+import render_cache
+from Pattern_extractor import extract_pattern
+from Values_extractor import DOMExtractor
+from browser_pool import close_pool, get_pool
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--disk-dir', help='Enable the compressed on-disk tier in this directory')
+    args = parser.parse_args()
+    render_cache._cache = render_cache.RenderCache(disk_dir=args.disk_dir)
+
+    extractor = DOMExtractor()
+    failures = 0
+    with FixtureServer() as server, contextlib.redirect_stdout(io.StringIO()) as logs:
+        url = server.url('product_small.html')
+        start = time.perf_counter()
+        prices, _, _ = extract_pattern(url)
+        first = time.perf_counter() - start
+        pages = get_pool().stats()['pages']
+
+        start = time.perf_counter()
+        price, title, _, _ = extractor.extract_values(url + '?utm_source=newsletter#reviews')
+        second = time.perf_counter() - start
+        cached_pages = get_pool().stats()['pages']
+
+        start = time.perf_counter()
+        extractor.extract_values(url, max_age=0) # Forces a new rendering
+        forced = time.perf_counter() - start
+        close_pool()
+
+    print(logs.getvalue(), end='')
+    print(f"extract-patterns (rendered):  {first * 1000:8.1f} ms, {len(prices)} prices")
+    print(f"extract-price (cached):       {second * 1000:8.1f} ms, {price} / {title}")
+    print(f"extract-price (max_age=0):    {forced * 1000:8.1f} ms")
+    print(f"cache: {render_cache.get_render_cache().stats()}")
+    if cached_pages != pages or server.hits('product_small.html') != 2:
+        failures += 1
+        print(f"FAILED: the cached request used the browser ({server.hits('product_small.html')} page loads)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
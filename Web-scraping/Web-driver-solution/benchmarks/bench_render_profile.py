@@ -0,0 +1,83 @@
+"""
+Compare the fixed 2 second wait with the render profiles (blocked assets and trackers, readiness-based
+wait) on a fixture page with slow images, a slow web font, a slow third-party tag and a price rendered
+client-side, and check that both renderings give the same extraction.
+
+Usage: python benchmarks/bench_render_profile.py [--runs 3]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault('PROXY_SERVER', '') # The fixture site is local
+os.environ.setdefault('BROWSER_HEADLESS', '1')
+
+from fixture_server import FixtureServer
+
+from Values_extractor import DOMExtractor
+from browser_pool import close_pool, get_pool
+from render_profile import DEFAULT_BLOCKED_HOSTS, RenderProfile
+
+PRICE_PARAM = json.dumps({'tag': 'span', 'attributes': json.dumps({'class': 'price'})})
+
+
+def timed(render, runs: int):
+    """
+    Render a page several times.
+    Returns: tuple: The best time in milliseconds and the last HTML content
+
+    """
+    best = None
+    html_content = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        html_content = render()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, html_content
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    # The fixture's third-party tag is served from localhost while the page is on 127.0.0.1
+    profile = RenderProfile(blocked_hosts=DEFAULT_BLOCKED_HOSTS + ['localhost'])
+    extractor = DOMExtractor()
+    selector = extractor._ready_selector(PRICE_PARAM)
+    pool = get_pool()
+    failures = 0
+    with FixtureServer() as server, contextlib.redirect_stdout(io.StringIO()) as logs:
+        url = server.url('product_assets.html')
+        pool.fetch_html(url, wait=0) # Launch the browser outside of the measures
+        rows = [
+            ('fixed wait (2000 ms)', *timed(lambda: pool.fetch_html(url, wait=2000), args.runs)),
+            ('profile, price text', *timed(lambda: pool.fetch_html(url, profile=profile), args.runs)),
+            ('profile, price selector', *timed(
+                lambda: pool.fetch_html(url, profile=profile, ready_selector=selector), args.runs)),
+        ]
+        close_pool()
+
+    print(logs.getvalue(), end='')
+    expected = extractor.extract_from_html(rows[0][2], PRICE_PARAM, None, None)
+    for name, elapsed, html_content in rows:
+        values = extractor.extract_from_html(html_content, PRICE_PARAM, None, None)
+        speedup = rows[0][1] / elapsed
+        print(f"{name:26s} {elapsed:8.1f} ms  x{speedup:5.1f}  price={values[0]!r}")
+        if values != expected:
+            failures += 1
+            print(f"FAILED: {name} extracted {values}, expected {expected}")
+    print(f"asset requests reaching the site: images={server.hits('images/product-1.jpg')}, "
+          f"fonts={server.hits('fonts/shop.woff2')}, tracker={server.hits('tracker/collect.js')} "
+          f"(the fixed wait loads each once per run)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the previous per-row relation upserts of compare_product with the chunked multi-row upserts of
+db_pool.upsert_relations, on the SQLite stand-in with a simulated network round-trip: rows per second and
+round-trips per run.
+
+Usage: python benchmarks/bench_upserts.py [--rows 20000] [--latency-ms 0.3]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from sql_standin import SCHEMA, StandInConnection
+from db_pool import upsert_relations
+
+
+def per_row_upserts(db, pairs) -> dict:
+    """
+    The writes of compare_product before the bulk upserts: one statement per row, one commit.
+    """
+    cursor = db.cursor()
+    start = time.perf_counter()
+    for id_product, id_history in pairs:
+        cursor.execute("""
+            INSERT INTO product_history_relation (id_product, id_history)
+            VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE
+            id_product = VALUES(id_product)
+        """, (int(id_product), int(id_history)))
+    db.commit()
+    elapsed = time.perf_counter() - start
+    return {'rows': len(pairs), 'round_trips': len(pairs) + 1, 'rows_per_s': round(len(pairs) / elapsed),
+            'write_s': round(elapsed, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--latency-ms', type=float, default=0.3, help='Simulated round-trip time to the server')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    pairs = list(zip(rng.integers(1, args.rows, args.rows), range(1, args.rows + 1)))
+    runs = [('per row (previous)', lambda db: per_row_upserts(db, pairs))]
+    for batch_size, commit_every in ((100, 0), (1000, 0), (1000, 5), (5000, 0)):
+        runs.append((f'batch {batch_size}, commit ' + (f'every {commit_every}' if commit_every else 'at end'),
+                     lambda db, b=batch_size, c=commit_every: upsert_relations(db, '', pairs, b, c)))
+
+    expected = None
+    failures = 0
+    print(f"{args.rows} relations, {args.latency_ms} ms per round-trip")
+    for name, write in runs:
+        db = StandInConnection(latency=args.latency_ms / 1000)
+        db.sqlite.executescript(SCHEMA.format(prefix=''))
+        stats = write(db)
+        print(f"  {name:<28}{stats['write_s']:8.3f}s  {stats['rows_per_s']:>9} rows/s  "
+              f"{stats['round_trips']:>6} round-trips")
+        saved = db.sqlite.execute('SELECT id_product, id_history FROM product_history_relation ORDER BY id_history').fetchall()
+        if expected is None:
+            expected = saved
+        elif saved != expected:
+            failures += 1
+            print(f"FAILED: {name} saved different relations")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Check that the single-pass DOMExtractor returns the same values as the previous implementation
+on the fixture corpus, and report the speedup of the parse and extraction phase.
+
+Usage: python benchmarks/bench_values_extractor.py [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import sys
+import time
+
+from fixture_server import load_corpus
+from legacy_extractor import LegacyDOMExtractor
+
+from Values_extractor import DOMExtractor
+
+
+def run(extractor, html, *params):
+    """
+    Run an extraction, returning the values or the type of the raised exception.
+    """
+    with contextlib.redirect_stdout(io.StringIO()): # The extractors print debugging information
+        try:
+            return extractor.extract_from_html(html, *params)
+        except Exception as e:
+            return type(e).__name__
+
+
+def best_time(extractor, html, params, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(extractor, html, *params)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    legacy, extractor = LegacyDOMExtractor(), DOMExtractor()
+    mismatches = 0
+    total_legacy = total_new = 0.0
+    print(f"{'case':<28}{'legacy ms':>12}{'single-pass ms':>16}{'speedup':>10}")
+    for name, html, *params in load_corpus():
+        expected, actual = run(legacy, html, *params), run(extractor, html, *params)
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH {name}\n  expected {expected!r}\n  actual   {actual!r}")
+        legacy_time = best_time(legacy, html, params, args.repeat)
+        new_time = best_time(extractor, html, params, args.repeat)
+        total_legacy += legacy_time
+        total_new += new_time
+        print(f"{name:<28}{legacy_time * 1000:12.2f}{new_time * 1000:16.2f}{legacy_time / new_time:9.2f}x")
+    print(f"{'total':<28}{total_legacy * 1000:12.2f}{total_new * 1000:16.2f}{total_legacy / total_new:9.2f}x")
+    if mismatches:
+        print(f"{mismatches} case(s) differ from the previous implementation")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
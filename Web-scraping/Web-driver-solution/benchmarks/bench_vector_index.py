@@ -0,0 +1,112 @@
+"""
+Compare the persistent IVF index of vector_index.py with the exact products x history similarity matrix
+used before, on synthetic clustered embeddings: recall@k, latency and memory, and the cost of an
+incremental update against a rebuild.
+
+Usage: python benchmarks/bench_vector_index.py [--products 50000] [--history 20000] [--nprobe 8]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # The service modules
+from vector_index import VectorIndex, _normalize, open_index
+
+
+def clustered(rng, centers: np.ndarray, count: int, noise: float = 0.5) -> np.ndarray:
+    """
+    Draw vectors around random centers.
+    """
+    chosen = centers[rng.integers(0, len(centers), count)]
+    return (chosen + noise * rng.standard_normal(chosen.shape, dtype=np.float32)).astype(np.float32)
+
+
+def exact_top_k(products: np.ndarray, history: np.ndarray, k: int, chunk: int = 2048) -> np.ndarray:
+    """
+    The exact top-k product positions of each history row, computed by chunks of history rows.
+    """
+    products, history = _normalize(products), _normalize(history)
+    result = np.empty((len(history), k), dtype=np.int64)
+    for start in range(0, len(history), chunk):
+        scores = history[start:start + chunk] @ products.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        result[start:start + chunk] = np.take_along_axis(top, order, axis=1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--history', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--min-recall', type=float, default=0.95, help='Fail below this recall@1')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    # Products are grouped in categories, history rows are the same products described by other shops
+    categories = rng.standard_normal((max(args.products // 50, 1), args.dim), dtype=np.float32)
+    products = clustered(rng, categories, args.products, noise=0.6)
+    history = clustered(rng, products, args.history, noise=0.3)
+    ids = np.arange(1, args.products + 1)
+
+    start = time.perf_counter()
+    truth = exact_top_k(products, history, args.k)
+    exact_time = time.perf_counter() - start
+    dense_bytes = args.products * args.history * 8 # cosine_similarity returns float64 for the model's output
+
+    index = VectorIndex(args.dim, nprobe=args.nprobe)
+    start = time.perf_counter()
+    index.upsert(ids, products)
+    build_time = time.perf_counter() - start
+    tracemalloc.start()
+    start = time.perf_counter()
+    _, found = index.search(history, k=args.k)
+    search_time = time.perf_counter() - start
+    search_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    truth_ids = ids[truth]
+    recall_1 = float(np.mean(found[:, 0] == truth_ids[:, 0]))
+    recall_k = float(np.mean([len(np.intersect1d(a, b)) / args.k for a, b in zip(found, truth_ids)]))
+
+    # Incremental update: 1% new products, then a save and a reload as compare_product does
+    new_products = clustered(rng, categories, args.products // 100, noise=0.6)
+    start = time.perf_counter()
+    index.upsert(np.arange(args.products + 1, args.products + 1 + len(new_products)), new_products)
+    update_time = time.perf_counter() - start
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'index.npz')
+        start = time.perf_counter()
+        index.save(path)
+        reloaded = open_index(path, args.dim, nprobe=args.nprobe)
+        persist_time = time.perf_counter() - start
+        file_bytes = os.path.getsize(path)
+    rebuilt = VectorIndex(args.dim, nprobe=args.nprobe)
+    start = time.perf_counter()
+    rebuilt.upsert(reloaded.ids, reloaded.vectors)
+    rebuild_time = time.perf_counter() - start
+
+    print(f"{args.products} products, {args.history} history rows, dim {args.dim}, "
+          f"{len(index.centroids)} groups, nprobe {args.nprobe}")
+    print(f"exact (chunked):        {exact_time:8.2f}s  (dense matrix: {dense_bytes / 1e9:.1f} GB)")
+    print(f"index build:            {build_time:8.2f}s")
+    print(f"index search:           {search_time:8.2f}s  x{exact_time / search_time:.1f}, "
+          f"peak {search_peak / 1e6:.0f} MB, index file {file_bytes / 1e6:.0f} MB")
+    print(f"recall@1 {recall_1:.4f}  recall@{args.k} {recall_k:.4f}")
+    print(f"add 1% products:        {update_time * 1000:8.1f} ms (rebuild: {rebuild_time * 1000:.1f} ms), "
+          f"save + load {persist_time * 1000:.1f} ms")
+    if recall_1 < args.min_recall:
+        print(f"FAILED: recall@1 below {args.min_recall}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
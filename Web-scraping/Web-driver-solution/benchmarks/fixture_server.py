@@ -0,0 +1,91 @@
+"""
+A local stand-in web site serving the saved pages of benchmarks/fixtures, used by the benchmarks
+so they don't depend on the network or on the proxy.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# Make the service modules importable from the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class _FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    Serve the fixture files, delaying the response when the URL has a ?delay=<ms> parameter.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES_DIR, **kwargs)
+
+    def do_GET(self):
+        self.server.hits[urlparse(self.path).path] = self.server.hits.get(urlparse(self.path).path, 0) + 1
+        delay = parse_qs(urlparse(self.path).query).get('delay')
+        if delay:
+            time.sleep(int(delay[0]) / 1000)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass # Keep the benchmark output readable
+
+
+class FixtureServer:
+    """
+    Run the fixture site in a background thread.
+    Usage:
+        with FixtureServer() as server:
+            url = server.url('product_small.html')
+    """
+    def __init__(self, port: int = 0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _FixtureHandler)
+        self.httpd.hits = {} # Number of requests per path
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{path.lstrip('/')}"
+
+    def hits(self, path: str) -> int:
+        return self.httpd.hits.get('/' + path.lstrip('/').split('?')[0], 0)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _as_param(value):
+    """
+    Encode a corpus param the way the API receives it (JSON with JSON encoded attributes).
+    """
+    if not value:
+        return None
+    return json.dumps({'tag': value['tag'], 'attributes': json.dumps(value['attributes'])})
+
+
+def load_corpus() -> list:
+    """
+    Load the extraction cases of fixtures/corpus.json.
+    Returns: list: (case name, HTML content, price_param, descr_param, stock_param) tuples
+
+    """
+    with open(os.path.join(FIXTURES_DIR, 'corpus.json')) as f:
+        cases = json.load(f)
+    pages = {}
+    corpus = []
+    for index, case in enumerate(cases):
+        if case['page'] not in pages:
+            with open(os.path.join(FIXTURES_DIR, case['page']), encoding='utf-8') as f:
+                pages[case['page']] = f.read()
+        has_params = any(case.get(key) for key in ('param', 'descr_param', 'stock_param'))
+        name = f"{case['page']}#{index}" if has_params else case['page']
+        corpus.append((name, pages[case['page']], _as_param(case.get('param')),
+                       _as_param(case.get('descr_param')), _as_param(case.get('stock_param'))))
+    return corpus
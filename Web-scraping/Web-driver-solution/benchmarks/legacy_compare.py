@@ -0,0 +1,160 @@
+"""
+compare_product before the streaming loader (SELECT *, fetchall into DataFrames, the whole tables embedded at
+once), kept as the reference for the peak memory reported by benchmarks/bench_compare_memory.py.
+"""
+import re
+import time
+import pandas as pd  # Import pandas
+import numpy as np  # Import numpy
+import os
+from encoder import get_encoder
+from vector_index import content_hashes, open_index
+from assignment import assign
+from db_pool import get_connection, upsert_relations
+
+
+def normalize_text(column):
+    # Lower-case and replace the punctuation with spaces
+    return column.str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x)))
+
+
+def compare_product(host , user , passwd , database , id_target, database_prefix, incremental=False, db=None):
+    """
+    Match the price history rows of a target with its products and save the relations.
+    Args:
+        host, user, passwd, database: The MySQL connection settings (user and passwd name environment variables)
+        id_target: The target
+        database_prefix: The prefix of the table names
+        incremental: Only match the history rows that have no relation yet
+        db: An open DB-API connection to use instead of a pooled connection
+
+    Returns: dict: The number of rows and the time spent in each stage, None if there is nothing to compare
+
+    """
+    if db is None:
+        db = get_connection(host, user, passwd, database) # Pooled connection, given back to the pool at the end
+        try:
+            return compare_product(host, user, passwd, database, id_target, database_prefix, incremental, db)
+        finally:
+            db.close()
+    cursor = db.cursor()
+
+    # Retrieve target products
+    cursor.execute("SELECT * FROM "+database_prefix+"target_product WHERE id_target = %s", (id_target,))
+    products = cursor.fetchall()
+
+    # Convert to pandas DataFrame
+    df = pd.DataFrame(products, columns=[i[0] for i in cursor.description])
+
+    # Check if target products exist
+    if df.empty:
+        print(f"No target products found for id_target: {id_target}")
+        return
+
+    # Retrieve price history (in incremental mode, only the rows not matched by a previous run)
+    query = "select p.* , c.id_target from "+database_prefix+"price_history p LEFT JOIN "+database_prefix+"competitor_target c on p.id_competitor = c.id_competitor"
+    if incremental:
+        query += " LEFT JOIN "+database_prefix+"product_history_relation r on r.id_history = p.id_history WHERE c.id_target = %s AND r.id_history IS NULL"
+    else:
+        query += " WHERE c.id_target = %s"
+    cursor.execute(query, (id_target,))
+    product = cursor.fetchall()
+    dfs = pd.DataFrame(product, columns=[i[0] for i in cursor.description])
+
+    # Check if price history exists
+    if dfs.empty:
+        print(f"No {'new ' if incremental else ''}price history found for id_target: {id_target}")
+        return {'products': len(df), 'history': 0, 'encoded_products': 0, 'encoded_history': 0} if incremental else None
+
+    # Use the resident SentenceTransformer model (loaded once per process)
+    encoder = get_encoder()
+    start = time.perf_counter()
+    encoder.load()
+    model_load_time = time.perf_counter() - start
+
+    # Embed the product names (weighted three times), descriptions, and prices for df
+    name = normalize_text(df['name'])
+    df['name_description_price'] = (
+    name + ' ' + name + ' ' + name + ' ' +
+    normalize_text(df['description']) + ' ' +
+    df['price'].astype(str)
+    )
+    # Embed the product titles (weighted three times), descriptions, and prices for dfs
+    title = normalize_text(dfs['product_title'])
+    dfs['name_description_price'] = (
+    title + ' ' + title + ' ' + title + ' ' +
+    normalize_text(dfs['product_description']) + ' ' +
+    dfs['price_raw'].astype(str)
+    )
+
+    # The persistent index of the target caches the product vectors: only the products that are new or whose
+    # text changed since their vector was computed are encoded
+    index_dir = os.environ.get('VECTOR_INDEX_DIR', 'vector_indexes')
+    os.makedirs(index_dir, exist_ok=True)
+    index_path = os.path.join(index_dir, f"{database_prefix}target_{id_target}.npz")
+    vector_index = open_index(index_path, encoder.dimension, encoder.model_name,
+                              nprobe=int(os.environ.get('VECTOR_INDEX_NPROBE', 8)))
+    product_ids = df['id_product'].values
+    hashes = content_hashes(df['name_description_price'])
+    stale = vector_index.stale(product_ids, hashes)
+
+    # Encode each distinct text once, for both tables
+    start = time.perf_counter()
+    embeddings = encoder.encode(df['name_description_price'][stale].tolist() + dfs['name_description_price'].tolist())
+    encode_time = time.perf_counter() - start
+    product_embeddings, dfs_embeddings = embeddings[:int(stale.sum())], embeddings[int(stale.sum()):]
+
+    # Find the top-k most similar products of each history row with the index, updated with the products
+    # added, changed or removed since the last run
+    start = time.perf_counter()
+    removed = vector_index.remove(np.setdiff1d(vector_index.ids, product_ids))
+    added, updated = vector_index.upsert(product_ids[stale], product_embeddings, hashes[stale])
+    if stale.any() or removed:
+        vector_index.save(index_path)
+    scores, candidate_ids = vector_index.search(dfs_embeddings, k=min(int(os.environ.get('COMPARE_TOP_K', 10)), len(df)))
+    candidates = pd.Index(product_ids).get_indexer(candidate_ids.ravel()).reshape(candidate_ids.shape)
+    search_time = time.perf_counter() - start
+
+    # Add the similarity scores to the DataFrame
+    dfs['similarity'] = scores[:, 0]
+
+    # Give each product to at most one history row, among the top-k candidates of the rows
+    start = time.perf_counter()
+    most_similar_indices = assign(scores, candidates, len(df), os.environ.get('COMPARE_ASSIGNMENT', 'auction'))
+    assignment_time = time.perf_counter() - start
+
+    x = pd.DataFrame({
+        'most_similar_product_id': df['id_product'].iloc[most_similar_indices].values,
+        'most_similar_history_id': dfs['id_history'].values,
+        'product_name': df['name'].iloc[most_similar_indices].values,
+        'history_name': dfs['product_title'].values,
+        'product_price': df['price'].iloc[most_similar_indices].values,
+        'history_price': dfs['price_raw'].values,
+        'product_url': df['url'].iloc[most_similar_indices].values,
+        'history_url': dfs['product_url'].values,
+        'similarity': scores[:, 0]
+    })
+    # Save most_similar_product_id and most_similar_history_id in the table "+database_prefix+"product_history_relation
+    # with chunked multi-row upserts
+    write_stats = upsert_relations(db, database_prefix,
+                                   zip(x['most_similar_product_id'].values, x['most_similar_history_id'].values),
+                                   batch_size=int(os.environ.get('COMPARE_UPSERT_BATCH', 1000)),
+                                   commit_every=int(os.environ.get('COMPARE_COMMIT_EVERY', 0)))
+
+    result = {
+        'products': len(df),
+        'history': len(dfs),
+        'encoded_products': int(stale.sum()),
+        'encoded_history': len(dfs),
+        'unique_texts': int(pd.concat([df['name_description_price'][stale], dfs['name_description_price']]).nunique()),
+        'model_load_s': round(model_load_time, 3),
+        'model_first_load_s': round(encoder.load_seconds, 3),
+        'encode_s': round(encode_time, 3),
+        'search_s': round(search_time, 3),
+        'assignment_s': round(assignment_time, 3),
+        'write': write_stats,
+        'index': {'added': added, 'updated': updated, 'removed': removed, 'size': len(vector_index),
+                  'exact': vector_index.centroids is None},
+    }
+    print(f"Compared id_target {id_target}: {result}")
+    return result
@@ -0,0 +1,312 @@
+"""
+The previous implementations of the DOMExtractor heuristics and of the extract_pattern scan, kept as the
+reference for the equivalence checks and the speedups reported by the benchmarks.
+"""
+import json
+from typing import Any, Optional
+
+from bs4 import BeautifulSoup, Comment ,Tag
+import re
+
+from Pattern_extractor import PRICE_PATTERNS, _extract_content_attributes, clean_attrs, clean_stock_attrs
+
+
+class LegacyDOMExtractor:
+    """
+    The DOMExtractor heuristics before the single-pass engine: two parses and destructive clean-ups.
+    """
+    def __init__(self):
+        """
+        Initialize the DOMExtractor with default settings.
+        """
+        self.product_indicators = ['product', 'item', 'detail', 'main', 'content'] # Indicators to identify product-related elements
+        self.PRICE_PATTERNS = [
+            # Matches: 1234.56 DT, 1,234.56 TND, 1 234.56 D.T
+            r'^(?:\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2})?)\s*(?:DT|TND|D\.T)$',
+
+            # Matches: $1234.56, €1,234.56, £1 234.56 AND US $145.95, EUR €100, etc.
+            r'^(?:(?:[A-Z]{2,3}\s+)?[$€£])\s*(?:\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2})?)$',
+
+            # Matches: 1234.56$, 1,234.56€, 1 234.56£
+            r'^(?:\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2})?)\s*[$€£]$'
+        ]
+
+    def _get_node_weight(self, element) -> float:
+        """
+        Calculate importance weight of a DOM node.
+        This function assigns a weight to a DOM node based on its attributes, content size, and depth in the DOM tree.
+        The weight is used to identify the most relevant elements for price extraction.
+        The higher the weight, the more important the element is considered to be.
+
+        Args:
+            element: The HTML element to analyze.
+
+        Returns: float: The importance weight of the element.
+
+        """
+
+        weight = 1.0 # Default weight
+
+        # Check element attributes
+        if element.get('id') or element.get('class') or element.get('content'):
+            for indicator in self.product_indicators:
+                if indicator in str(element.get('id', '')).lower() or \
+                        indicator in ' '.join(element.get('class', [])).lower():
+                    weight *= 1.5  # Increase weight
+
+        # Check content size
+        text = element.get_text(strip=True)
+        weight *= min(len(text) / 100, 3) # Normalize weight based on text length
+
+        # Check depth in DOM
+        depth = len([p for p in element.parents])
+        weight /= max(depth, 1) # Avoid division by zero
+
+        return weight
+
+    def _find_product_container(self, soup) -> BeautifulSoup:
+        """
+        Find the main product container using weighted scoring.
+        Args:
+            soup: The BeautifulSoup object representing the parsed HTML content.
+
+        Returns: BeautifulSoup: The main product container.
+
+        """
+        candidates = soup.find_all(['div', 'section', 'article', 'main']) # Possible product containers
+        max_weight = 0  # Initialize maximum weight
+        main_container = None # Initialize main container
+        # Iterate through candidates to find the one with the highest weight
+        for element in candidates:
+            weight = self._get_node_weight(element) # Calculate weight
+            if weight > max_weight:
+                max_weight = weight
+                main_container = element
+        # Return the main container or the entire soup if no suitable container is found
+        return main_container or soup
+
+    def get_price(self, soup):
+        """
+        Extract price from the given soup object.
+        Args:
+            soup: The BeautifulSoup object representing the parsed HTML content.
+
+        Returns: str: The extracted price as a string.
+
+        """
+        for tag in soup(['script', 'style', 'noscript', 'iframe',
+                         'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
+            tag.decompose() # Remove unnecessary tags from the soup object
+
+        # Get all elements with 'div', 'span', or 'p' tags
+        all_elements = soup.find_all(['div', 'span', 'p'], recursive=True)
+        # Iterate through all elements to find the price
+        for element in all_elements:
+            if isinstance(element, Tag):
+                # Get text and clean it from extra spaces
+                text = element.get_text().strip()
+
+
+                # Check if the text is exactly a price format
+                is_price = False
+                for pattern in self.PRICE_PATTERNS:
+                    if re.match(pattern, text):
+                        is_price = True
+
+                if is_price:
+                    return element.get_text().strip()
+
+    def get_title(self, soup):
+        """
+        Extract title from the given soup object.
+        Args:
+            soup:  The BeautifulSoup object representing the parsed HTML content.
+
+        Returns: str: The extracted title as a string.
+
+        """
+        try:
+            # Try to extract title from meta tags
+            try:
+                title = soup.find('meta', property='og:title')['content']
+                return title
+            except:
+                pass
+            try:
+                title = soup.find('meta', property='twitter:title')['content']
+                return title
+            except:
+                pass
+            try:
+                title = soup.find('meta', {'name': 'title'})['content']
+                return title
+            except:
+                pass
+
+            # Clean up DOM
+            for tag in soup(['script', 'style', 'noscript', 'iframe',
+                             'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
+                tag.decompose() # Remove unnecessary tags from the soup object
+
+            for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+                comment.extract() # Remove comments from the soup object
+
+            container = self._find_product_container(soup) # Find the main product container
+            seen_title = container.find('h1').get_text(strip=True) # Extract title from the container
+
+            return seen_title
+
+        except Exception as e:
+            print(f"Error extracting prices: {e}")
+            return ""
+
+    def extract_from_html(self, html_content: str, price_param: Optional[str] = None, descr_param: Optional[str] = None,
+                          stock_param: Optional[str] = None) -> tuple[str | Any, str | Any, str | None, str | None]:
+        soup = BeautifulSoup(html_content, 'lxml') # Parse the HTML content with BeautifulSoup for the description, title, stock and price (without attributes)extraction
+        soup1 = BeautifulSoup(html_content, 'lxml') # Parse the HTML content with BeautifulSoup for the price extraction with get_price
+        price = self.get_price(soup1) # Extract price
+        title = self.get_title(soup) # Extract title
+        description = '' # Initialize description
+        stock = '' # Initialize stock
+        # Extract price using the provided parameters
+        if price_param:
+            param_ = json.loads(price_param) # Load the price parameters
+            attributes = json.loads(param_['attributes']) # Load the attributes for price extraction
+            # Find elements with the specified tag and attributes
+            if attributes:
+                # Find elements with the specified tag and attributes
+                element = soup.find(name=param_['tag'], attrs=attributes)
+                # Extract the currency element from the meta tag if it exists
+                currency_element = soup.find(name="meta", attrs={'property': 'product:price:currency'})
+                # Check if the element has the 'content' attribute and the currency element is present
+                if (element.has_attr('content') and currency_element):
+                    # Format the price with commas and replace '.' with ','
+                    price = f"{float(element['content']):,.3f}".replace(",", " ").replace(".", ",")
+                    # Append the currency to the price
+                    price += " " + currency_element['content']
+                else:
+                    price = element.get_text().strip()
+            else:
+                # Find elements without any attributes
+                all_prices = soup1.find_all(lambda tag: tag.name == param_['tag'] and not tag.attrs)
+                # Iterate through all elements to find the price
+                for element in all_prices:
+                    if (isinstance(element, Tag)):
+                        text = element.get_text()
+                        for pattern in self.PRICE_PATTERNS:
+                            if re.match(pattern, text):
+                                price = element.get_text().strip()
+                                break
+        # Extract description using the provided parameters
+        if descr_param:
+            descr_param_ = json.loads(descr_param)# Load the description parameters
+            attributes = json.loads(descr_param_['attributes'])# Load the attributes for description extraction
+            element = soup.find(name=descr_param_['tag'], attrs=attributes)# Find elements with the specified tag and attributes
+            if (element.has_attr('content')):
+                description = element['content'] # Extract the content attribute if it exists
+            else:
+                description = element.get_text()# Extract the text content if the content attribute does not exist
+        # Extract stock using the provided parameters
+        if stock_param:
+            stock_param_ = json.loads(stock_param)# Load the stock parameters
+            print(stock_param_)
+            attributes = json.loads(stock_param_['attributes'])# Load the attributes for stock extraction
+            element = soup.find(name=stock_param_['tag'], attrs=attributes)# Find elements with the specified tag and attributes
+            if (element.has_attr('content')):
+                stock = element['content']# Extract the content attribute if it exists
+            else:
+                stock = element.get_text() # Extract the text content if the content attribute does not exist
+
+        return price, title, description, stock
+
+
+
+def legacy_extract_pattern_from_html(html_content: str):
+    """
+    The previous implementation of Pattern_extractor.extract_pattern, after the page was rendered.
+    """
+    soup = BeautifulSoup(html_content, 'lxml') # Parse the HTML content for prices extraction with BeautifulSoup
+    soup1 = BeautifulSoup(html_content, 'lxml') # Parse the HTML content for description and stock extraction with BeautifulSoup
+    for tag in soup(['script', 'style', 'noscript', 'iframe',
+                      'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li']):
+        tag.decompose() # Remove unnecessary tags from the soup
+    for tag in soup1(['script', 'style', 'noscript', 'iframe']):
+        tag.decompose() # Remove unnecessary tags from the soup1
+    # List to store all found prices
+    prices_list = []
+
+    # Get all elements
+    all_elements = soup.find_all(True, recursive=True)
+
+    for element in all_elements:
+        if isinstance(element, Tag):
+            # Get text and clean it from extra spaces
+            text = element.get_text().strip()
+
+            # Check if the text is exactly a price format
+            is_price = False
+            for pattern in PRICE_PATTERNS:
+                if re.match(pattern, text):
+                    is_price = True
+
+            if is_price and element.attrs:
+                # Add price element to list without checking for duplicates
+                prices_list.append(element)
+
+    # Extract description information
+    description = []
+    # Get all elements with 'description' in their attributes
+    for element in soup1.find_all(lambda tag: any('description' in str(value).lower()
+                                                 for value in tag.attrs.values())):
+        content = ' '.join(element.get_text().split()).strip()
+        attr_content = _extract_content_attributes(element)
+        # Check if the content or attribute content is not empty
+        if content or attr_content:
+            description.append({
+                'tag_name': element.name,
+                'attributes': clean_attrs(element.attrs),
+                'text_content': content or attr_content,
+
+            })
+
+    # Extract stock information
+    stock = []
+    # Get all elements with 'stock' in their attributes, excluding 'main' as a tag and 'stockage' as a keyword
+    for element in soup1.find_all(lambda tag: tag.name != 'main' and any('stock' in str(value).lower()
+                                                  and 'stockage' not in str(value).lower()
+                                                 for value in tag.attrs.values())):
+        content = ' '.join(element.get_text().split()).strip()
+        attr_content = _extract_content_attributes(element)
+        # Check if the content or attribute content is not empty
+        if content or attr_content:
+            stock.append({
+                'tag_name': element.name,
+                'attributes': clean_stock_attrs(element.attrs),
+                'text_content': content or attr_content,
+
+            })
+
+    results = []
+    # Extract price information from meta tags for more accurate results
+    price_metas_str = list(map(lambda x: str(x), soup1.find_all('meta')))
+    price_metas_str = list(filter(lambda x: 'price' in x.lower(), price_metas_str))
+    price_metas = [BeautifulSoup(tag, 'lxml').meta for tag in price_metas_str]
+    # Extract price information from the soup1 and merge it with the prices_list
+    for meta in price_metas:
+        if meta.has_attr('content') :
+            try:
+                results.append({
+                    'price': f"{float(meta['content']):,.3f}".replace(",", " ").replace(".", ",") + " DT",
+                    'tag_name': meta.name,
+                    'attributes': clean_attrs(meta.attrs)
+                })
+            except:
+                pass
+    for element in prices_list:
+        results.append({
+            'price': element.get_text().strip(),
+            'tag_name': element.name,
+            'attributes': clean_attrs(element.attrs)
+        })
+
+    return results,description,stock # Return the results as a tuple of prices, description, and stock
@@ -0,0 +1,163 @@
+"""
+A SQLite stand-in for the MySQL database of /api/compare, used by the benchmarks so they don't need a
+MySQL server.
+The connection accepts the MySQL statements of compare.py: %s placeholders and
+INSERT ... ON DUPLICATE KEY UPDATE col = VALUES(col) are translated to their SQLite spelling.
+It also counts the statements sent and the rows fetched, and can add a network latency to each round-trip.
+"""
+import random
+import re
+import sqlite3
+import time
+
+_DUPLICATE_KEY = re.compile(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', re.IGNORECASE)
+_VALUES_FUNCTION = re.compile(r'VALUES\((\w+)\)', re.IGNORECASE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS {prefix}target_product (
+    id_product INTEGER PRIMARY KEY, id_target INTEGER, name TEXT, description TEXT, price TEXT, url TEXT,
+    image TEXT, created_at TEXT);
+CREATE TABLE IF NOT EXISTS {prefix}competitor_target (id_competitor INTEGER PRIMARY KEY, id_target INTEGER);
+CREATE TABLE IF NOT EXISTS {prefix}price_history (
+    id_history INTEGER PRIMARY KEY, id_competitor INTEGER, product_title TEXT, product_description TEXT,
+    price_raw TEXT, product_url TEXT, scraped_at TEXT);
+CREATE TABLE IF NOT EXISTS {prefix}product_history_relation (id_product INTEGER, id_history INTEGER PRIMARY KEY);
+CREATE INDEX IF NOT EXISTS {prefix}history_competitor ON {prefix}price_history (id_competitor);
+"""
+
+WORDS = ['climatiseur', 'samsung', 'inverter', 'btu', 'trottinette', 'electrique', 'pliable', 'noir', 'blanc',
+         'smartphone', 'ecran', 'pouces', 'go', 'ram', 'stockage', 'lave', 'linge', 'kg', 'refrigerateur', 'litres',
+         'portable', 'gamer', 'clavier', 'souris', 'casque', 'bluetooth', 'tv', 'led', 'smart', '4k']
+
+
+def _translate(statement: str) -> str:
+    statement = statement.replace('%s', '?')
+    match = _DUPLICATE_KEY.search(statement)
+    if match:
+        update = _VALUES_FUNCTION.sub(r'excluded.\1', statement[match.end():])
+        statement = statement[:match.start()] + 'ON CONFLICT DO UPDATE SET' + update
+    return statement
+
+
+class StandInCursor:
+    def __init__(self, connection: 'StandInConnection'):
+        self.connection = connection
+        self.cursor = connection.sqlite.cursor()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, statement: str, params=()):
+        self.connection._round_trip()
+        self.cursor.execute(_translate(statement), tuple(params))
+
+    def executemany(self, statement: str, rows):
+        rows = [tuple(row) for row in rows]
+        self.connection._round_trip()
+        self.cursor.executemany(_translate(statement), rows)
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.connection.rows_fetched += len(rows)
+        return rows
+
+    def fetchmany(self, size: int = 1):
+        rows = self.cursor.fetchmany(size)
+        self.connection.rows_fetched += len(rows)
+        return rows
+
+    def close(self):
+        self.cursor.close()
+
+
+class StandInConnection:
+    """
+    A DB-API connection to a SQLite database speaking the MySQL dialect of compare.py.
+    """
+    def __init__(self, path: str = ':memory:', latency: float = 0.0):
+        """
+        Args:
+            path: The SQLite database
+            latency: The time (in seconds) added to each round-trip, to model the network to a MySQL server
+        """
+        self.sqlite = sqlite3.connect(path, check_same_thread=False)
+        self.latency = latency
+        self.round_trips = 0 # Statements and commits sent
+        self.rows_fetched = 0
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def cursor(self, *args, **kwargs) -> StandInCursor:
+        return StandInCursor(self)
+
+    def commit(self):
+        self._round_trip()
+        self.sqlite.commit()
+
+    def rollback(self):
+        self.sqlite.rollback()
+
+    def close(self):
+        pass # Kept open: the benchmarks reuse the in-memory database between runs
+
+    def reset_counters(self):
+        self.round_trips = self.rows_fetched = 0
+
+
+def _product_text(rng: random.Random, index: int) -> tuple[str, str]:
+    title = ' '.join(rng.choice(WORDS) for _ in range(5)) + f' ref{index}'
+    return title, ' '.join(rng.choice(WORDS) for _ in range(20))
+
+
+def create_dataset(connection: StandInConnection, prefix: str = '', targets: int = 1, products: int = 1000,
+                   history: int = 10000, competitors: int = 5, seed: int = 0):
+    """
+    Fill the stand-in with synthetic targets: each history row is one of the target's products as sold by a
+    competitor, with a slightly different title and price.
+    """
+    rng = random.Random(seed)
+    connection.sqlite.executescript(SCHEMA.format(prefix=prefix))
+    product_rows, competitor_rows = [], []
+    for target in range(1, targets + 1):
+        for _ in range(competitors):
+            competitor_rows.append((len(competitor_rows) + 1, target))
+        for _ in range(products):
+            index = len(product_rows) + 1
+            title, description = _product_text(rng, index)
+            product_rows.append((index, target, title, description, f'{rng.randint(50, 5000)}.000',
+                                 f'https://shop.example/p/{index}', '', '2024-01-01'))
+    connection.sqlite.executemany(f'INSERT INTO {prefix}target_product VALUES (?, ?, ?, ?, ?, ?, ?, ?)', product_rows)
+    connection.sqlite.executemany(f'INSERT INTO {prefix}competitor_target VALUES (?, ?)', competitor_rows)
+    connection.sqlite.commit()
+    add_history(connection, prefix, history * targets, seed=seed)
+
+
+def add_history(connection: StandInConnection, prefix: str, count: int, seed: int = 1) -> int:
+    """
+    Add history rows for random products of the stand-in (a new scraping run).
+    Returns: int: The number of added rows
+
+    """
+    rng = random.Random(seed)
+    products = connection.sqlite.execute(
+        f'SELECT p.id_product, p.name, p.description, p.price, c.id_competitor FROM {prefix}target_product p '
+        f'JOIN {prefix}competitor_target c ON c.id_target = p.id_target').fetchall()
+    start = connection.sqlite.execute(f'SELECT COALESCE(MAX(id_history), 0) FROM {prefix}price_history').fetchone()[0]
+    rows = []
+    for offset in range(count):
+        id_product, name, description, price, id_competitor = rng.choice(products)
+        words = name.split()
+        rng.shuffle(words) # Competitors word their titles differently
+        rows.append((start + offset + 1, id_competitor, ' '.join(words).upper(), description,
+                     f'{price} DT', f'https://competitor{id_competitor}.example/{id_product}', '2024-01-02'))
+    connection.sqlite.executemany(f'INSERT INTO {prefix}price_history VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    connection.sqlite.commit()
+    return len(rows)
@@ -0,0 +1,322 @@
+"""
+A pool of long-lived Chromium browsers shared by the extractors and the Flask endpoints.
+
+Playwright's sync API is bound to the thread that started it, so every browser lives in its own worker
+thread and the callers (Flask request threads) hand their work over through a queue.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Optional
+
+from playwright.sync_api import sync_playwright
+
+from metrics import span
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no browser became available within the acquire timeout, or a job didn't finish within the job
+    timeout.
+    """
+
+
+def _process_rss(pid: int) -> int:
+    """
+    Read the resident memory of a process from /proc.
+    Args:
+        pid: The process id
+
+    Returns: int: The resident set size in bytes (0 if it can't be read)
+
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return 0
+
+
+class _BrowserWorker(threading.Thread):
+    """
+    A worker thread owning one Chromium browser and one warm browser context.
+    """
+    def __init__(self, pool: 'BrowserPool', index: int):
+        super().__init__(name=f'browser-pool-{index}', daemon=True)
+        self.pool = pool
+        self.browser = None
+        self.context = None
+        self.pages = 0 # Pages rendered by the current browser
+        self.launches = 0 # Number of times a browser was (re)launched by this worker
+        self.rendered = 0 # Number of jobs run by this worker
+        self.last_check = 0.0 # Last health check time
+
+    def _launch(self, playwright):
+        """
+        Launch a fresh browser and context.
+        Args:
+            playwright: The Playwright instance owned by this thread
+
+        """
+        self._close()
+        launch_options = {'headless': self.pool.headless}
+        if self.pool.proxy:
+            launch_options['proxy'] = {"server": self.pool.proxy}
+        with span('browser.launch'):
+            self.browser = playwright.chromium.launch(**launch_options)
+            self.context = self.browser.new_context(ignore_https_errors=True)
+        self.pages = 0
+        self.launches += 1
+        self.last_check = time.monotonic()
+
+    def _close(self):
+        """
+        Close the current browser, ignoring errors from an already dead browser.
+        """
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception as e:
+                print(f"Error closing browser: {e}")
+        self.browser = None
+        self.context = None
+
+    def _is_healthy(self) -> bool:
+        """
+        Check that the browser is still connected.
+        Returns: bool: True if the browser can be used
+
+        """
+        return self.browser is not None and self.browser.is_connected()
+
+    def _memory_usage(self) -> int:
+        """
+        Sum the resident memory of all the Chromium processes (browser, renderers, GPU...) of this worker.
+        Returns: int: The memory usage in bytes (0 if unknown)
+
+        """
+        try:
+            cdp = self.browser.new_browser_cdp_session()
+            try:
+                info = cdp.send('SystemInfo.getProcessInfo')
+            finally:
+                cdp.detach()
+        except Exception:
+            return 0
+        return sum(_process_rss(process['id']) for process in info.get('processInfo', []))
+
+    def _needs_recycle(self) -> bool:
+        """
+        Check whether the browser served too many pages or grew too large.
+        Returns: bool: True if the browser should be relaunched
+
+        """
+        if self.pages >= self.pool.max_pages:
+            return True
+        if self.pool.max_memory and self._memory_usage() > self.pool.max_memory:
+            return True
+        return False
+
+    def run(self):
+        with sync_playwright() as playwright:
+            try:
+                self._launch(playwright) # Launched now, so the first request doesn't pay for it
+            except Exception as e:
+                print(f"Error launching browser: {e}") # Launched again by the first job
+                self._close()
+            while True:
+                try:
+                    job = self.pool._jobs.get(timeout=self.pool.health_interval)
+                except queue.Empty:
+                    # Idle: use the time to check that the browser is still alive
+                    if self.browser is not None and not self._is_healthy():
+                        self._close()
+                    continue
+                if job is None: # Shutdown signal
+                    break
+                callback, future = job
+                try:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        if not self._is_healthy():
+                            self._launch(playwright)
+                        with span('browser.new_page'):
+                            page = self.context.new_page()
+                        try:
+                            result = callback(page)
+                        finally:
+                            page.close()
+                        future.set_result(result)
+                    except BaseException as e:
+                        future.set_exception(e)
+                    self.pages += 1
+                    self.rendered += 1
+                    if not self._is_healthy() or self._needs_recycle():
+                        self._close() # The next job launches a fresh browser
+                except Exception as e:
+                    print(f"Browser worker error: {e}")
+                    self._close()
+                finally:
+                    self.pool._slots.release()
+            self._close()
+
+
+class BrowserPool:
+    """
+    A fixed-size pool of warm Chromium browsers.
+    Each job gets a new page in a long-lived context; browsers are relaunched when they disconnect,
+    after max_pages pages or when their processes use more than max_memory bytes.
+    """
+    def __init__(self, size: int = 2, max_pages: int = 100, max_memory_mb: int = 1024,
+                 acquire_timeout: float = 60, job_timeout: float = 180, health_interval: float = 30,
+                 proxy: Optional[str] = "socks5://127.0.0.1:8899", headless: bool = False):
+        """
+        Initialize the pool and start its worker threads.
+        Args:
+            size: The number of browsers
+            max_pages: The number of pages a browser renders before being recycled
+            max_memory_mb: The memory (in MB) above which a browser is recycled, 0 to disable the check
+            acquire_timeout: The maximum time (in seconds) to wait for a free browser
+            job_timeout: The maximum time (in seconds) a caller waits for its job once it has a browser
+            health_interval: The interval (in seconds) between health checks of idle browsers
+            proxy: The proxy server used by the browsers, None for a direct connection
+            headless: Run the browsers headless (faster, but easily blocked by some sites)
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.acquire_timeout = acquire_timeout
+        self.job_timeout = job_timeout
+        self.health_interval = health_interval
+        self.proxy = proxy
+        self.headless = headless
+        self._jobs = queue.Queue()
+        self._slots = threading.BoundedSemaphore(size) # One slot per browser, bounds the waiting callers
+        self._workers = [_BrowserWorker(self, i) for i in range(size)]
+        for worker in self._workers:
+            worker.start()
+        self._closed = False
+
+    def run(self, callback: Callable[[Any], Any], timeout: Optional[float] = None,
+            job_timeout: Optional[float] = None) -> Any:
+        """
+        Run a callback with a new page of one of the pooled browsers.
+        Args:
+            callback: A function taking a Playwright page, run in the browser's thread
+            timeout: The maximum time (in seconds) to wait for a free browser, defaults to acquire_timeout
+            job_timeout: The maximum time (in seconds) to wait for the callback, defaults to the pool's job_timeout
+
+        Returns: Any: The value returned by the callback
+
+        """
+        if self._closed:
+            raise RuntimeError('Browser pool is closed')
+        timeout = self.acquire_timeout if timeout is None else timeout
+        with span('browser.acquire'): # Waiting for a free browser
+            acquired = self._slots.acquire(timeout=timeout)
+        if not acquired:
+            raise PoolTimeout(f'No browser available after {timeout} seconds')
+        future = Future()
+        self._jobs.put((callback, future))
+        job_timeout = self.job_timeout if job_timeout is None else job_timeout
+        try:
+            return future.result(timeout=job_timeout)
+        except FutureTimeout:
+            # A job not started yet is dropped; a hung page keeps its browser until Playwright's own timeouts
+            future.cancel()
+            raise PoolTimeout(f'The browser job did not finish within {job_timeout} seconds') from None
+
+    def fetch_html(self, url: str, timeout: int = 30000, wait: int = 2000, profile=None,
+                   ready_selector: Optional[str] = None) -> str:
+        """
+        Render a page and return its HTML content.
+        Args:
+            url: The URL of the page
+            timeout: The navigation timeout in milliseconds
+            wait: The time to wait after the navigation, in milliseconds (ignored with a profile)
+            profile: The RenderProfile blocking requests and waiting for the page to be ready, None to
+                load everything and wait for a fixed time
+            ready_selector: The CSS selector whose presence means the page is ready (with a profile)
+
+        Returns: str: The HTML content of the page
+
+        """
+        def render(page):
+            if profile is not None:
+                return profile.render(page, url, timeout=timeout, ready_selector=ready_selector)
+            with span('browser.goto'):
+                page.goto(url, timeout=timeout) # Navigate to the URL
+            if wait:
+                with span('browser.wait'):
+                    page.wait_for_timeout(wait) # Allow the page to load
+            with span('browser.content'):
+                return page.content()
+        return self.run(render)
+
+    def stats(self) -> dict:
+        """
+        Get the state of the pool.
+        Returns: dict: The pool size, the open browsers, the number of launches and of rendered pages
+
+        """
+        return {
+            'size': self.size,
+            'open_browsers': sum(1 for worker in self._workers if worker.browser is not None),
+            'launches': sum(worker.launches for worker in self._workers),
+            'pages': sum(worker.rendered for worker in self._workers),
+            'queued': self._jobs.qsize(),
+        }
+
+    def close(self):
+        """
+        Stop the workers and close all the browsers.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers:
+            worker.join(timeout=30)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> BrowserPool:
+    """
+    Get the process-wide browser pool, creating it from the environment on first use.
+    Returns: BrowserPool: The shared pool
+
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(
+                size=int(os.environ.get('BROWSER_POOL_SIZE', 2)),
+                max_pages=int(os.environ.get('BROWSER_MAX_PAGES', 100)),
+                max_memory_mb=int(os.environ.get('BROWSER_MAX_MEMORY_MB', 1024)),
+                acquire_timeout=float(os.environ.get('BROWSER_ACQUIRE_TIMEOUT', 60)),
+                job_timeout=float(os.environ.get('BROWSER_JOB_TIMEOUT', 180)),
+                proxy=os.environ.get('PROXY_SERVER', "socks5://127.0.0.1:8899") or None,
+                headless=os.environ.get('BROWSER_HEADLESS', '0') == '1',
+            )
+        return _pool
+
+
+def close_pool():
+    """
+    Close the process-wide browser pool if it was created.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
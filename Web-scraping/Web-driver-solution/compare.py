@@ -1,104 +1,263 @@
+import itertools
 import re
-import mysql.connector
+import time
 import pandas as pd  # Import pandas
-from sentence_transformers import SentenceTransformer  # Import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity  # Import cosine_similarity
 import numpy as np  # Import numpy
 import os
-def compare_product(host , user , passwd , database , id_target, database_prefix):
-    db = mysql.connector.connect(
-        host=os.environ.get('MYSQL_HOST', host),
-        user=os.environ.get(user),
-        password=os.environ.get(passwd),
-        database=os.environ.get('MYSQL_DATABASE', database))
-    cursor = db.cursor()
+from encoder import get_encoder
+from metrics import get_metrics
+from vector_index import content_hashes, open_index
+from assignment import assign
+from db_pool import get_connection, upsert_relations
 
-    # Retrieve target products
-    cursor.execute("SELECT * FROM "+database_prefix+"target_product WHERE id_target = %s", (id_target,))
-    products = cursor.fetchall()
 
-    # Convert to pandas DataFrame
-    df = pd.DataFrame(products, columns=[i[0] for i in cursor.description])
+_PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def normalize_text(column):
+    # Lower-case and replace the punctuation with spaces, in one pass over the column (non-text values become 'nan')
+    return [_PUNCTUATION.sub(' ', value.lower()) if isinstance(value, str) else 'nan' for value in column]
+
+
+def matching_texts(names, descriptions, prices) -> list:
+    """
+    Build the texts that are embedded: the normalized name (weighted three times), description and price.
+    Args:
+        names: The product names or titles
+        descriptions: The descriptions
+        prices: The prices
+
+    Returns: list: One text per row
+
+    """
+    return [f"{name} {name} {name} {description} {price}"
+            for name, description, price in zip(normalize_text(names), normalize_text(descriptions), prices)]
+
+
+def read_chunks(cursor, chunk_size: int):
+    """
+    Read the result of the last statement of a cursor chunk by chunk.
+    Args:
+        cursor: The DB-API cursor
+        chunk_size: The number of rows per chunk
+
+    Returns: Iterator[list]: The chunks of rows
+
+    """
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def open_target_index(encoder, database_prefix, id_target) -> tuple:
+    """
+    Open the persistent vector index of a target (VECTOR_INDEX_DIR, VECTOR_INDEX_NPROBE).
+    Args:
+        encoder: The encoder the vectors are computed with
+        database_prefix: The prefix of the table names
+        id_target: The target
+
+    Returns: tuple: The VectorIndex and its path
+
+    """
+    index_dir = os.environ.get('VECTOR_INDEX_DIR', 'vector_indexes')
+    os.makedirs(index_dir, exist_ok=True)
+    index_path = os.path.join(index_dir, f"{database_prefix}target_{id_target}.npz")
+    vector_index = open_index(index_path, encoder.dimension, encoder.model_name,
+                              nprobe=int(os.environ.get('VECTOR_INDEX_NPROBE', 8)))
+    return vector_index, index_path
+
+
+def update_target_index(vector_index, index_path: str, product_ids: np.ndarray, stale_ids: np.ndarray,
+                        stale_vectors: np.ndarray, stale_hashes: np.ndarray) -> dict:
+    """
+    Update the index of a target with the products added, changed or removed since the last run, and save it.
+    Args:
+        vector_index: The VectorIndex of the target
+        index_path: Where the index is saved
+        product_ids: All the products of the target
+        stale_ids: The products that were encoded (new or changed)
+        stale_vectors: Their vectors
+        stale_hashes: The content hashes of their texts
+
+    Returns: dict: The number of products added, updated and removed
+
+    """
+    removed = vector_index.remove(np.setdiff1d(vector_index.ids, product_ids))
+    added = updated = 0
+    if len(stale_ids):
+        added, updated = vector_index.upsert(stale_ids, stale_vectors, stale_hashes)
+    if len(stale_ids) or removed:
+        vector_index.save(index_path)
+    return {'added': added, 'updated': updated, 'removed': removed, 'size': len(vector_index),
+            'exact': vector_index.centroids is None}
+
+
+def save_matches(db, database_prefix, product_ids: np.ndarray, history_ids: np.ndarray, scores: np.ndarray,
+                 candidates: np.ndarray) -> tuple:
+    """
+    Give each product to at most one history row among the top-k candidates of the rows (COMPARE_ASSIGNMENT) and
+    save the relations with chunked multi-row upserts (COMPARE_UPSERT_BATCH, COMPARE_COMMIT_EVERY).
+    Args:
+        db: The DB-API connection
+        database_prefix: The prefix of the table names
+        product_ids: The products of the target
+        history_ids: The history rows
+        scores: The similarity of the candidates of each row (rows x k)
+        candidates: The candidates of each row, as positions in product_ids (rows x k, -1 for no candidate)
+
+    Returns: tuple: The assignment time and the write statistics
+
+    """
+    start = time.perf_counter()
+    most_similar_indices = assign(scores, candidates, len(product_ids), os.environ.get('COMPARE_ASSIGNMENT', 'auction'))
+    assignment_time = time.perf_counter() - start
+
+    # The rows without any candidate product (-1) are not related: product_ids[-1] would be the last product
+    matched = most_similar_indices >= 0
+    # Save most_similar_product_id and most_similar_history_id in the table "+database_prefix+"product_history_relation
+    write_stats = upsert_relations(db, database_prefix,
+                                   zip(product_ids[most_similar_indices[matched]], history_ids[matched]),
+                                   batch_size=int(os.environ.get('COMPARE_UPSERT_BATCH', 1000)),
+                                   commit_every=int(os.environ.get('COMPARE_COMMIT_EVERY', 0)))
+    write_stats['unmatched'] = int(len(matched) - matched.sum())
+    return assignment_time, write_stats
+
+
+def compare_product(host , user , passwd , database , id_target, database_prefix, incremental=False, db=None):
+    """
+    Match the price history rows of a target with its products and save the relations.
+    Both tables are streamed in chunks of COMPARE_CHUNK_SIZE rows with only the columns used, and embedded chunk by
+    chunk, so the memory used doesn't grow with the text of the tables (only the ids and the top-k candidates of each
+    history row are kept).
+    Args:
+        host, user, passwd, database: The MySQL connection settings (user and passwd name environment variables)
+        id_target: The target
+        database_prefix: The prefix of the table names
+        incremental: Only match the history rows that have no relation yet
+        db: An open DB-API connection to use instead of a pooled connection
+
+    Returns: dict: The number of rows and the time spent in each stage, None if there is nothing to compare
+
+    """
+    if db is None:
+        db = get_connection(host, user, passwd, database) # Pooled connection, given back to the pool at the end
+        try:
+            return compare_product(host, user, passwd, database, id_target, database_prefix, incremental, db)
+        finally:
+            db.close()
+    compare_start = time.perf_counter()
+    chunk_size = int(os.environ.get('COMPARE_CHUNK_SIZE', 10000))
+    cursor = db.cursor(buffered=False) # Rows are read from the server as they are consumed
+
+    # Retrieve target products
+    cursor.execute("SELECT id_product, name, description, price FROM "+database_prefix+"target_product WHERE id_target = %s", (id_target,))
+    chunks = read_chunks(cursor, chunk_size)
+    first_chunk = next(chunks, None)
 
     # Check if target products exist
-    if df.empty:
+    if first_chunk is None:
         print(f"No target products found for id_target: {id_target}")
         return
 
-    # Retrieve price history
-    cursor.execute("select p.* , c.id_target from "+database_prefix+"price_history p LEFT JOIN "+database_prefix+"competitor_target c on p.id_competitor = c.id_competitor WHERE c.id_target = %s", (id_target,))
-    product = cursor.fetchall()
-    dfs = pd.DataFrame(product, columns=[i[0] for i in cursor.description])
+    # Use the resident SentenceTransformer model (loaded once per process)
+    encoder = get_encoder()
+    start = time.perf_counter()
+    encoder.load()
+    model_load_time = time.perf_counter() - start
 
-    # Check if price history exists
-    if dfs.empty:
-        print(f"No price history found for id_target: {id_target}")
-        return
+    # The persistent index of the target caches the product vectors: only the products that are new or whose
+    # text changed since their vector was computed are encoded
+    vector_index, index_path = open_target_index(encoder, database_prefix, id_target)
 
-    # Initialize the SentenceTransformer model
-    model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-
-    # Embed the product names, descriptions, and prices for df
-    df['name_description_price'] = (
-    df['name'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    df['name'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    df['name'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    df['description'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    df['price'].astype(str)
-    )
-    df_embeddings = model.encode(df['name_description_price'].tolist())
-
-    # Embed the product names, descriptions, and prices for dfs
-    dfs['name_description_price'] = (
-    dfs['product_title'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    dfs['product_title'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    dfs['product_title'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    dfs['product_description'].str.lower().apply(lambda x: re.sub(r'[^\w\s]', ' ', str(x))) + ' ' +
-    dfs['price_raw'].astype(str)
-    )
-    dfs_embeddings = model.encode(dfs['name_description_price'].tolist())
-
-    # Calculate cosine similarity between the embeddings of df and dfs
-    similarities = cosine_similarity(df_embeddings, dfs_embeddings)
-
-    # Add the similarity scores to the DataFrame
-    dfs['similarity'] = similarities.max(axis=0)
-
-    # Find the most similar product for each product in df
-    most_similar_indices = similarities.argmax(axis=0)
-
-    # Ensure no two products share the same most similar product
-    assigned_indices = set()
-    for i in range(len(most_similar_indices)):
-        if most_similar_indices[i] in assigned_indices:
-            sorted_similarities = np.argsort(-similarities[:, i])
-            for idx in sorted_similarities:
-                if idx not in assigned_indices:
-                    most_similar_indices[i] = idx
-                    assigned_indices.add(idx)
-                    break
-        else:
-            assigned_indices.add(most_similar_indices[i])
-
-    x = pd.DataFrame({
-        'most_similar_product_id': df['id_product'].iloc[most_similar_indices].values,
-        'most_similar_history_id': dfs['id_history'].values,
-        'product_name': df['name'].iloc[most_similar_indices].values,
-        'history_name': dfs['product_title'].values,
-        'product_price': df['price'].iloc[most_similar_indices].values,
-        'history_price': dfs['price_raw'].values,
-        'product_url': df['url'].iloc[most_similar_indices].values,
-        'history_url': dfs['product_url'].values,
-        'similarity': similarities.max(axis=0)
-    })
-    # Save most_similar_product_id and most_similar_history_id in the table "+database_prefix+"product_history_relation
-    for index, row in x.iterrows():
-        cursor.execute("""
-            INSERT INTO """+database_prefix+"""product_history_relation (id_product, id_history)
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE
-            id_product = VALUES(id_product)
-        """, (int(row['most_similar_product_id']), int(row['most_similar_history_id'])))
-    db.commit()
+    # Embed the product names (weighted three times), descriptions, and prices, chunk by chunk
+    product_ids = []
+    stale_ids = [np.empty(0, dtype=np.int64)]
+    stale_hashes = [np.empty(0, dtype=np.uint64)]
+    stale_vectors = [np.empty((0, vector_index.dim), dtype=np.float32)]
+    encode_time, unique_texts = 0.0, 0
+    for rows in itertools.chain([first_chunk], chunks):
+        ids, names, descriptions, prices = zip(*rows)
+        ids = np.asarray(ids, dtype=np.int64)
+        texts = matching_texts(names, descriptions, prices)
+        hashes = content_hashes(texts)
+        stale = vector_index.stale(ids, hashes)
+        product_ids.append(ids)
+        if stale.any():
+            stale_texts = [text for text, is_stale in zip(texts, stale) if is_stale]
+            start = time.perf_counter()
+            stale_vectors.append(encoder.encode(stale_texts))
+            encode_time += time.perf_counter() - start
+            unique_texts += len(set(stale_texts))
+            stale_ids.append(ids[stale])
+            stale_hashes.append(hashes[stale])
+    product_ids = np.concatenate(product_ids)
+    encoded_products = sum(len(ids) for ids in stale_ids)
+
+    # Update the index with the products added, changed or removed since the last run
+    start = time.perf_counter()
+    index_stats = update_target_index(vector_index, index_path, product_ids, np.concatenate(stale_ids),
+                                      np.concatenate(stale_vectors), np.concatenate(stale_hashes))
+    del stale_vectors
+    search_time = time.perf_counter() - start
+
+    # Retrieve price history (in incremental mode, only the rows not matched by a previous run)
+    query = "select p.id_history, p.product_title, p.product_description, p.price_raw from "+database_prefix+"price_history p LEFT JOIN "+database_prefix+"competitor_target c on p.id_competitor = c.id_competitor"
+    if incremental:
+        query += " LEFT JOIN "+database_prefix+"product_history_relation r on r.id_history = p.id_history WHERE c.id_target = %s AND r.id_history IS NULL"
+    else:
+        query += " WHERE c.id_target = %s"
+    cursor.execute(query, (id_target,))
+
+    # Find the top-k most similar products of each history row with the index, chunk by chunk
+    k = min(int(os.environ.get('COMPARE_TOP_K', 10)), len(product_ids))
+    positions = pd.Index(product_ids)
+    history_ids, scores, candidates = [], [], []
+    for rows in read_chunks(cursor, chunk_size):
+        ids, titles, descriptions, prices = zip(*rows)
+        texts = matching_texts(titles, descriptions, prices)
+        start = time.perf_counter()
+        vectors = encoder.encode(texts)
+        encode_time += time.perf_counter() - start
+        unique_texts += len(set(texts))
+        start = time.perf_counter()
+        chunk_scores, chunk_ids = vector_index.search(vectors, k=k)
+        candidates.append(positions.get_indexer(chunk_ids.ravel()).reshape(chunk_ids.shape).astype(np.int32))
+        search_time += time.perf_counter() - start
+        scores.append(chunk_scores)
+        history_ids.append(np.asarray(ids, dtype=np.int64))
+    cursor.close()
+
+    # Check if price history exists
+    if not history_ids:
+        print(f"No {'new ' if incremental else ''}price history found for id_target: {id_target}")
+        return {'products': len(product_ids), 'history': 0, 'encoded_products': encoded_products,
+                'encoded_history': 0} if incremental else None
+    history_ids, scores, candidates = np.concatenate(history_ids), np.concatenate(scores), np.concatenate(candidates)
 
+    # Give each product to at most one history row and save the relations
+    assignment_time, write_stats = save_matches(db, database_prefix, product_ids, history_ids, scores, candidates)
+    metrics = get_metrics() # The stages were timed along the way, the rest of the time is spent reading the tables
+    for stage, seconds in (('model_load', model_load_time), ('encode', encode_time), ('search', search_time),
+                           ('assignment', assignment_time), ('write', write_stats['write_s']),
+                           ('total', time.perf_counter() - compare_start)):
+        metrics.observe_stage(f'compare.{stage}', seconds)
 
+    result = {
+        'products': len(product_ids),
+        'history': len(history_ids),
+        'encoded_products': encoded_products,
+        'encoded_history': len(history_ids),
+        'unique_texts': unique_texts,
+        'model_load_s': round(model_load_time, 3),
+        'model_first_load_s': round(encoder.load_seconds, 3),
+        'encode_s': round(encode_time, 3),
+        'search_s': round(search_time, 3),
+        'assignment_s': round(assignment_time, 3),
+        'write': write_stats,
+        'index': index_stats,
+    }
+    print(f"Compared id_target {id_target}: {result}")
+    return result
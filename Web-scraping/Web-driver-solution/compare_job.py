@@ -0,0 +1,296 @@
+"""
+Bulk compare jobs: match the price history of many targets (or all of them) in one background job.
+The catalogues and the history of all the targets are read with one set-based query each, every distinct text
+is embedded once for the whole job, and the per-target matching (index update, top-k search, assignment and
+write) is spread over a pool of worker threads. The progress and timings of each target are kept in the job
+status.
+"""
+import concurrent.futures
+import os
+import threading
+import time
+import traceback
+import uuid
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from compare import matching_texts, open_target_index, read_chunks, save_matches, update_target_index
+from db_pool import get_connection, pool_size
+from encoder import get_encoder
+from metrics import get_metrics
+from vector_index import content_hashes
+
+
+def _in_targets(column: str, targets: Optional[list]) -> str:
+    # SQL filter on the targets of the job, all the targets when None
+    if targets is None:
+        return f"{column} IS NOT NULL"
+    return f"{column} IN ({', '.join(['%s'] * len(targets))})"
+
+
+class CompareJob:
+    """
+    A bulk compare of several targets running in a background thread.
+    """
+    def __init__(self, database_prefix: str, targets: Optional[list] = None, incremental: bool = False,
+                 workers: int = 4, connect: Callable = None, chunk_size: int = 10000):
+        """
+        Args:
+            database_prefix: The prefix of the table names
+            targets: The targets to compare, None for all the targets with products
+            incremental: Only match the history rows that have no relation yet
+            workers: The number of targets matched at the same time
+            connect: Returns a DB-API connection (closed after use); a worker takes one to write its relations
+            chunk_size: The number of rows read and embedded per chunk
+        """
+        self.id = uuid.uuid4().hex
+        self.database_prefix = database_prefix
+        self.targets = None if targets is None else [int(target) for target in targets]
+        self.incremental = incremental
+        self.workers = max(1, workers)
+        self.connect = connect
+        self.chunk_size = chunk_size
+        self.state = 'queued'
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.timings = {}
+        self.counts = {}
+        self.target_status = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f'compare-job-{self.id[:8]}', daemon=True)
+
+    def start(self) -> 'CompareJob':
+        self._thread.start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait for the end of the job.
+        Returns: bool: Whether the job is over
+
+        """
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def status(self) -> dict:
+        """
+        The state of the job and the progress and timings of each target.
+        Returns: dict: The job status
+
+        """
+        with self._lock:
+            targets = {str(target): dict(status) for target, status in self.target_status.items()}
+            done = sum(status['state'] in ('done', 'skipped', 'failed') for status in targets.values())
+            return {
+                'id': self.id,
+                'state': self.state,
+                'error': self.error,
+                'incremental': self.incremental,
+                'created': self.created,
+                'elapsed_s': round((self.finished or time.time()) - self.created, 3),
+                'targets_total': len(targets),
+                'targets_done': done,
+                'counts': dict(self.counts),
+                'timings': dict(self.timings),
+                'targets': targets,
+            }
+
+    def _set_target(self, id_target: int, **values):
+        with self._lock:
+            self.target_status[id_target].update(values)
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self._compare()
+            self.state = 'done'
+        except Exception as e:
+            traceback.print_exc()
+            self.state, self.error = 'failed', str(e)
+        finally:
+            self.timings['total_s'] = round(time.perf_counter() - start, 3)
+            self.finished = time.time()
+
+    def _compare(self):
+        prefix = self.database_prefix
+        encoder = get_encoder()
+        start = time.perf_counter()
+        encoder.load()
+        self.timings['model_load_s'] = round(time.perf_counter() - start, 3)
+        if self.targets is not None and not self.targets:
+            return
+        params = tuple(self.targets or ())
+
+        self.state = 'loading'
+        start = time.perf_counter()
+        texts = {} # Distinct texts to embed, by content hash
+        indexes = {}
+        catalogue = ([], [], [], []) # Chunks of targets, product ids, hashes and stale masks
+        history = ([], [], []) # Chunks of targets, history ids and hashes
+        db = self.connect()
+        try:
+            cursor = db.cursor(buffered=False) # Rows are read from the server as they are consumed
+            # The catalogues of all the targets
+            cursor.execute("SELECT id_target, id_product, name, description, price FROM " + prefix +
+                           "target_product WHERE " + _in_targets('id_target', self.targets), params)
+            for rows in read_chunks(cursor, self.chunk_size):
+                targets, ids, names, descriptions, prices = zip(*rows)
+                targets, ids = np.asarray(targets, dtype=np.int64), np.asarray(ids, dtype=np.int64)
+                chunk_texts = matching_texts(names, descriptions, prices)
+                hashes = content_hashes(chunk_texts)
+                stale = np.zeros(len(ids), dtype=bool)
+                for id_target in np.unique(targets).tolist():
+                    if id_target not in indexes:
+                        indexes[id_target] = open_target_index(encoder, prefix, id_target)
+                    rows_of_target = targets == id_target
+                    stale[rows_of_target] = indexes[id_target][0].stale(ids[rows_of_target], hashes[rows_of_target])
+                for position in np.flatnonzero(stale).tolist():
+                    texts.setdefault(int(hashes[position]), chunk_texts[position])
+                for chunks, values in zip(catalogue, (targets, ids, hashes, stale)):
+                    chunks.append(values)
+
+            # The history of all the targets, in one query (in incremental mode, only the rows not matched yet)
+            query = ("SELECT c.id_target, p.id_history, p.product_title, p.product_description, p.price_raw FROM " +
+                     prefix + "price_history p JOIN " + prefix + "competitor_target c ON p.id_competitor = c.id_competitor")
+            if self.incremental:
+                query += (" LEFT JOIN " + prefix + "product_history_relation r ON r.id_history = p.id_history WHERE " +
+                          _in_targets('c.id_target', self.targets) + " AND r.id_history IS NULL")
+            else:
+                query += " WHERE " + _in_targets('c.id_target', self.targets)
+            cursor.execute(query, params)
+            for rows in read_chunks(cursor, self.chunk_size):
+                targets, ids, titles, descriptions, prices = zip(*rows)
+                chunk_texts = matching_texts(titles, descriptions, prices)
+                hashes = content_hashes(chunk_texts)
+                for text, text_hash in zip(chunk_texts, hashes.tolist()):
+                    texts.setdefault(text_hash, text)
+                for chunks, values in zip(history, (np.asarray(targets, dtype=np.int64),
+                                                    np.asarray(ids, dtype=np.int64), hashes)):
+                    chunks.append(values)
+            cursor.close()
+        finally:
+            db.close()
+        catalogue = [np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64) for chunks in catalogue]
+        history = [np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64) for chunks in history]
+        self.counts.update({'products': len(catalogue[0]), 'history': len(history[0]), 'unique_texts': len(texts)})
+        self.timings['load_s'] = round(time.perf_counter() - start, 3)
+        get_metrics().observe_stage('compare_job.load', time.perf_counter() - start)
+
+        # Embed every distinct text once for all the targets
+        self.state = 'encoding'
+        start = time.perf_counter()
+        text_hashes = np.fromiter(texts.keys(), dtype=np.uint64, count=len(texts))
+        texts = list(texts.values())
+        vectors = np.empty((len(texts), encoder.dimension), dtype=np.float32)
+        for offset in range(0, len(texts), self.chunk_size):
+            vectors[offset:offset + self.chunk_size] = encoder.encode(texts[offset:offset + self.chunk_size])
+        del texts
+        order = np.argsort(text_hashes)
+        text_hashes = text_hashes[order]
+        self.timings['encode_s'] = round(time.perf_counter() - start, 3)
+        get_metrics().observe_stage('compare_job.encode', time.perf_counter() - start)
+
+        def vectors_of(hashes: np.ndarray) -> np.ndarray:
+            return vectors[order[np.searchsorted(text_hashes, hashes)]]
+
+        # Split the rows by target
+        product_targets = pd.Series(np.arange(len(catalogue[0]))).groupby(catalogue[0]).indices
+        history_targets = pd.Series(np.arange(len(history[0]))).groupby(history[0]).indices
+        with self._lock:
+            for id_target in sorted({int(target) for target in
+                                     [*(self.targets or []), *product_targets, *history_targets]}):
+                self.target_status[id_target] = {'state': 'pending'}
+
+        self.state = 'matching'
+        start = time.perf_counter()
+
+        def match(id_target: int):
+            target_start = time.perf_counter()
+            products = product_targets.get(id_target)
+            rows = history_targets.get(id_target)
+            if products is None or rows is None:
+                self._set_target(id_target, state='skipped', products=0 if products is None else len(products),
+                                 history=0 if rows is None else len(rows),
+                                 reason='no target products' if products is None else 'no price history')
+                return
+            self._set_target(id_target, state='matching', products=len(products), history=len(rows))
+            try:
+                product_ids, hashes, stale = catalogue[1][products], catalogue[2][products], catalogue[3][products]
+                vector_index, index_path = indexes[id_target]
+                step = time.perf_counter()
+                index_stats = update_target_index(vector_index, index_path, product_ids, product_ids[stale],
+                                                  vectors_of(hashes[stale]), hashes[stale])
+                k = min(int(os.environ.get('COMPARE_TOP_K', 10)), len(product_ids))
+                scores, candidate_ids = vector_index.search(vectors_of(history[2][rows]), k=k)
+                candidates = pd.Index(product_ids).get_indexer(candidate_ids.ravel()).reshape(candidate_ids.shape)
+                search_time = time.perf_counter() - step
+                db = self.connect()
+                try:
+                    assignment_time, write_stats = save_matches(db, self.database_prefix, product_ids,
+                                                                history[1][rows], scores, candidates)
+                finally:
+                    db.close()
+                for stage, seconds in (('search', search_time), ('assignment', assignment_time),
+                                       ('write', write_stats['write_s'])):
+                    get_metrics().observe_stage(f'compare_job.{stage}', seconds)
+                self._set_target(id_target, state='done', encoded_products=int(stale.sum()), index=index_stats,
+                                 search_s=round(search_time, 3), assignment_s=round(assignment_time, 3),
+                                 write=write_stats, seconds=round(time.perf_counter() - target_start, 3))
+            except Exception as e:
+                traceback.print_exc()
+                self._set_target(id_target, state='failed', error=str(e),
+                                 seconds=round(time.perf_counter() - target_start, 3))
+
+        with concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='compare-worker') as executor:
+            list(executor.map(match, list(self.target_status)))
+        self.timings['match_s'] = round(time.perf_counter() - start, 3)
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def start_job(host, user, passwd, database, database_prefix, targets: Optional[list] = None,
+              incremental: bool = False, workers: Optional[int] = None) -> CompareJob:
+    """
+    Start a bulk compare job on pooled connections (the settings are those of compare_product).
+    The COMPARE_JOBS_KEPT most recent jobs are kept for their status.
+    Args:
+        host, user, passwd, database: The MySQL connection settings (user and passwd name environment variables)
+        database_prefix: The prefix of the table names
+        targets: The targets to compare, None for all the targets
+        incremental: Only match the history rows that have no relation yet
+        workers: The number of targets matched at the same time (COMPARE_JOB_WORKERS by default), at most
+            MYSQL_POOL_SIZE - 1 so a pooled connection stays free for /api/compare
+
+    Returns: CompareJob: The started job
+
+    """
+    # Each worker holds a pooled connection while it writes: more workers than connections would only wait
+    workers = min(workers or int(os.environ.get('COMPARE_JOB_WORKERS', 4)), max(1, pool_size() - 1))
+    job = CompareJob(
+        database_prefix, targets, incremental,
+        workers=workers,
+        connect=lambda: get_connection(host, user, passwd, database),
+        chunk_size=int(os.environ.get('COMPARE_CHUNK_SIZE', 10000)),
+    )
+    with _jobs_lock:
+        _jobs[job.id] = job
+        kept = int(os.environ.get('COMPARE_JOBS_KEPT', 20))
+        for old in sorted(_jobs.values(), key=lambda item: item.created)[:-kept]:
+            if old.finished is not None:
+                del _jobs[old.id]
+    return job.start()
+
+
+def get_job(job_id: str) -> Optional[CompareJob]:
+    """
+    Get a job started by start_job.
+    Returns: CompareJob: The job, None if it is unknown (or was dropped)
+
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
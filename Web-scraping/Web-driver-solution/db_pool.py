@@ -0,0 +1,133 @@
+"""
+Pooled MySQL connections and bulk writes for compare.py.
+Connections are taken from a per-database pool instead of being opened on every /api/compare call, and the
+relations are written with multi-row INSERT ... ON DUPLICATE KEY UPDATE statements instead of one statement
+per row. When every connection of a pool is in use, get_connection waits for one to be closed (up to
+MYSQL_POOL_TIMEOUT seconds) instead of failing.
+"""
+import itertools
+import os
+import threading
+import time
+
+import mysql.connector.pooling
+from mysql.connector.errors import PoolError
+
+_pools = {} # Settings -> (pool, semaphore of its free connections)
+_pools_lock = threading.Lock()
+
+
+class PooledConnection:
+    """
+    A connection of the pool that frees its slot when it is closed (once, even if closed again).
+    """
+    def __init__(self, connection, slots: threading.BoundedSemaphore):
+        self._connection = connection
+        self._slots = slots
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def close(self):
+        slots, self._slots = self._slots, None
+        if slots is None:
+            return
+        try:
+            self._connection.close() # Back to the pool
+        finally:
+            slots.release()
+
+
+def pool_size() -> int:
+    """
+    Get the number of connections of a pool (MYSQL_POOL_SIZE).
+    """
+    return int(os.environ.get('MYSQL_POOL_SIZE', 5))
+
+
+def get_connection(host, user, passwd, database, timeout: float = None) -> PooledConnection:
+    """
+    Get a connection from the pool of a database, creating the pool on first use (MYSQL_POOL_SIZE connections).
+    When all the connections are in use, wait for one to be closed. The connection goes back to the pool when
+    it is closed.
+    Args:
+        host: The MySQL host (overridden by MYSQL_HOST)
+        user: The environment variable holding the user name
+        passwd: The environment variable holding the password
+        database: The database (overridden by MYSQL_DATABASE)
+        timeout: The maximum wait in seconds for a free connection, defaults to MYSQL_POOL_TIMEOUT (30)
+
+    Returns: PooledConnection: The connection
+
+    """
+    settings = {
+        'host': os.environ.get('MYSQL_HOST', host),
+        'user': os.environ.get(user),
+        'password': os.environ.get(passwd),
+        'database': os.environ.get('MYSQL_DATABASE', database),
+    }
+    key = tuple(settings.values())
+    with _pools_lock:
+        entry = _pools.get(key)
+        if entry is None:
+            size = pool_size()
+            entry = _pools[key] = (mysql.connector.pooling.MySQLConnectionPool(
+                pool_name=f'compare-{len(_pools)}',
+                pool_size=size,
+                pool_reset_session=True,
+                **settings), threading.BoundedSemaphore(size))
+    pool, slots = entry
+    if timeout is None:
+        timeout = float(os.environ.get('MYSQL_POOL_TIMEOUT', 30))
+    if not slots.acquire(timeout=timeout): # The pool itself raises at once when it is exhausted
+        raise PoolError(f"No free MySQL connection after {timeout:g}s (MYSQL_POOL_SIZE={pool.pool_size})")
+    try:
+        return PooledConnection(pool.get_connection(), slots)
+    except BaseException:
+        slots.release()
+        raise
+
+
+def upsert_relations(db, database_prefix: str, pairs, batch_size: int = 1000, commit_every: int = 0) -> dict:
+    """
+    Save (id_product, id_history) relations with chunked multi-row upserts.
+    Args:
+        db: The DB-API connection
+        database_prefix: The prefix of the table names
+        pairs: The (id_product, id_history) pairs
+        batch_size: The number of rows per statement
+        commit_every: Commit after this many statements, 0 to commit once at the end
+
+    Returns: dict: The number of rows, statements, commits (round-trips) and the rows per second
+
+    """
+    pairs = iter(pairs) # Consumed chunk by chunk, the pairs are never all converted at once
+    cursor = db.cursor()
+    start = time.perf_counter()
+    rows = statements = commits = 0
+    while True:
+        chunk = [(int(id_product), int(id_history)) for id_product, id_history in itertools.islice(pairs, batch_size)]
+        if not chunk:
+            break
+        rows += len(chunk)
+        cursor.execute(
+            "INSERT INTO " + database_prefix + "product_history_relation (id_product, id_history) VALUES " +
+            ", ".join(["(%s, %s)"] * len(chunk)) +
+            " ON DUPLICATE KEY UPDATE id_product = VALUES(id_product)",
+            [value for pair in chunk for value in pair])
+        statements += 1
+        if commit_every and statements % commit_every == 0:
+            db.commit()
+            commits += 1
+    if not commit_every or statements % commit_every:
+        db.commit()
+        commits += 1
+    cursor.close()
+    elapsed = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'statements': statements,
+        'round_trips': statements + commits,
+        'rows_per_s': round(rows / elapsed) if elapsed > 0 else None,
+        'write_s': round(elapsed, 3),
+    }
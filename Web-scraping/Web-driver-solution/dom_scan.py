@@ -0,0 +1,365 @@
+"""
+Single-pass analysis of a parsed page.
+The tree is never modified: instead of decomposing the unwanted tags (scripts, navigation, footers...),
+their subtrees are skipped while walking the tree and while reading the text of the elements.
+"""
+import re
+
+from bs4 import CData, NavigableString, SoupStrainer, Tag
+
+_DEFAULT_STRING_TYPES = frozenset(getattr(Tag, 'MAIN_CONTENT_STRING_TYPES', (NavigableString, CData)))
+
+
+def _string_types(element) -> frozenset:
+    """
+    Get the string classes read by element.get_text() (e.g. Script strings only count inside a script tag).
+    Args:
+        element: The HTML element
+
+    Returns: frozenset: The NavigableString subclasses to keep
+
+    """
+    types = getattr(element, 'interesting_string_types', None) or _DEFAULT_STRING_TYPES
+    return frozenset([types]) if isinstance(types, type) else frozenset(types)
+
+
+def iter_strings(element, skip: frozenset = frozenset()):
+    """
+    Iterate over the strings element.get_text() would read, ignoring the subtrees of the skipped tags.
+    Args:
+        element: The HTML element
+        skip: The names of the tags whose subtrees are ignored
+
+    Returns: Iterator[str]: The strings in document order
+
+    """
+    types = _string_types(element)
+    stack = list(reversed(element.contents))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tag):
+            if node.name not in skip:
+                stack.extend(reversed(node.contents))
+        elif type(node) in types:
+            yield node
+
+
+def visible_text(element, skip: frozenset = frozenset(), strip: bool = False) -> str:
+    """
+    Equivalent of element.get_text(strip=strip) on a tree where the skipped tags were decomposed.
+    Args:
+        element: The HTML element
+        skip: The names of the tags whose subtrees are ignored
+        strip: Strip every string and drop the empty ones
+
+    Returns: str: The text of the element
+
+    """
+    if strip:
+        return ''.join(s for s in (string.strip() for string in iter_strings(element, skip)) if s)
+    return ''.join(iter_strings(element, skip))
+
+
+class PageScan:
+    """
+    The candidates collected by scan_page.
+    Elements inside a skipped subtree are "pruned": they are only reported by the queries, separately
+    from the unpruned matches.
+    """
+    def __init__(self):
+        self.prices = [] # Unpruned (index, element, text) whose text is exactly a price, in document order
+        self.containers = [] # Unpruned (element, depth, start, end, text length) product container candidates
+        self.headings = [] # Unpruned (index, h1 element), in document order
+        self.matches = {} # Query key -> [first match, first unpruned match]
+        self.bare = {} # Tag name -> unpruned elements of that name without attributes
+
+    def match(self, key: str, pruned: bool = False):
+        """
+        Get the first element matched by a query.
+        Args:
+            key: The query key
+            pruned: Ignore the elements inside the skipped subtrees
+
+        Returns: Tag: The first matching element, or None
+
+        """
+        return self.matches.get(key, (None, None))[1 if pruned else 0]
+
+    def first_heading(self, container=None):
+        """
+        Equivalent of container.find('h1') on the pruned tree.
+        Args:
+            container: One of the container candidates, None for the whole page
+
+        Returns: Tag: The first unpruned h1 inside the container, or None
+
+        """
+        if container is None:
+            return self.headings[0][1] if self.headings else None
+        _, _, start, end, _ = container
+        for index, heading in self.headings:
+            if start < index <= end:
+                return heading
+            if index > end:
+                break
+        return None
+
+
+PRICE_TAGS = frozenset(['div', 'span', 'p'])
+CONTAINER_TAGS = frozenset(['div', 'section', 'article', 'main'])
+
+# Pre-filters for the price patterns, applied to every string once: a price (see DOMExtractor.PRICE_PATTERNS)
+# only contains digits, separators, spaces, upper case currency codes and currency symbols, needs at least
+# one digit and a currency (all the currency codes contain a D).
+_NOT_PRICE_CHAR = re.compile(r'[^\d.,\sA-Z$€£]')
+_DIGIT = re.compile(r'\d')
+_CURRENCY_CHAR = re.compile(r'[D$€£]')
+
+
+def compile_price_patterns(patterns: list) -> re.Pattern:
+    """
+    Combine the price patterns into one compiled pattern.
+    Args:
+        patterns: The price patterns, each anchored with ^ and $
+
+    Returns: re.Pattern: A pattern matching whenever one of the patterns matches
+
+    """
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns))
+
+
+class _Frame:
+    """
+    The state of an unpruned element while its subtree is walked.
+    The text is only assembled while it can still be a price: as soon as a string of the subtree
+    has a character that can't appear in a price, the element and all its ancestors are marked bad.
+    """
+    __slots__ = ('element', 'index', 'parent', 'slot', 'bad', 'digit', 'currency', 'parts', 'container', 'length')
+
+    def __init__(self, element, index, parent, slot):
+        self.element = element
+        self.index = index
+        self.parent = parent # The frame of the parent element, None for the roots
+        self.slot = slot # The position of the element in the parent's parts
+        self.bad = False
+        self.digit = False
+        self.currency = False
+        self.parts = None # The strings and the children's texts, in document order
+        self.container = None
+        self.length = 0 # Length of the stripped text of the subtree (as in get_text(strip=True))
+
+
+def scan_page(soup, skip: frozenset, queries: dict = None, bare: frozenset = frozenset(),
+              price_regex: re.Pattern = None, price_tags: frozenset = PRICE_TAGS) -> PageScan:
+    """
+    Walk the tree once and collect the price, title, description and stock candidates.
+    The texts are aggregated bottom-up, so the price detection is linear in the size of the page.
+    Args:
+        soup: The parsed page
+        skip: The names of the tags whose subtrees are pruned
+        queries: Query key -> (tag name, attributes), for the elements looked up like soup.find(name, attrs=attributes)
+        bare: The tag names whose attribute-less unpruned elements are collected
+        price_regex: The compiled price pattern (see compile_price_patterns), None to skip the price detection
+        price_tags: The tag names of the price candidates, None for all the tags
+
+    Returns: PageScan: The collected candidates
+
+    """
+    scan = PageScan()
+    by_name = {} # Tag name -> [(key, strainer)], so only the relevant queries are tried on an element
+    for key, (name, attrs) in (queries or {}).items():
+        scan.matches[key] = [None, None]
+        by_name.setdefault(name, []).append((key, SoupStrainer(name=name, attrs=attrs or {})))
+    pending = set(scan.matches) # Queries still missing an unpruned match
+
+    index = 0
+    # Stack of elements to enter, as (element, depth, parent frame, slot, pruned), and of frames to close
+    stack = [(child, 1, None, 0, False) for child in reversed(soup.contents) if isinstance(child, Tag)]
+    while stack:
+        item = stack.pop()
+        if type(item) is _Frame:
+            _close_frame(item, index, scan, price_regex, price_tags, skip)
+            continue
+        element, depth, parent, slot, pruned = item
+        index += 1
+        name = element.name
+        pruned = pruned or name in skip
+
+        if pending:
+            for key, strainer in by_name.get(name, []) + by_name.get(None, []):
+                found = scan.matches[key]
+                if found[1] is None and strainer.matches_tag(element):
+                    if found[0] is None:
+                        found[0] = element
+                    if not pruned:
+                        found[1] = element
+                        pending.discard(key)
+
+        if pruned:
+            # Only the queries look inside the pruned subtrees
+            if pending:
+                stack.extend((child, depth + 1, None, 0, True)
+                             for child in reversed(element.contents) if isinstance(child, Tag))
+            continue
+
+        if name == 'h1':
+            scan.headings.append((index, element))
+        if name in bare and not element.attrs:
+            scan.bare.setdefault(name, []).append(element)
+        frame = _Frame(element, index, parent, slot)
+        if name in CONTAINER_TAGS:
+            frame.container = [element, depth, index, index, 0]
+            scan.containers.append(frame.container)
+
+        parts = []
+        children = []
+        for child in element.contents:
+            if isinstance(child, Tag):
+                children.append((child, depth + 1, frame, len(parts), False))
+                parts.append('') # Filled with the child's text when it is closed
+            elif type(child) in _DEFAULT_STRING_TYPES:
+                frame.length += len(child.strip())
+                if not frame.bad:
+                    if _NOT_PRICE_CHAR.search(child):
+                        frame.bad = True
+                    else:
+                        frame.digit = frame.digit or _DIGIT.search(child) is not None
+                        frame.currency = frame.currency or _CURRENCY_CHAR.search(child) is not None
+                parts.append(child)
+        if not frame.bad:
+            frame.parts = parts
+        stack.append(frame) # Closed once all the children are done
+        stack.extend(reversed(children))
+
+    scan.containers = [tuple(container) for container in scan.containers]
+    scan.prices.sort(key=lambda price: price[0])
+    return scan
+
+
+def _close_frame(frame: _Frame, index: int, scan: PageScan, price_regex, price_tags, skip):
+    """
+    Finish an element once its whole subtree was walked: check whether its text is a price and pass
+    the text on to the parent.
+    """
+    element = frame.element
+    if frame.container is not None:
+        frame.container[3] = index # The last element of the subtree
+        frame.container[4] = frame.length
+    text = None
+    if not frame.bad:
+        text = ''.join(frame.parts)
+        frame.parts = None
+    if price_regex is not None and (price_tags is None or element.name in price_tags):
+        if _string_types(element) != _DEFAULT_STRING_TYPES:
+            # e.g. a template, whose own text is made of strings its ancestors ignore
+            own_text = visible_text(element, skip).strip()
+            if price_regex.match(own_text):
+                scan.prices.append((frame.index, element, own_text))
+        elif text is not None and frame.digit and frame.currency:
+            stripped = text.strip()
+            if price_regex.match(stripped):
+                scan.prices.append((frame.index, element, stripped))
+    parent = frame.parent
+    if parent is not None:
+        parent.length += frame.length
+    if parent is not None and not parent.bad:
+        if text is None:
+            parent.bad = True
+            parent.parts = None
+        else:
+            parent.parts[frame.slot] = text
+            parent.digit = parent.digit or frame.digit
+            parent.currency = parent.currency or frame.currency
+
+
+def container_weight(element, text_length: int, depth: int, indicators: list) -> float:
+    """
+    Calculate importance weight of a product container candidate.
+    The weight grows with the product indicators found in the id and classes and with the text length,
+    and decreases with the depth in the DOM tree.
+    Args:
+        element: The HTML element
+        text_length: The length of the stripped text of the element
+        depth: The depth of the element in the DOM tree (number of parents)
+        indicators: The indicators of product-related elements
+
+    Returns: float: The importance weight of the element
+
+    """
+    weight = 1.0 # Default weight
+
+    # Check element attributes
+    if element.get('id') or element.get('class') or element.get('content'):
+        for indicator in indicators:
+            if indicator in str(element.get('id', '')).lower() or \
+                    indicator in ' '.join(element.get('class', [])).lower():
+                weight *= 1.5  # Increase weight
+
+    weight *= min(text_length / 100, 3) # Normalize weight based on text length
+    weight /= max(depth, 1) # Avoid division by zero
+    return weight
+
+
+def best_container(containers, indicators: list):
+    """
+    Pick the container candidate with the highest weight (the first one on ties).
+    Args:
+        containers: The (element, depth, start, end, text length) candidates in document order
+        indicators: The indicators of product-related elements
+
+    Returns: tuple: The best candidate, or None if no candidate has a positive weight
+
+    """
+    max_weight = 0
+    main_container = None
+    for container in containers:
+        weight = container_weight(container[0], container[4], container[1], indicators)
+        if weight > max_weight:
+            max_weight = weight
+            main_container = container
+    return main_container
+
+
+def find_product_container(soup, indicators: list, skip: frozenset = frozenset(), tags: frozenset = CONTAINER_TAGS):
+    """
+    Find the main product container of a page in one post-order traversal, for the callers without a PageScan.
+    Args:
+        soup: The parsed page
+        indicators: The indicators of product-related elements
+        skip: The names of the tags whose subtrees are ignored
+        tags: The tag names of the container candidates
+
+    Returns: Tag: The main product container, or None if no candidate has a positive weight
+
+    """
+    containers = [] # [element, depth, start, end, text length] in document order
+    # Stack of (element, depth, parent frame) to enter, and of frames to close.
+    # A frame is [text length, parent frame, container or None].
+    stack = [(child, 1, None) for child in reversed(soup.contents) if isinstance(child, Tag)]
+    while stack:
+        item = stack.pop()
+        if type(item) is list:
+            length, parent, container = item
+            if container is not None:
+                container[4] = length
+            if parent is not None:
+                parent[0] += length
+            continue
+        element, depth, parent = item
+        if element.name in skip:
+            continue
+        container = None
+        if element.name in tags:
+            container = [element, depth, 0, 0, 0]
+            containers.append(container)
+        frame = [0, parent, container]
+        children = []
+        for child in element.contents:
+            if isinstance(child, Tag):
+                children.append((child, depth + 1, frame))
+            elif type(child) in _DEFAULT_STRING_TYPES:
+                frame[0] += len(child.strip())
+        stack.append(frame)
+        stack.extend(reversed(children))
+    container = best_container(containers, indicators)
+    return container[0] if container else None
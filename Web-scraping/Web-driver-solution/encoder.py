@@ -0,0 +1,100 @@
+"""
+The sentence encoder used by compare.py, loaded once per process and shared by all the requests.
+Only the unique texts of a call are encoded, the vectors are then mapped back to the rows.
+"""
+import os
+import threading
+import time
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+
+class Encoder:
+    """
+    A resident SentenceTransformer model.
+    """
+    def __init__(self, model_name: str = 'paraphrase-MiniLM-L6-v2', batch_size: int = 64, device: str = None):
+        """
+        Args:
+            model_name: The SentenceTransformer model
+            batch_size: The number of texts encoded per batch
+            device: The torch device (cpu, cuda...), None to let SentenceTransformer choose
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self.model = None
+        self.load_seconds = None # Time spent loading the model, None until it is loaded
+        self._load_lock = threading.Lock()
+        self._encode_lock = threading.Lock() # One encode at a time: torch already uses all the cores
+
+    def load(self) -> SentenceTransformer:
+        """
+        Load the model if it isn't loaded yet.
+        Returns: SentenceTransformer: The model
+
+        """
+        with self._load_lock:
+            if self.model is None:
+                start = time.perf_counter()
+                self.model = SentenceTransformer(self.model_name, device=self.device)
+                self.load_seconds = time.perf_counter() - start
+                print(f"Loaded {self.model_name} in {self.load_seconds:.2f}s")
+        return self.model
+
+    @property
+    def dimension(self) -> int:
+        """
+        The dimension of the vectors (loads the model).
+        """
+        return self.load().get_sentence_embedding_dimension()
+
+    def warmup(self):
+        """
+        Load the model and run a first encode, so the first request doesn't pay for the lazy initializations.
+        """
+        try:
+            self.encode(['warmup'])
+        except Exception as e:
+            print(f"Error warming up the encoder: {e}")
+
+    def encode(self, texts: list) -> np.ndarray:
+        """
+        Encode texts, each distinct text once.
+        Args:
+            texts: The texts, possibly with duplicates
+
+        Returns: np.ndarray: One vector per text, in the order of the texts
+
+        """
+        model = self.load()
+        if not len(texts):
+            return np.empty((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Deduplicated with a dict: a fixed-width string array would take rows x longest text x 4 bytes
+        index = {}
+        inverse = [index.setdefault(str(text), len(index)) for text in texts]
+        with self._encode_lock:
+            vectors = model.encode(list(index), batch_size=self.batch_size, convert_to_numpy=True)
+        return vectors[np.asarray(inverse, dtype=np.intp)]
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder() -> Encoder:
+    """
+    Get the process-wide encoder (ENCODER_MODEL, ENCODER_BATCH_SIZE, ENCODER_DEVICE), loaded on first use.
+    Returns: Encoder: The shared encoder
+
+    """
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = Encoder(
+                model_name=os.environ.get('ENCODER_MODEL', 'paraphrase-MiniLM-L6-v2'),
+                batch_size=int(os.environ.get('ENCODER_BATCH_SIZE', 64)),
+                device=os.environ.get('ENCODER_DEVICE') or None,
+            )
+        return _encoder
@@ -0,0 +1,198 @@
+"""
+Plain-HTTP fast path for the extraction.
+Many shops render their prices server-side, so a plain HTTP fetch (cloudscraper, as in ../price.py) is enough.
+The outcome is remembered per domain: "http-ok" domains keep using HTTP, "needs-browser" domains go
+straight to Playwright until the decision expires. A domain needs the browser when it refuses plain HTTP
+(403, 429, 503 or a bot challenge page) or when its HTTP fetches fail several times in a row.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+import cloudscraper
+
+HTTP_OK = 'http-ok'
+NEEDS_BROWSER = 'needs-browser'
+BLOCKED_STATUSES = frozenset([403, 429, 503]) # The site refuses (or challenges) clients without a browser
+# Texts of the bot challenge pages served with a 200 (Cloudflare, DataDome, PerimeterX), lower-cased
+CHALLENGE_MARKERS = ('<title>just a moment...</title>', 'cf-browser-verification', 'cf_chl_opt',
+                     'attention required! | cloudflare', 'checking your browser before accessing',
+                     'captcha-delivery.com', 'px-captcha')
+
+
+def domain_of(url: str) -> str:
+    """
+    Get the domain a decision applies to.
+    Args:
+        url: The URL of a page
+
+    Returns: str: The lower-cased host without the www. prefix
+
+    """
+    host = (urlparse(url).hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class DomainStrategies:
+    """
+    The per-domain fetch decisions, persisted to a JSON file.
+    """
+    def __init__(self, path: Optional[str] = None, ttl: float = 7 * 24 * 3600, max_failures: int = 3):
+        """
+        Args:
+            path: The JSON file storing the decisions, None to keep them in memory only
+            ttl: The time (in seconds) after which a decision is tried again
+            max_failures: The failed HTTP fetches in a row (timeouts, errors) after which a domain needs the browser
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_failures = max_failures
+        self._lock = threading.Lock()
+        self._decisions = {} # Domain -> {'mode': HTTP_OK or NEEDS_BROWSER, 'updated': timestamp}
+        self._failures = {} # Domain -> failed HTTP fetches in a row, kept in memory only
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self._decisions = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error loading the fetch strategies: {e}")
+
+    def mode(self, url: str) -> Optional[str]:
+        """
+        Get the current decision for the domain of a URL.
+        Args:
+            url: The URL of a page
+
+        Returns: str: HTTP_OK, NEEDS_BROWSER or None if the domain is unknown (or its decision expired)
+
+        """
+        with self._lock:
+            decision = self._decisions.get(domain_of(url))
+        if decision is None or time.time() - decision['updated'] > self.ttl:
+            return None
+        return decision['mode']
+
+    def use_http(self, url: str) -> bool:
+        """
+        Check whether the HTTP fast path should be tried for a URL.
+        """
+        return self.mode(url) != NEEDS_BROWSER
+
+    def record(self, url: str, mode: str):
+        """
+        Remember the outcome of a fetch for the domain of a URL.
+        Args:
+            url: The URL of the page
+            mode: HTTP_OK or NEEDS_BROWSER
+
+        """
+        domain = domain_of(url)
+        with self._lock:
+            self._failures.pop(domain, None)
+            previous = self._decisions.get(domain)
+            self._decisions[domain] = {'mode': mode, 'updated': time.time()}
+            if previous is not None and previous['mode'] == mode and \
+                    time.time() - previous['updated'] < self.ttl / 2:
+                return # Nothing new to persist
+            self._save()
+
+    def record_failure(self, url: str):
+        """
+        Count a failed HTTP fetch (timeout, network error, unusable reply) for the domain of a URL, which needs
+        the browser after max_failures in a row.
+        Args:
+            url: The URL of the page
+
+        """
+        domain = domain_of(url)
+        with self._lock:
+            failures = self._failures[domain] = self._failures.get(domain, 0) + 1
+        if failures >= self.max_failures:
+            self.record(url, NEEDS_BROWSER)
+
+    def _save(self):
+        if not self.path:
+            return
+        temporary = None
+        try:
+            # A temporary file of its own, so processes sharing the file never write to the same one
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+            with os.fdopen(descriptor, 'w') as f:
+                json.dump(self._decisions, f, indent=1, sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            print(f"Error saving the fetch strategies: {e}")
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+
+    def snapshot(self) -> dict:
+        """
+        Get all the decisions.
+        Returns: dict: Domain -> decision
+
+        """
+        with self._lock:
+            return dict(self._decisions)
+
+
+_local = threading.local()
+
+
+def is_challenge(html_content: str) -> bool:
+    """
+    Check whether a page is a bot challenge instead of the requested page.
+    """
+    head = html_content[:20000].lower() # The challenge pages are small, their markers come early
+    return any(marker in head for marker in CHALLENGE_MARKERS)
+
+
+def http_fetch(url: str, timeout: float = 15) -> tuple[Optional[int], Optional[str]]:
+    """
+    Fetch a page without a browser.
+    Args:
+        url: The URL of the page
+        timeout: The request timeout in seconds
+
+    Returns: tuple: The status code (None if the request failed) and the HTML content (None unless the reply
+    is a 200 HTML page)
+
+    """
+    scraper = getattr(_local, 'scraper', None)
+    if scraper is None: # cloudscraper sessions aren't thread-safe, keep one per thread
+        scraper = _local.scraper = cloudscraper.create_scraper()
+        proxy = os.environ.get('PROXY_SERVER', "socks5://127.0.0.1:8899")
+        if proxy:
+            scraper.proxies = {'http': proxy, 'https': proxy}
+    try:
+        response = scraper.get(url, timeout=timeout)
+    except Exception as e:
+        print(f"HTTP fetch failed for {url}: {e}")
+        return None, None
+    if response.status_code != 200 or 'html' not in response.headers.get('Content-Type', 'text/html'):
+        return response.status_code, None
+    return response.status_code, response.text
+
+
+_strategies = None
+_strategies_lock = threading.Lock()
+
+
+def get_strategies() -> DomainStrategies:
+    """
+    Get the process-wide fetch decisions, loaded from the environment on first use.
+    Returns: DomainStrategies: The shared decisions
+
+    """
+    global _strategies
+    with _strategies_lock:
+        if _strategies is None:
+            _strategies = DomainStrategies(
+                path=os.environ.get('FETCH_STRATEGY_FILE', 'fetch_strategies.json') or None,
+                ttl=float(os.environ.get('FETCH_STRATEGY_TTL', 7 * 24 * 3600)),
+                max_failures=int(os.environ.get('FETCH_STRATEGY_MAX_FAILURES', 3)),
+            )
+        return _strategies
@@ -0,0 +1,302 @@
+"""
+An append-only log of the extractions served by the API, replacing the interactions kept in the Flask session.
+Each interaction is a JSON line with an increasing id, written by a background thread so a request only pays
+for putting it in a queue. The lines go to segment files (interactions-<first id>.jsonl) rotated by size, the
+oldest segments being deleted beyond a count, and are queried newest first with filters and an id cursor.
+A log directory is written by one process.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from fetch_strategy import domain_of
+
+_STOP = None # Sent down the queue to stop the writer
+_PREFIX, _SUFFIX = 'interactions-', '.jsonl'
+
+
+class InteractionLog:
+    """
+    JSONL segments written by a background thread, with size-based rotation.
+    """
+    def __init__(self, directory: str = 'interactions', segment_bytes: int = 16 * 1024 * 1024,
+                 max_segments: int = 8, queue_size: int = 10000):
+        """
+        Args:
+            directory: The directory of the segments
+            segment_bytes: The size above which the next interactions go to a new segment
+            max_segments: The number of segments kept, the oldest ones are deleted
+            queue_size: The interactions waiting to be written, the next ones are dropped (and counted)
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+        self._queue = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._written = threading.Condition(self._lock)
+        self.counters = {'logged': 0, 'written': 0, 'dropped': 0, 'rotations': 0}
+        self._next_id, self._last_written = self._recover()
+        self._file = None
+        self._writer = threading.Thread(target=self._write_loop, name='interaction-log', daemon=True)
+        self._writer.start()
+
+    def _segments(self) -> list:
+        # The (first id, path) of the segments, oldest first
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(_PREFIX) and name.endswith(_SUFFIX):
+                try:
+                    segments.append((int(name[len(_PREFIX):-len(_SUFFIX)]), os.path.join(self.directory, name)))
+                except ValueError:
+                    pass
+        return sorted(segments)
+
+    def _recover(self) -> tuple:
+        """
+        Find the next id from the last segment, which the writer goes on appending to.
+        Returns: tuple: The next id and the last id written
+
+        """
+        self._resume = None
+        segments = self._segments()
+        if not segments:
+            return 1, 0
+        first_id, path = segments[-1]
+        last_id = first_id - 1
+        with open(path, 'rb') as f:
+            line = b''
+            for line in f:
+                try:
+                    last_id = json.loads(line)['id']
+                except (ValueError, KeyError):
+                    pass # A line cut by a crash
+        self._resume = (path, bool(line) and not line.endswith(b'\n'))
+        return last_id + 1, last_id
+
+    def append(self, endpoint: str, url: str, client: Optional[str] = None, **values) -> Optional[int]:
+        """
+        Log an interaction, without waiting for it to be written.
+        Args:
+            endpoint: The API endpoint that served it
+            url: The URL of the page
+            client: The address of the client
+            values: The values returned (JSON-serializable)
+
+        Returns: int: The id of the interaction, None if the queue was full and it was dropped
+
+        """
+        with self._lock:
+            interaction_id = self._next_id
+            # The id first, so the queries read it without decoding the line
+            record = {'id': interaction_id, 'time': time.time(), 'endpoint': endpoint, 'url': url, 'client': client,
+                      **values}
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                self.counters['dropped'] += 1
+                return None
+            self._next_id += 1
+            self.counters['logged'] += 1
+        return interaction_id
+
+    def _write_loop(self):
+        while True:
+            records = [self._queue.get()]
+            while records[-1] is not _STOP: # Everything that queued up meanwhile is written at once
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = records[-1] is _STOP
+            records = [record for record in records if record is not _STOP]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                print(f"Error writing the interaction log: {e}")
+                self._close_segment() # Reopened for the next records
+            with self._written:
+                if records:
+                    self._last_written = records[-1]['id']
+                    self.counters['written'] += len(records)
+                self._written.notify_all()
+            if stop:
+                self._close_segment()
+                return
+
+    def _write(self, records: list):
+        if self._file is None and self._resume:
+            path, cut = self._resume
+            self._file = open(path, 'ab') # The last segment of the previous run
+            if cut:
+                self._file.write(b'\n') # Ends the line cut by a crash, skipped by the queries
+            self._resume = None
+        chunk, size = [], self._file.tell() if self._file is not None else 0
+        for record in records:
+            line = (json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+            if self._file is None or size and size + len(line) > self.segment_bytes:
+                if chunk:
+                    self._file.write(b''.join(chunk))
+                self._rotate(record['id'])
+                chunk, size = [], 0
+            chunk.append(line)
+            size += len(line)
+        self._file.write(b''.join(chunk))
+        self._file.flush()
+
+    def _rotate(self, first_id: int):
+        """
+        Start a new segment, after a full one, and delete the oldest segments beyond max_segments.
+        Args:
+            first_id: The id of the first interaction of the new segment
+
+        """
+        if self._file is not None:
+            self.counters['rotations'] += 1
+        self._close_segment()
+        self._file = open(os.path.join(self.directory, f'{_PREFIX}{first_id:012d}{_SUFFIX}'), 'ab')
+        for _, path in self._segments()[:-self.max_segments]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error removing an interaction log segment: {e}")
+
+    def _close_segment(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """
+        Wait until the interactions logged so far are written.
+        Args:
+            timeout: The maximum wait in seconds
+
+        Returns: bool: True if they were all written
+
+        """
+        with self._written:
+            target = self._next_id - 1
+            return self._written.wait_for(lambda: self._last_written >= target or not self._writer.is_alive(),
+                                          timeout)
+
+    def query(self, limit: int = 50, before: Optional[int] = None, endpoint: Optional[str] = None,
+              domain: Optional[str] = None, url: Optional[str] = None, client: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> tuple[list, Optional[int]]:
+        """
+        Get the interactions newest first, one page at a time.
+        Args:
+            limit: The maximum number of interactions returned
+            before: Only the interactions with a smaller id (the cursor of the previous page)
+            endpoint: Only the interactions of this endpoint
+            domain: Only the pages of this domain (without www.)
+            url: Only the URLs containing this text
+            client: Only the interactions of this client address
+            since: Only the interactions logged at or after this time (Unix seconds)
+            until: Only the interactions logged before this time (Unix seconds)
+
+        Returns: tuple: The interactions and the cursor of the next page (None on the last page)
+
+        """
+        self.flush()
+        domain = domain and domain_of(f'//{domain}') # As the URLs are compared: lower-cased, without www.
+        # Texts a matching line must contain, checked before decoding it
+        needles = [json.dumps(text, ensure_ascii=False)[1:-1].encode('utf-8') for text in (endpoint, url, client) if text]
+        results = []
+        for first_id, path in reversed(self._segments()):
+            if before is not None and first_id >= before:
+                continue # Every interaction of the segment is after the cursor
+            try:
+                with open(path, 'rb') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue # Deleted by a rotation meanwhile
+            for line in reversed(lines):
+                if before is not None and _line_id(line) >= before:
+                    continue
+                if not all(needle in line for needle in needles):
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # A line cut by a crash
+                if since is not None and record['time'] < since:
+                    return results, None # The older interactions are all before since
+                if until is not None and record['time'] >= until:
+                    continue
+                if endpoint and record['endpoint'] != endpoint or client and record.get('client') != client:
+                    continue
+                if domain and domain_of(record['url']) != domain or url and url not in record['url']:
+                    continue
+                if len(results) == limit:
+                    return results, results[-1]['id'] # There is a next page
+                results.append(record)
+        return results, None
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the log.
+        Returns: dict: The interactions logged, written and dropped, the rotations and the queue length
+
+        """
+        with self._lock:
+            return dict(self.counters, queued=self._queue.qsize())
+
+    def close(self, timeout: float = 10):
+        """
+        Write the queued interactions and stop the writer.
+        """
+        if self._writer.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                return
+            self._writer.join(timeout)
+
+
+def _line_id(line: bytes) -> int:
+    # The id of a line, at its start: {"id": 123, ...
+    try:
+        return int(line[7:line.index(b',', 7)])
+    except ValueError:
+        return 0 # A line cut by a crash, skipped when decoded
+
+
+_log = None
+_log_lock = threading.Lock()
+
+
+def get_interaction_log() -> InteractionLog:
+    """
+    Get the process-wide interaction log, created from the environment on first use.
+    Returns: InteractionLog: The shared log
+
+    """
+    global _log
+    with _log_lock:
+        if _log is None:
+            _log = InteractionLog(
+                directory=os.environ.get('INTERACTION_LOG_DIR', 'interactions'),
+                segment_bytes=int(os.environ.get('INTERACTION_LOG_SEGMENT_MB', 16)) * 1024 * 1024,
+                max_segments=int(os.environ.get('INTERACTION_LOG_SEGMENTS', 8)),
+                queue_size=int(os.environ.get('INTERACTION_LOG_QUEUE', 10000)),
+            )
+        return _log
+
+
+def close_interaction_log():
+    """
+    Flush and close the process-wide interaction log if it was created.
+    """
+    global _log
+    with _log_lock:
+        if _log is not None:
+            _log.close()
+            _log = None
@@ -0,0 +1,225 @@
+"""
+Latency and activity metrics of the scraping API, exported in the Prometheus text format by /metrics.
+The stages of the extractions and compares (browser launch, navigation, wait, page.content(), parses,
+heuristics, serialization, encoding...) are timed with span() into histograms labelled by stage.
+Recording a span costs two perf_counter calls and a locked bucket increment; the gauges read from the browser
+pool and the render cache and the text of the endpoint are only computed when /metrics is scraped.
+"""
+import bisect
+import os
+import threading
+import time
+from typing import Callable
+
+# Upper bounds (in seconds) of the histogram buckets: from the parses of small pages to the slow renders
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Type and help of the metrics, in the order of the /metrics text
+METRICS = {
+    'scraper_stage_seconds': ('histogram', 'Time spent in each stage of the extractions and compares'),
+    'scraper_stage_errors_total': ('counter', 'Stages that raised an exception'),
+    'scraper_request_seconds': ('histogram', 'Time spent serving the API requests, by endpoint'),
+    'scraper_requests_total': ('counter', 'API requests served, by endpoint and status code'),
+    'scraper_in_flight_requests': ('gauge', 'API requests being served, by endpoint'),
+    'scraper_render_waits_total': ('counter', 'Why the render profiles stopped waiting for a page'),
+    'scraper_browsers_open': ('gauge', 'Browsers of the pool currently open'),
+    'scraper_browser_pool_size': ('gauge', 'Browsers the pool can open'),
+    'scraper_browser_queued_jobs': ('gauge', 'Pages waiting for a browser of the pool'),
+    'scraper_browser_launches_total': ('counter', 'Browsers launched (or relaunched) by the pool'),
+    'scraper_browser_pages_total': ('counter', 'Pages rendered by the pool'),
+    'scraper_render_cache_total': ('counter', 'Render cache lookups and evictions, by result'),
+    'scraper_render_cache_entries': ('gauge', 'Pages in the memory tier of the render cache'),
+    'scraper_render_cache_bytes': ('gauge', 'Size of the pages in the memory tier of the render cache'),
+    'scraper_interactions_total': ('counter', 'Interactions logged, written and dropped (queue full) by the log'),
+    'scraper_interaction_log_queued': ('gauge', 'Interactions waiting to be written to the log'),
+}
+
+
+class Histogram:
+    """
+    Observations counted in cumulative buckets, with their sum.
+    """
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # The last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Span:
+    """
+    Times a stage into the stage histogram, counting the stages that raise.
+    """
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics: 'Metrics', stage: str):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.metrics.observe_stage(self.stage, time.perf_counter() - self.start, failed=exc_type is not None)
+        return False
+
+
+class _NoSpan:
+    """
+    The span of disabled metrics.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Metrics:
+    """
+    The histograms, counters and gauges of the process, and the collectors read when they are exported.
+    """
+    def __init__(self, enabled: bool = True, buckets: tuple = DEFAULT_BUCKETS):
+        """
+        Args:
+            enabled: Record the metrics, False to make span() and the other calls no-ops
+            buckets: The upper bounds (in seconds) of the histogram buckets
+        """
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {} # (name, labels) -> Histogram, the labels being a tuple of (name, value) pairs
+        self._values = {} # (name, labels) -> value of a counter or gauge
+        self._collectors = [] # Functions returning (name, labels dict, value) tuples when the metrics are exported
+
+    def span(self, stage: str):
+        """
+        Time a stage: `with metrics.span('browser.goto'): ...`
+        Args:
+            stage: The name of the stage, the stage label of scraper_stage_seconds
+
+        Returns: Span: The context manager
+
+        """
+        return Span(self, stage) if self.enabled else _NO_SPAN
+
+    def observe_stage(self, stage: str, seconds: float, failed: bool = False):
+        """
+        Record the duration of a stage timed by the caller.
+        Args:
+            stage: The name of the stage
+            seconds: Its duration
+            failed: Whether it raised an exception
+
+        """
+        if not self.enabled:
+            return
+        labels = (('stage', stage),)
+        self.observe('scraper_stage_seconds', seconds, labels)
+        if failed:
+            self.inc('scraper_stage_errors_total', labels)
+
+    def observe(self, name: str, value: float, labels: tuple = ()):
+        # Add an observation to a histogram
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[name, labels] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        # Increment a counter, or move a gauge by value
+        if not self.enabled:
+            return
+        with self._lock:
+            self._values[name, labels] = self._values.get((name, labels), 0) + value
+
+    def register(self, collector: Callable[[], list]):
+        """
+        Add a function read when the metrics are exported, for the values that are only worth computing then.
+        Args:
+            collector: A function returning a list of (name, labels dict, value) tuples
+
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """
+        Export the metrics in the Prometheus text format.
+        Returns: str: The text of the /metrics endpoint
+
+        """
+        samples = {}
+        with self._lock:
+            for (name, labels), histogram in self._histograms.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    samples.setdefault(name, []).append((f'{name}_bucket', labels + (('le', str(bound)),), cumulative))
+                samples[name].append((f'{name}_sum', labels, histogram.sum))
+                samples[name].append((f'{name}_count', labels, cumulative))
+            for (name, labels), value in self._values.items():
+                samples.setdefault(name, []).append((name, labels, value))
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    samples.setdefault(name, []).append((name, tuple(sorted(labels.items())), value))
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+
+        order = {name: position for position, name in enumerate(METRICS)}
+        lines = []
+        for name in sorted(samples, key=lambda name: (order.get(name, len(order)), name)):
+            kind, description = METRICS.get(name, ('untyped', ''))
+            if description:
+                lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample, labels, value in samples[name]:
+                text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+                lines.append(f'{sample}{{{text}}} {_number(value)}' if text else f'{sample} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _number(value) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """
+    Get the process-wide metrics, enabled unless METRICS_ENABLED is 0.
+    Returns: Metrics: The shared metrics
+
+    """
+    global _metrics
+    if _metrics is None:
+        with _metrics_lock:
+            if _metrics is None:
+                _metrics = Metrics(enabled=os.environ.get('METRICS_ENABLED', '1') == '1')
+    return _metrics
+
+
+def span(stage: str):
+    """
+    Time a stage with the process-wide metrics: `with span('extract.parse'): ...`
+    """
+    return get_metrics().span(stage)
@@ -1,51 +1,31 @@
-from playwright.sync_api import sync_playwright
+from browser_pool import get_pool
+from render_profile import get_profile
 import json
 
 def test_proxy_connection():
-    with sync_playwright() as playwright:
-        try:
-            browser = playwright.chromium.launch(
-                proxy={
-                    "server": "socks5://127.0.0.1:8899"
-                },
-                headless=False
-            )
-            context = browser.new_context(ignore_https_errors=True)
-            page = context.new_page()
-
+    try:
+        def read_ip(page):
             # Test the proxy connection with a simple request
             page.goto("https://api.ipify.org?format=json", timeout=30000)
-            ip_info = page.evaluate("() => document.body.textContent")
-            print(f"Proxy IP: {ip_info}")
-
-            browser.close()
-            return True
-        except Exception as e:
-            print(f"Proxy connection error: {e}")
-            return False
+            return page.evaluate("() => document.body.textContent")
+        ip_info = get_pool().run(read_ip)
+        print(f"Proxy IP: {ip_info}")
+        return True
+    except Exception as e:
+        print(f"Proxy connection error: {e}")
+        return False
 
 def test_method():
     if not test_proxy_connection():
         return "Proxy connection failed"
 
-    with sync_playwright() as playwright:
-        try:
-            browser = playwright.chromium.launch(
-                proxy={
-                    "server": "socks5://127.0.0.1:8899"
-                },
-                headless=False
-            )
-            context = browser.new_context(ignore_https_errors=True)
-            page = context.new_page()
-            page.goto("https://mytek.tn/", timeout=30000)
-            content = page.content()
-            browser.close()
-            return content
-        except Exception as e:
-            print(f"Error: {e}")
-            return str(e)
+    try:
+        url = "https://mytek.tn/"
+        return get_pool().fetch_html(url, timeout=30000, profile=get_profile(url))
+    except Exception as e:
+        print(f"Error: {e}")
+        return str(e)
 
 if __name__ == "__main__":
     result = test_method()
-    print(result)
\ No newline at end of file
+    print(result)
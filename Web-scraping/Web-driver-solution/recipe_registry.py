@@ -0,0 +1,292 @@
+"""
+Per-domain extraction recipes: the price, title, description and stock elements of a shop, saved once
+(typically from the /api/extract-patterns output) instead of being sent as params with every request.
+Each recipe is compiled into lxml XPath expressions when it is loaded, so extracting a page is one lxml parse
+and a few XPath evaluations, without the DOM heuristics.
+The recipes are stored in SQLite and reloaded when another connection (another worker, a script) changes them.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import lxml.html
+from lxml import etree
+
+from fetch_strategy import domain_of
+
+FIELDS = ('price', 'title', 'description', 'stock', 'currency')
+
+_NAME = re.compile(r'^[A-Za-z_][\w:.-]*$') # The tag and attribute names accepted in a recipe
+
+# The text BeautifulSoup's get_text returns: the strings of the element, without scripts, styles and templates
+_TEXT = etree.XPath('.//text()[not(ancestor::script or ancestor::style or ancestor::template)]')
+_RAW_TEXT_TAGS = {'script', 'style', 'template'}
+
+# Used when a recipe has no title or currency element
+_DEFAULT_TITLES = [etree.XPath(path) for path in ('(//meta[@property="og:title"][@content])[1]',
+                                                  '(//meta[@property="twitter:title"][@content])[1]',
+                                                  '(//meta[@name="title"][@content])[1]', '(//h1)[1]')]
+_DEFAULT_CURRENCY = etree.XPath('(//meta[@property="product:price:currency"])[1]')
+
+# The ancestors ignored by the DOM heuristics (DOMExtractor.pruned_tags) when choosing a bare price element
+_PRUNED_ANCESTOR = ' or '.join(f'ancestor-or-self::{tag}' for tag in (
+    'script', 'style', 'noscript', 'iframe', 'head', 'footer', 'nav', 'del', 'header', 'a', 'ol', 'ul', 'li'))
+
+# huge_tree lifts libxml2's 256 levels nesting limit, as the BeautifulSoup lxml builder does
+_PARSER = lxml.html.HTMLParser(huge_tree=True)
+
+
+def _xpath_literal(value: str) -> str:
+    """
+    Quote a string for an XPath expression.
+    """
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    parts = value.split('"')
+    return 'concat(' + ', \'"\', '.join(f'"{part}"' for part in parts) + ')'
+
+
+def param_xpath(tag: str, attributes: dict) -> str:
+    """
+    Build the XPath of the first element a param (tag and attributes, as used by soup.find) describes.
+    As with BeautifulSoup, a list of values matches any of them and a class value matches one of the classes
+    of the element (or all of them when it contains spaces).
+    Args:
+        tag: The tag name
+        attributes: The attributes
+
+    Returns: str: The XPath expression
+
+    """
+    if not _NAME.match(tag) or not all(_NAME.match(name) for name in attributes or {}):
+        raise ValueError(f'Invalid tag or attribute name in {tag} {attributes}')
+    conditions = []
+    for name, value in (attributes or {}).items():
+        values = value if isinstance(value, list) else [value]
+        alternatives = []
+        for item in values:
+            if item is True:
+                alternatives.append(f'@{name}')
+            elif name == 'class' and ' ' not in str(item):
+                alternatives.append(f'contains(concat(" ", normalize-space(@class), " "), {_xpath_literal(f" {item} ")})')
+            elif name == 'class':
+                alternatives.append(f'normalize-space(@class) = {_xpath_literal(" ".join(str(item).split()))}')
+            else:
+                alternatives.append(f'@{name} = {_xpath_literal(str(item))}')
+        conditions.append('[' + ' or '.join(alternatives) + ']')
+    return f'(//{tag}{"".join(conditions)})[1]'
+
+
+def element_text(element) -> str:
+    """
+    Get the text of an element the way BeautifulSoup's get_text does.
+    Args:
+        element: The lxml element
+
+    Returns: str: The text of the element
+
+    """
+    if element.tag in _RAW_TEXT_TAGS:
+        return element.text or ''
+    return ''.join(_TEXT(element))
+
+
+class Recipe:
+    """
+    The compiled extraction recipe of a domain.
+    """
+    def __init__(self, domain: str, elements: dict, updated: float = 0.0):
+        """
+        Args:
+            domain: The domain (without www.) the recipe applies to
+            elements: Field ('price', 'title', 'description', 'stock', 'currency') -> {'tag': ..., 'attributes': {...}}
+            updated: The time the recipe was saved
+        """
+        self.domain = domain
+        self.elements = {field: element for field, element in elements.items() if element}
+        self.updated = updated
+        # Compile the XPath expressions once, when the recipe is loaded
+        self.xpaths = {field: etree.XPath(param_xpath(element['tag'], element.get('attributes') or {}))
+                       for field, element in self.elements.items()}
+        self.bare_xpaths = {field: etree.XPath(f"//{element['tag']}[not(@*)][not({_PRUNED_ANCESTOR})]")
+                            for field, element in self.elements.items() if not element.get('attributes')}
+
+    def extract(self, html_content: str, price_regex=None) -> dict:
+        """
+        Extract the fields of the recipe from a page.
+        Args:
+            html_content: The HTML content of the page
+            price_regex: The compiled price pattern used to choose among attribute-less price elements
+
+        Returns: dict: Field -> value, None for the fields whose element is missing
+
+        """
+        document = lxml.html.document_fromstring(html_content, parser=_PARSER)
+        matches = {field: next(iter(xpath(document)), None) for field, xpath in self.xpaths.items()}
+        if 'price' in self.bare_xpaths and price_regex is not None:
+            # An attribute-less price element is ambiguous: keep the last one whose text is a price
+            matches['price'] = None
+            for element in self.bare_xpaths['price'](document):
+                if price_regex.match(element_text(element)):
+                    matches['price'] = element
+        values = {}
+
+        price = matches.get('price')
+        if price is not None:
+            currency = matches['currency'] if 'currency' in matches else next(iter(_DEFAULT_CURRENCY(document)), None)
+            if price.get('content') is not None and currency is not None:
+                # Format the price as the param-driven extraction does
+                values['price'] = f"{float(price.get('content')):,.3f}".replace(",", " ").replace(".", ",") + \
+                    " " + str(currency.get('content'))
+            else:
+                values['price'] = element_text(price).strip()
+        elif 'price' in self.xpaths:
+            values['price'] = None
+
+        if 'title' in self.xpaths:
+            title = matches['title']
+        else:
+            title = next((found[0] for found in (xpath(document) for xpath in _DEFAULT_TITLES) if found), None)
+        if title is None:
+            values['title'] = '' if 'title' not in self.xpaths else None
+        elif title.get('content') is not None:
+            values['title'] = title.get('content')
+        else:
+            values['title'] = element_text(title).strip()
+
+        for field in ('description', 'stock'):
+            element = matches.get(field)
+            if element is not None:
+                content = element.get('content')
+                values[field] = content if content is not None else element_text(element)
+            elif field in self.xpaths:
+                values[field] = None
+        return values
+
+    def to_dict(self) -> dict:
+        return {'domain': self.domain, 'updated': self.updated, **self.elements}
+
+
+class RecipeRegistry:
+    """
+    The recipes of all the domains, stored in SQLite and kept compiled in memory.
+    """
+    def __init__(self, path: str = 'recipes.db'):
+        """
+        Args:
+            path: The SQLite database storing the recipes
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS recipes '
+                                 '(domain TEXT PRIMARY KEY, elements TEXT NOT NULL, updated REAL NOT NULL)')
+        self._connection.commit()
+        self._recipes = {}
+        self._data_version = None
+        self.reloads = 0
+        self.reload()
+
+    def reload(self):
+        """
+        Load and compile all the recipes from the database.
+        """
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        recipes = {}
+        for domain, elements, updated in self._connection.execute('SELECT domain, elements, updated FROM recipes'):
+            try:
+                recipes[domain] = Recipe(domain, json.loads(elements), updated)
+            except (ValueError, KeyError, TypeError, etree.XPathSyntaxError) as e:
+                print(f"Error compiling the recipe of {domain}: {e}")
+        self._recipes = recipes
+        self._data_version = self._connection.execute('PRAGMA data_version').fetchone()[0]
+        self.reloads += 1
+
+    def for_url(self, url: str) -> Optional[Recipe]:
+        """
+        Get the recipe of the domain of a URL, reloading the recipes if another connection changed them.
+        Args:
+            url: The URL of a page
+
+        Returns: Recipe: The compiled recipe, or None if the domain has none
+
+        """
+        with self._lock:
+            # data_version changes when another connection commits: the hot reload costs one pragma per lookup
+            if self._connection.execute('PRAGMA data_version').fetchone()[0] != self._data_version:
+                self._load()
+            return self._recipes.get(domain_of(url))
+
+    def save(self, url: str, elements: dict) -> Recipe:
+        """
+        Save (or replace) the recipe of the domain of a URL.
+        Args:
+            url: A URL (or the domain) of the shop
+            elements: Field -> {'tag': ..., 'attributes': {...}}, as listed by /api/extract-patterns
+
+        Returns: Recipe: The compiled recipe
+
+        """
+        domain = domain_of(url if '//' in url else f'//{url}')
+        elements = {field: {'tag': element['tag'], 'attributes': element.get('attributes') or {}}
+                    for field, element in elements.items() if element and field in FIELDS}
+        if 'price' not in elements:
+            raise ValueError('A recipe needs a price element')
+        try:
+            recipe = Recipe(domain, elements, time.time()) # Compile before saving, so a broken recipe isn't stored
+        except etree.XPathSyntaxError as e:
+            raise ValueError(f'Invalid recipe: {e}')
+        with self._lock:
+            self._connection.execute('INSERT OR REPLACE INTO recipes (domain, elements, updated) VALUES (?, ?, ?)',
+                                     (domain, json.dumps(elements), recipe.updated))
+            self._connection.commit()
+            self._recipes[domain] = recipe
+        return recipe
+
+    def delete(self, domain: str) -> bool:
+        """
+        Delete the recipe of a domain.
+        Returns: bool: True if the domain had a recipe
+
+        """
+        domain = domain_of(domain if '//' in domain else f'//{domain}')
+        with self._lock:
+            deleted = self._connection.execute('DELETE FROM recipes WHERE domain = ?', (domain,)).rowcount
+            self._connection.commit()
+            self._recipes.pop(domain, None)
+        return bool(deleted)
+
+    def snapshot(self) -> list:
+        """
+        Get all the recipes.
+        Returns: list: The recipes as dictionaries
+
+        """
+        with self._lock:
+            return [recipe.to_dict() for recipe in self._recipes.values()]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_recipes() -> RecipeRegistry:
+    """
+    Get the process-wide recipe registry (RECIPES_DB, default recipes.db).
+    Returns: RecipeRegistry: The shared registry
+
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = RecipeRegistry(os.environ.get('RECIPES_DB', 'recipes.db'))
+        return _registry
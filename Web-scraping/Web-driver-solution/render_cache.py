@@ -0,0 +1,230 @@
+"""
+A cache of rendered pages, shared by extract_pattern and DOMExtractor.extract_values so the usual
+/api/extract-patterns then /api/extract-price flow renders a page only once.
+Pages are kept in memory (LRU bounded by size) and optionally in a compressed on-disk tier.
+The pages fetched over plain HTTP are cached apart from the browser renderings (kind='http'), so they are never
+served as a rendering.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+RENDERED, HTTP = 'rendered', 'http' # The kinds of cached pages: browser renderings and plain HTTP fetches
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalize a URL so the different spellings of a page share the same cache entry.
+    The scheme and host are lower-cased, the default port, the fragment and the utm_* parameters are
+    dropped and the query parameters are sorted.
+    Args:
+        url: The URL
+
+    Returns: str: The normalized URL
+
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if not k.lower().startswith('utm_'))
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+def cache_key(url: str, kind: str = RENDERED) -> str:
+    # The renderings are keyed by their normalized URL, the other kinds of pages by the kind and the URL
+    key = normalize_url(url)
+    return key if kind == RENDERED else f'{kind} {key}'
+
+
+class RenderCache:
+    """
+    Rendered HTML keyed by normalized URL, with a TTL and an LRU eviction bounded by the total size.
+    """
+    def __init__(self, ttl: float = 600, max_bytes: int = 256 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_entries: int = 10000):
+        """
+        Args:
+            ttl: The default maximum age (in seconds) of a cached page
+            max_bytes: The maximum size of the pages kept in memory
+            disk_dir: The directory of the compressed on-disk tier, None to keep the pages in memory only
+            disk_max_entries: The maximum number of pages kept on disk
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict() # Normalized URL -> (render time, HTML content), least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._disk_writes = 0
+        self.counters = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.html.gz')
+
+    def get(self, url: str, max_age: Optional[float] = None, kind: str = RENDERED) -> Optional[str]:
+        """
+        Get a cached page if it is recent enough.
+        Args:
+            url: The URL of the page
+            max_age: The maximum age (in seconds) accepted for this request, defaults to the TTL
+            kind: RENDERED for a browser rendering, HTTP for a page fetched without a browser
+
+        Returns: str: The HTML content, or None on a miss
+
+        """
+        key = cache_key(url, kind)
+        max_age = self.ttl if max_age is None else max_age
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] <= max_age:
+                self._entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return entry[1]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                rendered_at = os.path.getmtime(path)
+                if now - rendered_at <= max_age:
+                    with gzip.open(path, 'rt', encoding='utf-8') as f:
+                        html_content = f.read()
+                    self._remember(key, rendered_at, html_content)
+                    with self._lock:
+                        self.counters['disk_hits'] += 1
+                    return html_content
+            except OSError:
+                pass
+        with self._lock:
+            self.counters['misses'] += 1
+        return None
+
+    def put(self, url: str, html_content: str, kind: str = RENDERED):
+        """
+        Cache a rendered page.
+        Args:
+            url: The URL of the page
+            html_content: The HTML content
+            kind: RENDERED for a browser rendering, HTTP for a page fetched without a browser
+
+        """
+        key = cache_key(url, kind)
+        rendered_at = time.time()
+        self._remember(key, rendered_at, html_content)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            temporary = None
+            try:
+                # A temporary file of its own, so concurrent puts of the same page never write to the same file
+                descriptor, temporary = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+                with os.fdopen(descriptor, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8', compresslevel=6) as f:
+                    f.write(html_content)
+                os.utime(temporary, (rendered_at, rendered_at)) # The modification time is the render time
+                os.replace(temporary, path)
+            except OSError as e:
+                print(f"Error writing the render cache: {e}")
+                if temporary is not None and os.path.exists(temporary):
+                    os.remove(temporary)
+            with self._lock:
+                self._disk_writes += 1
+                prune = self._disk_writes % 100 == 0
+            if prune:
+                self._prune_disk()
+
+    def fetch(self, url: str, render: Callable[[], str], max_age: Optional[float] = None) -> str:
+        """
+        Get a page from the cache, rendering and caching it on a miss.
+        Args:
+            url: The URL of the page
+            render: The function rendering the page
+            max_age: The maximum age (in seconds) accepted for this request, 0 to always render
+
+        Returns: str: The HTML content
+
+        """
+        html_content = self.get(url, max_age)
+        if html_content is None:
+            html_content = render()
+            self.put(url, html_content)
+        return html_content
+
+    def _remember(self, key: str, rendered_at: float, html_content: str):
+        """
+        Add a page to the memory tier, evicting the least recently used pages beyond max_bytes.
+        """
+        size = len(html_content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[1])
+            self._entries[key] = (rendered_at, html_content)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                self.counters['evictions'] += 1
+
+    def _prune_disk(self):
+        """
+        Remove the expired pages and the oldest pages beyond disk_max_entries from the disk tier, and the
+        temporary files left by an interrupted write.
+        """
+        try:
+            entries = list(os.scandir(self.disk_dir))
+            now = time.time()
+            for entry in entries:
+                if entry.name.endswith('.tmp') and now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            files = [entry for entry in entries if entry.name.endswith('.html.gz')]
+            files.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+            for position, entry in enumerate(files):
+                if position >= self.disk_max_entries or now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+        except OSError as e:
+            print(f"Error pruning the render cache: {e}")
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters.
+        Returns: dict: The hits, misses, evictions and the memory tier size
+
+        """
+        with self._lock:
+            lookups = self.counters['hits'] + self.counters['disk_hits'] + self.counters['misses']
+            return dict(self.counters, entries=len(self._entries), bytes=self._size,
+                        hit_rate=round((lookups - self.counters['misses']) / lookups, 3) if lookups else 0.0)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """
+    Get the process-wide render cache, creating it from the environment on first use.
+    Returns: RenderCache: The shared cache
+
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache(
+                ttl=float(os.environ.get('RENDER_CACHE_TTL', 600)),
+                max_bytes=int(os.environ.get('RENDER_CACHE_MAX_MB', 256)) * 1024 * 1024,
+                disk_dir=os.environ.get('RENDER_CACHE_DIR') or None,
+            )
+        return _cache
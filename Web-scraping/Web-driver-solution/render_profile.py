@@ -0,0 +1,280 @@
+"""
+Render profiles: which requests a page may make and how long to wait for it once navigated.
+Instead of downloading every image, font and tracker through the proxy and sleeping 2 seconds after
+each navigation, a profile blocks the useless requests and waits until the price is on the page or the
+network is idle, with a hard cap. The defaults can be overridden per domain in a JSON file.
+"""
+import json
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from fetch_strategy import domain_of
+from metrics import get_metrics, span
+
+# Resource types a price extraction never needs
+DEFAULT_BLOCKED_RESOURCE_TYPES = ['image', 'media', 'font']
+
+# Analytics, ads and tag managers (a request is blocked when its host is one of these or a subdomain)
+DEFAULT_BLOCKED_HOSTS = [
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+    'googleadservices.com', 'facebook.net', 'connect.facebook.net', 'hotjar.com', 'clarity.ms',
+    'tiktok.com', 'analytics.tiktok.com', 'snap.licdn.com', 'bat.bing.com', 'criteo.com', 'criteo.net',
+    'taboola.com', 'outbrain.com', 'yandex.ru', 'mc.yandex.ru', 'newrelic.com', 'nr-data.net',
+]
+
+# Checks whether the page is ready: the price selector is present, or a price-like text is visible
+_READY_JS = r"""
+(selector) => {
+    if (selector) {
+        try { return document.querySelector(selector) !== null; } catch (e) { return false; }
+    }
+    const text = document.body ? document.body.innerText : '';
+    return /\d{1,3}(?:[.,\s]\d{3})*(?:[.,]\d{2,3})?\s*(?:DT|TND|D\.T|[$€£])|[$€£]\s*\d/.test(text);
+}
+"""
+
+
+def param_selector(tag: str, attributes: dict) -> str:
+    """
+    Build the CSS selector of the elements a param (tag and attributes, as used by soup.find) describes.
+    A list of values matches any of them, as with BeautifulSoup.
+    Args:
+        tag: The tag name
+        attributes: The attributes
+
+    Returns: str: The CSS selector
+
+    """
+    selectors = [tag]
+    for name, value in (attributes or {}).items():
+        values = value if isinstance(value, list) else [value]
+        alternatives = []
+        for selector in selectors:
+            for item in values:
+                if item is True:
+                    alternatives.append(f'{selector}[{name}]')
+                else:
+                    operator = '~=' if name == 'class' and ' ' not in str(item) else '='
+                    escaped = str(item).replace('\\', '\\\\').replace('"', '\\"')
+                    alternatives.append(f'{selector}[{name}{operator}"{escaped}"]')
+        selectors = alternatives
+    return ', '.join(selectors)
+
+
+class RenderProfile:
+    """
+    How a page is rendered: blocked requests and readiness wait.
+    """
+    def __init__(self, blocked_resource_types: list = None, blocked_hosts: list = None,
+                 wait_for_price: bool = True, network_idle_ms: int = 500, max_wait: int = 5000,
+                 poll_interval: int = 100):
+        """
+        Args:
+            blocked_resource_types: Playwright resource types aborted (image, media, font, stylesheet...)
+            blocked_hosts: Hosts whose requests are aborted, with their subdomains
+            wait_for_price: Wait for the price selector (or a price-like text) to appear
+            network_idle_ms: The time without network activity after which the page is considered loaded
+            max_wait: The hard cap (in milliseconds) of the wait after the navigation
+            poll_interval: The interval (in milliseconds) between two readiness checks
+        """
+        self.blocked_resource_types = set(DEFAULT_BLOCKED_RESOURCE_TYPES if blocked_resource_types is None
+                                          else blocked_resource_types)
+        self.blocked_hosts = set(DEFAULT_BLOCKED_HOSTS if blocked_hosts is None else blocked_hosts)
+        self.wait_for_price = wait_for_price
+        self.network_idle_ms = network_idle_ms
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+    def is_blocked(self, resource_type: str, url: str) -> bool:
+        """
+        Check whether a request is blocked by the profile.
+        """
+        if resource_type in self.blocked_resource_types:
+            return True
+        host = (urlparse(url).hostname or '').lower()
+        while host:
+            if host in self.blocked_hosts:
+                return True
+            host = host.partition('.')[2]
+        return False
+
+    def apply(self, page) -> dict:
+        """
+        Install the request blocking and the network activity tracking on a page, before the navigation.
+        Args:
+            page: The Playwright page
+
+        Returns: dict: The network activity counters updated while the page loads
+
+        """
+        activity = {'in_flight': 0, 'last_change': time.monotonic(), 'blocked': 0}
+
+        def route(route):
+            request = route.request
+            if self.is_blocked(request.resource_type, request.url):
+                activity['blocked'] += 1
+                route.abort()
+            else:
+                route.continue_()
+
+        def started(_):
+            activity['in_flight'] += 1
+            activity['last_change'] = time.monotonic()
+
+        def finished(_):
+            activity['in_flight'] = max(activity['in_flight'] - 1, 0)
+            activity['last_change'] = time.monotonic()
+
+        if self.blocked_resource_types or self.blocked_hosts:
+            page.route('**/*', route)
+        page.on('request', started)
+        page.on('requestfinished', finished)
+        page.on('requestfailed', finished)
+        return activity
+
+    def wait(self, page, activity: dict, ready_selector: Optional[str] = None) -> str:
+        """
+        Wait until the page is ready, after the navigation.
+        Args:
+            page: The Playwright page
+            activity: The counters returned by apply
+            ready_selector: The CSS selector of the price, None to look for a price-like text
+
+        Returns: str: Why the wait ended ('price', 'network-idle' or 'timeout')
+
+        """
+        deadline = time.monotonic() + self.max_wait / 1000
+        while True:
+            if self.wait_for_price and page.evaluate(_READY_JS, ready_selector):
+                return 'price'
+            now = time.monotonic()
+            if activity['in_flight'] == 0 and (now - activity['last_change']) * 1000 >= self.network_idle_ms:
+                return 'network-idle'
+            if now >= deadline:
+                return 'timeout'
+            page.wait_for_timeout(self.poll_interval) # Lets Playwright dispatch the network events
+
+    def render(self, page, url: str, timeout: int = 30000, ready_selector: Optional[str] = None) -> str:
+        """
+        Navigate to a page with this profile and return its HTML content.
+        Args:
+            page: The Playwright page
+            url: The URL of the page
+            timeout: The navigation timeout in milliseconds
+            ready_selector: The CSS selector of the price, None to look for a price-like text
+
+        Returns: str: The HTML content of the page
+
+        """
+        activity = self.apply(page)
+        with span('browser.goto'):
+            page.goto(url, timeout=timeout, wait_until='domcontentloaded')
+        with span('browser.wait'):
+            reason = self.wait(page, activity, ready_selector)
+        get_metrics().inc('scraper_render_waits_total', (('reason', reason),))
+        with span('browser.content'):
+            return page.content()
+
+
+PROFILE_KEYS = ('blocked_resource_types', 'blocked_hosts', 'wait_for_price', 'network_idle_ms', 'max_wait',
+                'poll_interval') # The arguments of RenderProfile, the keys of the profiles file
+
+
+def _valid_settings(name: str, settings) -> dict:
+    """
+    Check an entry of the profiles file, reporting and dropping what RenderProfile doesn't accept.
+    Args:
+        name: The entry ('default' or a domain), for the report
+        settings: Its settings
+
+    Returns: dict: The known settings of the entry
+
+    """
+    if not isinstance(settings, dict):
+        print(f"Render profile {name}: expected an object, got {type(settings).__name__}, ignored")
+        return {}
+    unknown = sorted(set(settings) - set(PROFILE_KEYS))
+    if unknown:
+        print(f"Render profile {name}: unknown keys {', '.join(unknown)} ignored (expected {', '.join(PROFILE_KEYS)})")
+    return {key: value for key, value in settings.items() if key in PROFILE_KEYS}
+
+
+class RenderProfiles:
+    """
+    The default profile and the per-domain overrides, loaded from a JSON file:
+        {"default": {"max_wait": 5000}, "domains": {"mytek.tn": {"blocked_resource_types": ["image", "font"]}}}
+    The file is reloaded when it changes.
+    """
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._settings = {'default': {}, 'domains': {}}
+        self._profiles = {}
+
+    def _reload(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as f:
+                settings = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading the render profiles: {e}")
+            return
+        domains = settings.get('domains', {}) if isinstance(settings, dict) else {}
+        if not isinstance(domains, dict):
+            print("Render profiles: 'domains' must be an object, ignored")
+            domains = {}
+        self._settings = {
+            'default': _valid_settings('default', settings.get('default', {}) if isinstance(settings, dict) else {}),
+            'domains': {domain: _valid_settings(domain, values) for domain, values in domains.items()},
+        }
+        self._profiles = {}
+        self._mtime = mtime
+
+    def for_url(self, url: str) -> RenderProfile:
+        """
+        Get the profile of a URL: the default settings with the overrides of its domain.
+        Args:
+            url: The URL of the page
+
+        Returns: RenderProfile: The profile
+
+        """
+        domain = domain_of(url)
+        with self._lock:
+            self._reload()
+            key = domain if domain in self._settings['domains'] else None
+            if key not in self._profiles:
+                settings = dict(self._settings['default'], **self._settings['domains'].get(key, {}))
+                self._profiles[key] = RenderProfile(**settings)
+            return self._profiles[key]
+
+
+_profiles = None
+_profiles_lock = threading.Lock()
+
+
+def get_profile(url: str) -> RenderProfile:
+    """
+    Get the render profile of a URL from the process-wide profiles (RENDER_PROFILES_FILE).
+    Args:
+        url: The URL of the page
+
+    Returns: RenderProfile: The profile
+
+    """
+    global _profiles
+    with _profiles_lock:
+        if _profiles is None:
+            _profiles = RenderProfiles(os.environ.get('RENDER_PROFILES_FILE', 'render_profiles.json'))
+    return _profiles.for_url(url)
@@ -0,0 +1,331 @@
+"""
+A persistent approximate nearest neighbour index (IVF, inverted file) of the catalogue embeddings of a target,
+built with NumPy only.
+The vectors are grouped around k-means centroids; a query only scores the vectors of its nprobe closest groups,
+so matching the price history never materializes the full products x history similarity matrix.
+Small catalogues are searched exactly. The index is updated in place when products are added, changed or
+removed, and retrained only when it has grown well beyond the size it was trained on.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale vectors to unit length so the inner product is the cosine similarity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _merge_top_k(scores: np.ndarray, ids: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the k best columns of each row, sorted by decreasing score.
+    """
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, keep, axis=1)
+        ids = np.take_along_axis(ids, keep, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class VectorIndex:
+    """
+    An IVF index of unit vectors keyed by integer ids (the product ids).
+    """
+    def __init__(self, dim: int, nprobe: int = 8, min_train_size: int = 2048, model: str = ''):
+        """
+        Args:
+            dim: The dimension of the vectors
+            nprobe: The number of groups scored per query (more is slower and more accurate)
+            min_train_size: The number of vectors below which the index is searched exactly
+            model: The name of the model the vectors come from, an index of another model is rebuilt
+        """
+        self.dim = dim
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.model = model
+        self.ids = np.empty(0, dtype=np.int64)
+        self.hashes = np.empty(0, dtype=np.uint64) # Content hash of the text each vector was computed from
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.centroids = None # None while the index is searched exactly
+        self.assignments = np.empty(0, dtype=np.int32) # Group of each vector
+        self.trained_size = 0
+        self._lists = None # (vector positions sorted by group, group offsets), rebuilt after a change
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def train(self, iterations: int = 10, seed: int = 0):
+        """
+        Compute the group centroids with k-means on (a sample of) the vectors and reassign all the vectors.
+        Args:
+            iterations: The number of k-means iterations
+            seed: The seed of the initialization and of the sample
+
+        """
+        with self._lock:
+            if len(self.ids) < self.min_train_size:
+                self.centroids = None
+                self.assignments = np.zeros(len(self.ids), dtype=np.int32)
+                self._lists = None
+                return
+            rng = np.random.default_rng(seed)
+            nlist = int(min(max(np.sqrt(len(self.ids)), 1), 4096))
+            sample_size = min(len(self.ids), nlist * 64)
+            sample = self.vectors[rng.choice(len(self.ids), sample_size, replace=False)]
+            centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+            for _ in range(iterations):
+                assignments = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, sample)
+                counts = np.bincount(assignments, minlength=nlist)
+                empty = counts == 0
+                sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))] # Restart the empty groups
+                centroids = _normalize(sums)
+            self.centroids = centroids
+            self.assignments = self._assign(self.vectors)
+            self.trained_size = len(self.ids)
+            self._lists = None
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(vectors), dtype=np.int32)
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), 8192):
+            assignments[start:start + 8192] = np.argmax(vectors[start:start + 8192] @ self.centroids.T, axis=1)
+        return assignments
+
+    def upsert(self, ids, vectors, hashes=None) -> tuple[int, int]:
+        """
+        Add new vectors and replace the vectors of known ids.
+        Args:
+            ids: The ids
+            vectors: The vectors (normalized by the index)
+            hashes: The content hashes of the texts of the vectors (see stale), 0 when unknown
+
+        Returns: tuple: The number of added and updated vectors
+
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = _normalize(vectors)
+        hashes = np.zeros(len(ids), dtype=np.uint64) if hashes is None else np.asarray(hashes, dtype=np.uint64)
+        with self._lock:
+            positions = self._positions(ids)
+            known = positions >= 0
+            changed = known.copy()
+            changed[known] = np.any(self.vectors[positions[known]] != vectors[known], axis=1)
+            self.hashes[positions[known]] = hashes[known]
+            if changed.any():
+                self.vectors[positions[changed]] = vectors[changed]
+                self.assignments[positions[changed]] = self._assign(vectors[changed])
+            new = ~known
+            if new.any():
+                self.ids = np.concatenate([self.ids, ids[new]])
+                self.hashes = np.concatenate([self.hashes, hashes[new]])
+                self.vectors = np.concatenate([self.vectors, vectors[new]])
+                self.assignments = np.concatenate([self.assignments, self._assign(vectors[new])])
+            if changed.any() or new.any():
+                self._lists = None
+            if (self.centroids is None and len(self.ids) >= self.min_train_size) or \
+                    (self.centroids is not None and len(self.ids) > 4 * self.trained_size):
+                self.train() # The groups no longer fit the data
+            return int(new.sum()), int(changed.sum())
+
+    def remove(self, ids) -> int:
+        """
+        Remove vectors.
+        Args:
+            ids: The ids to remove
+
+        Returns: int: The number of removed vectors
+
+        """
+        with self._lock:
+            keep = ~np.isin(self.ids, np.asarray(ids, dtype=np.int64))
+            removed = int(len(keep) - keep.sum())
+            if removed:
+                self.ids, self.vectors, self.assignments = self.ids[keep], self.vectors[keep], self.assignments[keep]
+                self.hashes = self.hashes[keep]
+                self._lists = None
+            return removed
+
+    def sync(self, ids, vectors, hashes=None) -> dict:
+        """
+        Make the index contain exactly these vectors (the current catalogue), changing only what differs.
+        Args:
+            ids: The ids of the catalogue
+            vectors: Their vectors
+            hashes: The content hashes of their texts
+
+        Returns: dict: The number of added, updated and removed vectors
+
+        """
+        with self._lock:
+            removed = self.remove(np.setdiff1d(self.ids, np.asarray(ids, dtype=np.int64)))
+            added, updated = self.upsert(ids, vectors, hashes)
+            return {'added': added, 'updated': updated, 'removed': removed}
+
+    def stale(self, ids, hashes) -> np.ndarray:
+        """
+        Find the ids whose vector must be computed: unknown ids, and ids whose text changed since their vector
+        was computed.
+        Args:
+            ids: The ids of the catalogue
+            hashes: The content hashes of their current texts (see content_hashes)
+
+        Returns: np.ndarray: A boolean mask of the ids to encode
+
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        with self._lock:
+            positions = self._positions(ids)
+            stale = positions < 0
+            stale[~stale] = self.hashes[positions[~stale]] != np.asarray(hashes, dtype=np.uint64)[~stale]
+            return stale
+
+    def vectors_of(self, ids) -> np.ndarray:
+        """
+        Get the stored vectors of known ids.
+        """
+        with self._lock:
+            positions = self._positions(np.asarray(ids, dtype=np.int64))
+            if (positions < 0).any():
+                raise KeyError('Unknown ids')
+            return self.vectors[positions]
+
+    def _positions(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Find the positions of ids in the index, -1 for the unknown ids.
+        """
+        if not len(self.ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        order = np.argsort(self.ids, kind='stable')
+        found = np.searchsorted(self.ids, ids, sorter=order)
+        found = np.minimum(found, len(order) - 1)
+        positions = order[found]
+        return np.where(self.ids[positions] == ids, positions, -1)
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        if self._lists is None:
+            nlist = 1 if self.centroids is None else len(self.centroids)
+            order = np.argsort(self.assignments, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=nlist))])
+            self._lists = (order, offsets)
+        return self._lists
+
+    def search(self, queries, k: int = 10, batch_size: int = 1024) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar vectors of each query.
+        Args:
+            queries: The query vectors (normalized by the index)
+            k: The number of neighbours
+            batch_size: The number of queries scored together (bounds the memory use)
+
+        Returns: tuple: The cosine similarities and the ids, both (queries x k) sorted by decreasing similarity,
+        padded with -inf and -1 when the index has fewer than k vectors
+
+        """
+        queries = _normalize(queries)
+        with self._lock:
+            order, offsets = self._inverted_lists()
+            scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+            ids = np.full((len(queries), k), -1, dtype=np.int64)
+            for start in range(0, len(queries), batch_size):
+                batch = queries[start:start + batch_size]
+                best_scores = np.full((len(batch), k), -np.inf, dtype=np.float32)
+                best_ids = np.full((len(batch), k), -1, dtype=np.int64)
+                if self.centroids is None:
+                    probes = np.zeros((len(batch), 1), dtype=np.int64)
+                else:
+                    nprobe = min(self.nprobe, len(self.centroids))
+                    probes = np.argpartition(-(batch @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+                for group in np.unique(probes):
+                    members = order[offsets[group]:offsets[group + 1]]
+                    if not len(members):
+                        continue
+                    rows = np.flatnonzero((probes == group).any(axis=1))
+                    group_scores = batch[rows] @ self.vectors[members].T
+                    group_ids = np.broadcast_to(self.ids[members], group_scores.shape)
+                    best_scores[rows], best_ids[rows] = _merge_top_k(
+                        np.concatenate([best_scores[rows], group_scores], axis=1),
+                        np.concatenate([best_ids[rows], group_ids], axis=1), k)
+                scores[start:start + batch_size], ids[start:start + batch_size] = best_scores, best_ids
+            return scores, ids
+
+    def save(self, path: str):
+        """
+        Save the index to a .npz file (written atomically, through a temporary file of its own so concurrent
+        saves of the same target never share one).
+        """
+        with self._lock:
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+            try:
+                with os.fdopen(descriptor, 'wb') as f:
+                    np.savez(f, ids=self.ids, hashes=self.hashes, vectors=self.vectors, assignments=self.assignments,
+                             centroids=self.centroids if self.centroids is not None else np.empty((0, self.dim)),
+                             meta=np.array([self.dim, self.nprobe, self.min_train_size, self.trained_size]),
+                             model=np.array(self.model))
+                os.replace(temporary, path)
+            except BaseException:
+                os.remove(temporary)
+                raise
+
+    @classmethod
+    def load(cls, path: str) -> 'VectorIndex':
+        """
+        Load an index saved with save.
+        """
+        with np.load(path) as data:
+            dim, nprobe, min_train_size, trained_size = (int(value) for value in data['meta'])
+            index = cls(dim, nprobe, min_train_size, str(data['model']))
+            index.ids, index.vectors, index.assignments = data['ids'], data['vectors'], data['assignments']
+            index.hashes = data['hashes'] if 'hashes' in data else np.zeros(len(index.ids), dtype=np.uint64)
+            index.centroids = data['centroids'] if len(data['centroids']) else None
+            index.trained_size = trained_size
+        return index
+
+
+def content_hashes(texts) -> np.ndarray:
+    """
+    Hash texts to 64 bits, to detect the products whose text changed since their vector was computed.
+    Args:
+        texts: The texts
+
+    Returns: np.ndarray: One uint64 hash per text (never 0, which means unknown)
+
+    """
+    return np.array([int.from_bytes(hashlib.blake2b(str(text).encode(), digest_size=8).digest(), 'little') or 1
+                     for text in texts], dtype=np.uint64)
+
+
+def open_index(path: Optional[str], dim: int, model: str = '', nprobe: int = 8) -> VectorIndex:
+    """
+    Load the index saved at a path, or create an empty one when it doesn't exist or is unusable (other
+    model or dimension).
+    Args:
+        path: The .npz file of the index, None for an in-memory index
+        dim: The dimension of the vectors
+        model: The name of the model the vectors come from
+        nprobe: The number of groups scored per query
+
+    Returns: VectorIndex: The index
+
+    """
+    if path and os.path.exists(path):
+        try:
+            index = VectorIndex.load(path)
+            if index.dim == dim and index.model == model:
+                index.nprobe = nprobe
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error loading the vector index {path}: {e}")
+    return VectorIndex(dim, nprobe, model=model)
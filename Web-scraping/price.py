@@ -1,9 +1,12 @@
 from typing import Any
 
-from bs4 import BeautifulSoup, Comment
+from bs4 import BeautifulSoup, CData, Comment, NavigableString, Tag
 import re
 import cloudscraper
 
+# The strings get_text() reads (the same scoring as Web-driver-solution/dom_scan.find_product_container)
+_TEXT_TYPES = frozenset(getattr(Tag, 'MAIN_CONTENT_STRING_TYPES', (NavigableString, CData)))
+
 
 class DOMPriceExtractor:
     def __init__(self):
@@ -12,8 +15,8 @@ class DOMPriceExtractor:
         self.product_indicators = ['product', 'item', 'detail', 'main', 'content']
         self.price_pattern = r'\d{1,}(?:[\s.,]\d{3})*(?:[.,]\d+)?\s*?(?:DT|TND)'
 
-    def _get_node_weight(self, element) -> float:
-        """Calculate importance weight of a DOM node"""
+    def _get_node_weight(self, element, text_length: int, depth: int) -> float:
+        """Calculate importance weight of a DOM node, from its text length and depth"""
         weight = 1.0
 
         # Check element attributes
@@ -23,29 +26,48 @@ class DOMPriceExtractor:
                    indicator in ' '.join(element.get('class', [])).lower():
                     weight *= 1.5
 
-        # Check content size
-        text = element.get_text(strip=True)
-        weight *= min(len(text) / 100, 3)
-
-        # Check depth in DOM
-        depth = len([p for p in element.parents])
-        weight /= max(depth, 1)
-
+        weight *= min(text_length / 100, 3) # Check content size
+        weight /= max(depth, 1) # Check depth in DOM
         return weight
 
     def _find_product_container(self, soup) -> BeautifulSoup:
-        """Find the main product container using weighted scoring"""
-        candidates = soup.find_all(['div', 'section', 'article', 'main'])
+        """Find the main product container using weighted scoring, in one post-order traversal: the text
+        length of each candidate is summed from its children and its depth comes from the traversal"""
+        candidates = [] # [element, depth, text length] in document order
+        # Stack of (element, depth, parent frame) to enter, and of frames [text length, parent frame, candidate] to close
+        stack = [(child, 1, None) for child in reversed(soup.contents) if isinstance(child, Tag)]
+        while stack:
+            item = stack.pop()
+            if type(item) is list:
+                length, parent, candidate = item
+                if candidate is not None:
+                    candidate[2] = length
+                if parent is not None:
+                    parent[0] += length
+                continue
+            element, depth, parent = item
+            candidate = None
+            if element.name in ('div', 'section', 'article', 'main'):
+                candidate = [element, depth, 0]
+                candidates.append(candidate)
+            frame = [0, parent, candidate]
+            children = []
+            for child in element.contents:
+                if isinstance(child, Tag):
+                    children.append((child, depth + 1, frame))
+                elif type(child) in _TEXT_TYPES:
+                    frame[0] += len(child.strip())
+            stack.append(frame)
+            stack.extend(reversed(children))
+
         max_weight = 0
         main_container = None
-
-        for element in candidates:
-            weight = self._get_node_weight(element)
+        for element, depth, text_length in candidates:
+            weight = self._get_node_weight(element, text_length, depth)
             if weight > max_weight:
                 max_weight = weight
                 main_container = element
-
-        return  main_container or soup
+        return main_container or soup
     def get_price(self,soup):
         try:
             for a_tag in soup.find_all('a'):